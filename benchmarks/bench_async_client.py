@@ -0,0 +1,62 @@
+#!/usr/bin/env python
+"""
+Seeding users one request at a time with SCIMClient against fanning them out with
+AsyncSCIMClient, on a local stand-in SCIM server answering after a fixed latency
+
+    $ PYTHONPATH=. python benchmarks/bench_async_client.py [users]
+"""
+import asyncio
+import sys
+import time
+import uuid
+from datetime import datetime
+from standin_server import standin_server_process
+from sync_app.async_client import AsyncSCIMClient
+from sync_app.client import ClientConfiguration, SCIMClient
+from sync_app.scim.resource import ResourceMeta
+from sync_app.scim.user import User
+
+
+def make_user(i: int) -> User:
+    now = datetime.now()
+    return User(
+        meta=ResourceMeta("User", now, now, "http://example.com"),
+        user_id=uuid.uuid4(),
+        displayName=f"User {i}",
+        active=True,
+        userName=f"user{i}@example.com",
+        name=None,
+        emails=[],
+    )
+
+
+async def seed(config: ClientConfiguration, users, concurrency: int) -> None:
+    async with AsyncSCIMClient(config, concurrency) as client:
+        await client.create_users_many(users)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    users = [make_user(i) for i in range(count)]
+    latency = 0.02
+    with standin_server_process(latency=latency) as url:
+        config = ClientConfiguration(url, "token")
+
+        client = SCIMClient(config)
+        start = time.perf_counter()
+        for user in users:
+            client.create_user(user)
+        elapsed = time.perf_counter() - start
+        print(f"SCIMClient serial          {count / elapsed:>7.0f} users/s")
+
+        for concurrency in [4, 16, 64]:
+            start = time.perf_counter()
+            asyncio.run(seed(config, users, concurrency))
+            elapsed = time.perf_counter() - start
+            rate = count / elapsed
+            print(f"AsyncSCIMClient {concurrency:>3} at once {rate:>7.0f} users/s")
+    print(f"server latency {latency * 1e3:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
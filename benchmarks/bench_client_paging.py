@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""
+Pulling a whole tenant page by page with SCIMClient.get_users against iter_users,
+which fetches the next page while the current one is processed, from a local
+stand-in SCIM server answering after a fixed latency
+
+    $ PYTHONPATH=. python benchmarks/bench_client_paging.py [users]
+"""
+import json
+import sys
+import time
+from standin_server import standin_server_process
+from sync_app.client import ClientConfiguration, PageRequest, SCIMClient
+from sync_app.scim.user import User
+
+PAGE_SIZE = 100
+LATENCY = 0.05
+
+
+def process(user: User) -> None:
+    # stands in for whatever the caller does with each user
+    for _ in range(20):
+        json.dumps(user.to_dict())
+
+
+def pull_pages(client: SCIMClient) -> int:
+    pulled = 0
+    start_index = 1
+    while True:
+        page = client.get_users(page=PageRequest(start_index, PAGE_SIZE))
+        for user in page.resources:
+            process(user)
+        pulled += len(page.resources)
+        start_index += len(page.resources)
+        if not page.resources or start_index > page.totalResults:
+            return pulled
+
+
+def pull_iterator(client: SCIMClient) -> int:
+    pulled = 0
+    for user in client.iter_users(page_size=PAGE_SIZE):
+        process(user)
+        pulled += 1
+    return pulled
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with standin_server_process(latency=LATENCY, tenant_size=users) as url:
+        client = SCIMClient(ClientConfiguration(url, "token"))
+        pulls = [("get_users pages", pull_pages), ("iter_users", pull_iterator)]
+        for name, pull in pulls:
+            start = time.perf_counter()
+            assert pull(client) == users
+            elapsed = time.perf_counter() - start
+            print(f"{name:<16} {elapsed:>6.2f}s {users / elapsed:>7.0f} users/s")
+    print(f"{users} users, pages of {PAGE_SIZE}, server latency {LATENCY * 1e3:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+"""
+Compares filter parse time between the abnf grammar and the hand written parser
+
+    $ PYTHONPATH=. python benchmarks/bench_filter_parser.py
+"""
+import timeit
+from sync_app.parsers.python_filter import abnf_parse_filter
+from sync_app.parsers.filter_parser import parse_filter
+
+TYPICAL_IDP_FILTERS = [
+    'userName eq "bjensen@example.com"',
+    'externalId eq "00u1abcd2EFGH3ijk4x7"',
+    'displayName eq "Dunder Mifflin"',
+    'meta.lastModified gt "2011-05-13T04:42:34Z"',
+    'emails[type eq "work" and value co "@example.com"]',
+    'userName eq "a" or userName eq "b" or userName eq "c" or userName eq "d" and active eq true',
+]
+
+
+def measure(parse, filter: str, number: int) -> float:
+    return min(timeit.repeat(lambda: parse(filter), number=number, repeat=3)) / number
+
+
+def main():
+    print(f"{'filter':<60} {'abnf us':>10} {'native us':>10} {'speedup':>8}")
+    for filter in TYPICAL_IDP_FILTERS:
+        abnf = measure(abnf_parse_filter, filter, 20)
+        native = measure(parse_filter, filter, 2000)
+        print(f"{filter[:60]:<60} {abnf * 1e6:>10.1f} {native * 1e6:>10.1f} {abnf / native:>7.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+"""
+JournaledStore: loading and single creates with every change fsynced, creates from
+several threads sharing fsyncs, and recovery on reopening from the journal alone, from
+a snapshot, and from a snapshot and a journal tail of 1% of the store
+
+    $ PYTHONPATH=. python benchmarks/bench_journal.py [users ...]
+"""
+import gc
+import sys
+import tempfile
+import threading
+import time
+from bench_stores import BATCH, make_user
+from sync_app.journaled_store import JournaledStore
+from sync_app.scim.user import User
+
+THREADS = 8
+# large enough that no snapshot is taken unless asked for
+SNAPSHOT_EVERY = 10**9
+
+
+def concurrent_creates(store: JournaledStore, first: int, commit_delay: float) -> None:
+    store.journal.commit_delay = commit_delay
+    per_thread = 200
+    syncs = store.journal.syncs
+    threads = [
+        threading.Thread(
+            target=lambda offset: [
+                store.create(make_user(offset + i)) for i in range(per_thread)
+            ],
+            args=(first + t * per_thread,),
+        )
+        for t in range(THREADS)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    changes = THREADS * per_thread
+    print(
+        f"  {THREADS} threads creating, commit delay {commit_delay * 1e3:.0f}ms"
+        f"{changes / elapsed:10.0f} creates/s"
+        f" {(store.journal.syncs - syncs) / changes:6.2f} fsyncs/create"
+    )
+    store.journal.commit_delay = 0.0
+
+
+def reopen(directory: str, label: str) -> JournaledStore:
+    gc.collect()
+    start = time.perf_counter()
+    store = JournaledStore(User, directory, snapshot_every=SNAPSHOT_EVERY)
+    elapsed = time.perf_counter() - start
+    # the snapshot is read into memory in the background once the journal is replayed
+    store.loaded.wait()
+    loaded = time.perf_counter() - start
+    per_user = loaded / len(store.datastore) * 1e6
+    print(
+        f"  recovery from {label:<28} {elapsed:8.2f}s"
+        f" {loaded:6.2f}s loaded {per_user:6.1f} us/user"
+    )
+    return store
+
+
+def bench(size: int, directory: str) -> None:
+    print(f"JournaledStore, {size} users")
+    store = JournaledStore(User, directory, snapshot_every=SNAPSHOT_EVERY)
+    start = time.perf_counter()
+    for offset in range(0, size, BATCH):
+        end = min(size, offset + BATCH)
+        store.create_many([make_user(i) for i in range(offset, end)])
+    elapsed = time.perf_counter() - start
+    print(f"  load in batches of {BATCH} {elapsed / size * 1e6:33.1f} us/user")
+
+    extra = [make_user(size + i) for i in range(200)]
+    start = time.perf_counter()
+    for user in extra:
+        store.create(user)
+    elapsed = time.perf_counter() - start
+    print(f"  create, fsynced alone {elapsed / len(extra) * 1e6:35.1f} us/user")
+    for i, commit_delay in enumerate([0.0, 0.002]):
+        concurrent_creates(store, size + 1000 + i * 2000, commit_delay)
+    store.close()
+    del store
+
+    store = reopen(directory, "the journal")
+    start = time.perf_counter()
+    store.snapshot()
+    print(f"  snapshot {time.perf_counter() - start:47.2f}s")
+    store.close()
+    del store
+
+    store = reopen(directory, "a snapshot")
+    tail = size // 100
+    for offset in range(0, tail, BATCH):
+        users = range(size + 10_000 + offset, size + 10_000 + min(tail, offset + BATCH))
+        store.create_many([make_user(i) for i in users])
+    store.close()
+    del store
+
+    store = reopen(directory, "a snapshot and a 1% tail")
+    store.close()
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [100_000]
+    for size in sizes:
+        with tempfile.TemporaryDirectory(dir=".") as directory:
+            bench(size, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Memory taken by users built with User.from_dict, each with two emails, a name and
+group refs out of a tenant of GROUP_COUNT groups, and the time from_dict takes. Each
+size is measured in a process of its own, memory is the growth of the process'
+anonymous resident memory while the users are built. Users are built out of freshly
+decoded JSON, so values repeated across users are only shared if from_dict shares them.
+
+    $ PYTHONPATH=. python benchmarks/bench_memory.py [--groups refs] [users ...]
+"""
+import gc
+import json
+import subprocess
+import sys
+import time
+import uuid
+from typing import List, Mapping
+from sync_app.scim.resource import resource_refs
+from sync_app.scim.user import User
+
+# group refs per user, unless given with --groups
+GROUPS = 20
+GROUP_COUNT = 1000
+
+
+def anonymous_rss() -> int:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError("RssAnon is missing from /proc/self/status")
+
+
+def resource(i: int, groups: int) -> Mapping:
+    """What a client would send, made of strings of its own like freshly decoded JSON"""
+    return decoded({
+        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+        "id": str(uuid.uuid4()),
+        "externalId": f"ext-{i:07}",
+        "meta": {
+            "resourceType": "User",
+            "created": "2024-01-01 00:00:00",
+            "lastModified": f"2024-01-01 00:00:{i % 60:02}",
+            "location": f"https://example.com/v2/Users/{i}",
+        },
+        "userName": f"user{i:07}",
+        "displayName": f"User {i}",
+        "active": True,
+        "name": {"givenName": f"Given{i}", "familyName": f"Family{i}"},
+        "emails": [
+            {"value": f"user{i:07}@work.example", "type": "work", "primary": True},
+            {"value": f"user{i:07}@home.example", "type": "home"},
+        ],
+        "groups": [group_ref((i + g * 37) % GROUP_COUNT) for g in range(groups)],
+    })
+
+
+def decoded(resource: Mapping) -> Mapping:
+    return json.loads(json.dumps(resource))
+
+
+def group_ref(n: int) -> Mapping:
+    id = str(uuid.UUID(int=n))
+    return {
+        "value": id,
+        "$ref": f"https://example.com/v2/Groups/{id}",
+        "display": f"Group {n}",
+    }
+
+
+def measure(size: int, groups: int) -> None:
+    gc.collect()
+    before = anonymous_rss()
+    elapsed = 0.0
+    users: List[User] = []
+    for i in range(size):
+        r = resource(i, groups)
+        start = time.perf_counter()
+        users.append(User.from_dict(r))
+        elapsed += time.perf_counter() - start
+    gc.collect()
+    print(f"  from_dict {elapsed / size * 1e6:10.1f} us/user")
+    print(f"  memory {(anonymous_rss() - before) / size:13.0f} B/user")
+    print(f"  shared group refs {len(resource_refs):6}")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "measure":
+        measure(int(sys.argv[2]), int(sys.argv[3]))
+        return
+
+    arguments = sys.argv[1:]
+    groups = GROUPS
+    if arguments[:1] == ["--groups"]:
+        groups = int(arguments[1])
+        arguments = arguments[2:]
+    for size in [int(size) for size in arguments] or [100_000]:
+        print(f"{size} users, {groups} group refs each", flush=True)
+        command = [sys.executable, __file__, "measure", str(size), str(groups)]
+        subprocess.run(command, check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+"""
+Restarting a JournaledStore from a JSON lines snapshot, which parses every record up
+front, against restarting one from an mmapped binary snapshot, which serves records as
+they are asked for while the rest are read in the background: time to start, lookups
+by id and userName while hydrating, the time until every record is in memory, and the
+resident memory after each. Every measurement runs in a process of its own.
+
+    $ PYTHONPATH=. python benchmarks/bench_mmap_snapshot.py [users ...]
+"""
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from bench_stores import make_user
+from sync_app.journaled_store import JournaledStore, encode
+from sync_app.mmap_snapshot import key_attributes, write_snapshot
+from sync_app.scim.user import User
+
+SAMPLE = 1000
+SNAPSHOT = "users.00000000.snapshot"
+
+
+def memory() -> str:
+    """Resident memory of this process, anonymous and mapped from files"""
+    sizes = {}
+    with open("/proc/self/status") as status:
+        for line in status:
+            name, _, value = line.partition(":")
+            if name in ["RssAnon", "RssFile"]:
+                sizes[name] = int(value.split()[0]) / 1024
+    return f"RSS {sizes['RssAnon']:6.0f} MB anonymous {sizes['RssFile']:5.0f} MB file"
+
+
+def report(label: str, seconds: float, per: str = "") -> None:
+    scaled = f"{seconds * 1e6:7.1f} us/{per:<6}" if per else f"{seconds:7.2f} s{'':8}"
+    print(f"  {label:<28} {scaled} {memory()}", flush=True)
+
+
+def write(directory: str, size: int) -> None:
+    users = [make_user(i) for i in range(size)]
+    for kind in ["json", "mmap"]:
+        os.makedirs(os.path.join(directory, kind))
+    start = time.perf_counter()
+    with open(os.path.join(directory, "json", SNAPSHOT), "wb") as file:
+        for user in users:
+            file.write(encode(user.to_dict()))
+    elapsed = time.perf_counter() - start
+    print(f"  {'write JSON lines snapshot':<28} {elapsed:7.2f} s", flush=True)
+
+    start = time.perf_counter()
+    path = os.path.join(directory, "mmap", SNAPSHOT)
+    write_snapshot(path, users, key_attributes(User))
+    elapsed = time.perf_counter() - start
+    print(f"  {'write binary snapshot':<28} {elapsed:7.2f} s", flush=True)
+
+    sample = random.sample(users, min(SAMPLE, size))
+    with open(os.path.join(directory, "sample.json"), "w") as file:
+        json.dump([[str(u.id), u.userName] for u in sample], file)
+
+
+def start_json(directory: str) -> None:
+    report("before starting", 0)
+    start = time.perf_counter()
+    store = JournaledStore(User, os.path.join(directory, "json"))
+    report("start from JSON lines", time.perf_counter() - start)
+    store.close()
+
+
+def start_mmap(directory: str) -> None:
+    with open(os.path.join(directory, "sample.json")) as file:
+        sample = [(uuid.UUID(id), userName) for id, userName in json.load(file)]
+    report("before starting", 0)
+    start = time.perf_counter()
+    store = JournaledStore(User, os.path.join(directory, "mmap"))
+    report("start from binary snapshot", time.perf_counter() - start)
+
+    # the first lookups race the records being read into memory behind them
+    for label in ["get_by_id, first touch", "get_by_id, touched before"]:
+        lookups = time.perf_counter()
+        for id, _ in sample:
+            store.get_by_id(id)
+        report(label, (time.perf_counter() - lookups) / len(sample), "get")
+    lookups = time.perf_counter()
+    for _, userName in sample:
+        store.lookup("userName", userName)
+    report("lookup userName", (time.perf_counter() - lookups) / len(sample), "get")
+
+    store.loaded.wait()
+    report("hydrated in the background", time.perf_counter() - start)
+    store.close()
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] in ["write", "json", "mmap"]:
+        command, directory = sys.argv[1:3]
+        if command == "write":
+            write(directory, int(sys.argv[3]))
+        else:
+            {"json": start_json, "mmap": start_mmap}[command](directory)
+        return
+
+    sizes = [int(size) for size in sys.argv[1:]] or [100_000]
+    for size in sizes:
+        print(f"{size} users")
+        with tempfile.TemporaryDirectory(dir=".") as directory:
+            for command in ["write", "json", "mmap"]:
+                arguments = [sys.executable, __file__, command, directory, str(size)]
+                subprocess.run(arguments, check=True)
+
+
+if __name__ == "__main__":
+    main()
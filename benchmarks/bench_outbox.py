@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Sustained enqueue and drain rates of the durable outbox against a local stand-in
+downstream SCIM server, sending each change on its own and batched through /Bulk
+
+    $ PYTHONPATH=. python benchmarks/bench_outbox.py [changes]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime
+from typing import Optional
+from standin_server import standin_server_process
+from sync_app.outbox import Outbox, OutboxDispatcher
+from sync_app.scim.bulk import BulkLimits
+from sync_app.scim.resource import ResourceMeta
+from sync_app.scim.user import User
+from sync_app.server import SCIMServer, ServerConfiguration
+
+
+def make_user(i: int) -> User:
+    now = datetime.now()
+    return User(
+        meta=ResourceMeta("User", now, now, "http://example.com"),
+        user_id=uuid.uuid4(),
+        displayName=f"User {i}",
+        active=True,
+        userName=f"user{i}@example.com",
+        name=None,
+        emails=[],
+    )
+
+
+async def run(
+    changes: int,
+    workers: int,
+    failure_rate: float,
+    latency: float,
+    bulk: Optional[BulkLimits],
+) -> None:
+    with standin_server_process(failure_rate, latency) as url:
+        await deliver(url, changes, workers, failure_rate, latency, bulk)
+
+
+async def deliver(
+    url: str,
+    changes: int,
+    workers: int,
+    failure_rate: float,
+    latency: float,
+    bulk: Optional[BulkLimits],
+) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        server = SCIMServer(ServerConfiguration(url, "token"))
+        outbox = Outbox(os.path.join(directory, "outbox.sqlite3"))
+        dispatcher = OutboxDispatcher(
+            outbox, server, workers=workers, base_delay=0.01, bulk=bulk
+        )
+        users = [make_user(i) for i in range(changes)]
+
+        start = time.perf_counter()
+        for user in users:
+            dispatcher.handle_resource_change("add", user)
+        enqueue = time.perf_counter() - start
+
+        start = time.perf_counter()
+        await dispatcher.start()
+        await dispatcher.drain()
+        drain = time.perf_counter() - start
+        await dispatcher.stop()
+        stats = dispatcher.stats()
+        connections = server.session.stats.to_dict()
+        outbox.close()
+
+    batch = bulk.max_operations if bulk is not None else 1
+    print(
+        f"batch {batch:>4} workers {workers:>2} latency {latency * 1e3:>3.0f}ms failures {failure_rate:>4.0%}"
+        f"   enqueue {changes / enqueue:>8.0f}/s"
+        f"   drain {changes / drain:>7.0f}/s"
+        f"   delivered {stats['delivered']} retried {stats['retried']}"
+        f"   connections reused {connections['reuse_rate']:.1%}"
+    )
+
+
+def main():
+    changes = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    for workers, latency, failure_rate, bulk in [
+        (1, 0.0, 0.0, None),
+        (8, 0.0, 0.0, None),
+        (1, 0.02, 0.0, None),
+        (8, 0.02, 0.0, None),
+        (8, 0.02, 0.1, None),
+        (1, 0.02, 0.0, BulkLimits(100)),
+        (8, 0.02, 0.0, BulkLimits(100)),
+        (8, 0.02, 0.1, BulkLimits(100)),
+        (8, 0.02, 0.0, BulkLimits(1000)),
+    ]:
+        asyncio.run(run(changes, workers, failure_rate, latency, bulk))
+
+
+if __name__ == "__main__":
+    main()
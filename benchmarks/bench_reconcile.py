@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Reconciling two local stand-in SCIM servers answering after a fixed latency: an
+initial sync into an empty target, one after the two have drifted apart, and one where
+nothing has changed, with the peak memory the last one allocates
+
+    $ PYTHONPATH=. python benchmarks/bench_reconcile.py [users]
+"""
+import sys
+import time
+import tracemalloc
+from standin_server import standin_server_process
+from sync_app.client import ClientConfiguration, SCIMClient
+from sync_app.http_session import PoolConfiguration
+from sync_app.reconcile import Reconciler
+from sync_app.scim.patchop import Operation, PatchOp
+
+CONCURRENCY = 16
+
+
+def client(url: str) -> SCIMClient:
+    pool = PoolConfiguration(connections_per_host=CONCURRENCY)
+    return SCIMClient(ClientConfiguration(url, "token", pool))
+
+
+def reconcile(source: SCIMClient, target: SCIMClient, label: str, **options):
+    start = time.perf_counter()
+    report = Reconciler(source, target, **options).reconcile_users()
+    elapsed = time.perf_counter() - start
+    print(
+        f"{label:<26} {elapsed:>6.2f}s  scanned {report.scanned:>6}"
+        f"  created {report.created:>6}  patched {report.patched:>5}"
+        f"  deleted {report.deleted:>5}  skipped {report.skipped:>6}"
+        f"  failed {report.failed}"
+    )
+    return report
+
+
+def drift(source: SCIMClient, target: SCIMClient) -> None:
+    """Renames 5% of the source's users and deletes 2% of the target's"""
+    users = list(source.iter_users(page_size=500))
+    for user in users[::20]:
+        rename = PatchOp([Operation("replace", "displayName", f"{user.userName}!")])
+        source.update_user(str(user.id), rename)
+    for user in list(target.iter_users(page_size=500))[1::50]:
+        target.delete_user(str(user.id))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    latency = 0.005
+    with standin_server_process(latency=latency, tenant_size=count) as source_url:
+        source = client(source_url)
+        for concurrency in [1, CONCURRENCY]:
+            with standin_server_process(latency=latency) as target_url:
+                target = client(target_url)
+                reconcile(
+                    source,
+                    target,
+                    f"initial, {concurrency} at once",
+                    concurrency=concurrency,
+                )
+
+        # the last target is gone with its process, sync a fresh one to drift from
+        with standin_server_process(latency=latency) as target_url:
+            target = client(target_url)
+            reconcile(source, target, "initial", concurrency=CONCURRENCY)
+            drift(source, target)
+            reconcile(source, target, "drifted, dry run", dry_run=True)
+            reconcile(source, target, "drifted", concurrency=CONCURRENCY)
+
+            tracemalloc.start()
+            reconcile(source, target, "unchanged", concurrency=CONCURRENCY)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"unchanged peak memory {peak / 1e6:.1f}MB, {peak / count:.0f}B/user")
+    print(f"{count} users, server latency {latency * 1e3:.0f}ms")
+
+
+if __name__ == "__main__":
+    main()
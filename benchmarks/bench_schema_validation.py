@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""
+Per request validation cost of a User with jsonschema.validate versus the validators
+ResourceValidator builds once at load time
+
+    $ PYTHONPATH=. python benchmarks/bench_schema_validation.py
+"""
+import os
+import timeit
+import jsonschema
+from sync_app.schema import ResourceValidator, COMMON_SCHEMA
+
+SCHEMA_DIRECTORY = os.path.join(os.path.dirname(__file__), "..", "schemas")
+
+USER = {
+    "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+    "id": "2819c223-7f76-453a-919d-413861904646",
+    "userName": "bjensen@example.com",
+    "name": {"givenName": "Barbara", "familyName": "Jensen"},
+    "emails": [{"value": "bjensen@example.com", "type": "work", "primary": True}],
+    "meta": {
+        "resourceType": "User",
+        "created": "2010-01-23T04:56:22Z",
+        "lastModified": "2011-05-13T04:42:34Z",
+        "version": "",
+        "location": "https://example.com/v2/Users/2819c223-7f76-453a-919d-413861904646",
+    },
+}
+
+
+def validate_uncached(validator: ResourceValidator, resource) -> None:
+    # what ResourceValidator.validate used to do for every request
+    for schema_id in resource["schemas"] + [COMMON_SCHEMA]:
+        jsonschema.validate(resource, validator.schemas[schema_id].schema)
+
+
+def main():
+    validator = ResourceValidator.load(
+        [
+            os.path.join(SCHEMA_DIRECTORY, f)
+            for f in ["common.schema.json", "user.schema.json", "schemas.schema.json"]
+        ]
+    )
+    number = 500
+    uncached = min(
+        timeit.repeat(lambda: validate_uncached(validator, USER), number=number, repeat=3)
+    )
+    cached = min(
+        timeit.repeat(lambda: validator.validate(USER), number=number, repeat=3)
+    )
+    print(f"jsonschema.validate per request  {uncached / number * 1e6:8.1f} us")
+    print(f"prebuilt validators per request  {cached / number * 1e6:8.1f} us")
+    print(f"speedup                          {uncached / cached:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+"""
+Time to serve the first page of a sorted user listing, from the store's sorted indexes
+versus sorting every record per request, and what keeping those indexes adds to each
+create once the store holds that many users
+
+    $ PYTHONPATH=. python benchmarks/bench_sorted_listing.py [users]
+"""
+import sys
+import time
+import uuid
+from datetime import datetime
+from sync_app.handlers.common import QueryParameters, list_resources, sort_records
+from sync_app.memory_store import MemoryStore
+from sync_app.scim.resource import ResourceMeta
+from sync_app.scim.user import User
+
+
+# creates timed once the store is full
+CREATES = 10_000
+
+
+def make_user(userName: str) -> User:
+    now = datetime.now()
+    return User(
+        meta=ResourceMeta("User", now, now, "http://example.com"),
+        user_id=uuid.uuid4(),
+        displayName=None,
+        active=True,
+        userName=userName,
+        name=None,
+        emails=[],
+    )
+
+
+def populate(size: int) -> MemoryStore[User]:
+    store = MemoryStore[User]()
+    for i in range(size):
+        store.create(make_user(f"user{(i * 7919) % size:07}"))
+    return store
+
+
+def measure(run, number: int) -> float:
+    best = float("inf")
+    for _ in range(number):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    start = time.perf_counter()
+    store = populate(size)
+    print(f"indexed {size} users in {time.perf_counter() - start:.1f}s")
+
+    # userNames which land all over the userName index rather than at its end
+    users = [make_user(f"user{i:07}x") for i in range(0, size, max(1, size // CREATES))]
+    start = time.perf_counter()
+    for user in users:
+        store.create(user)
+    elapsed = time.perf_counter() - start
+    print(f"create at {size} users {elapsed / len(users) * 1e6:8.1f} us")
+    for user in users:
+        store.delete_by_id(user.id)
+
+    for order in ["ascending", "descending"]:
+        parameters = QueryParameters(sort_by="userName", sort_order=order, count=100)
+        indexed = measure(lambda: list_resources(store, parameters).to_dict(), 20)
+        full_sort = measure(
+            lambda: sort_records(store.get_all(), "userName", order == "ascending")[:100],
+            3,
+        )
+        print(
+            f"{order:<10} first page indexed {indexed * 1e3:8.2f} ms"
+            f"   sorted() per request {full_sort * 1e3:8.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
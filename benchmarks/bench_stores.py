@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+"""
+MemoryStore against SqliteStore: loading, single creates, gets by id, listing pages and
+filtering, at each of the given store sizes
+
+    $ PYTHONPATH=. python benchmarks/bench_stores.py [users ...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import List
+from sync_app import query_planner
+from sync_app.memory_store import MemoryStore
+from sync_app.scim.resource import ResourceMeta
+from sync_app.scim.user import Email, User
+from sync_app.sqlite_store import SqliteStore
+
+BATCH = 10_000
+START = datetime(2024, 1, 1)
+
+
+def filters(size: int) -> List[str]:
+    def modified_after(fraction: float) -> str:
+        after = START + timedelta(milliseconds=size * (1 - fraction))
+        return f'meta.lastModified gt "{after.isoformat()}Z"'
+
+    return [
+        'userName eq "user0012345"',
+        'emails.value eq "user0012345@home.example"',
+        'userName sw "user00123"',
+        'displayName eq "Team 42"',
+        # the newest 1% and 50% of users
+        modified_after(0.01),
+        modified_after(0.5),
+        'active eq false and externalId eq "ext-0012345"',
+    ]
+
+
+def make_user(i: int) -> User:
+    modified = START + timedelta(milliseconds=i)
+    return User(
+        meta=ResourceMeta("User", START, modified, "http://example.com"),
+        user_id=uuid.uuid4(),
+        displayName=f"Team {i % 1000}",
+        active=i % 2 == 0,
+        userName=f"user{i:07}",
+        name=None,
+        emails=[Email(value=f"user{i:07}@home.example", type="home")],
+        externalId=f"ext-{i:07}",
+    )
+
+
+def measure(run, number: int = 3) -> float:
+    best = float("inf")
+    for _ in range(number):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+        if best > 2:
+            break
+    return best
+
+
+def report(label: str, seconds: float, per: str = "") -> None:
+    if per:
+        print(f"  {label:<48} {seconds * 1e6:10.1f} us/{per}")
+    else:
+        print(f"  {label:<48} {seconds * 1e3:10.2f} ms")
+
+
+def bench(name: str, store, size: int) -> None:
+    print(f"{name}, {size} users")
+    start = time.perf_counter()
+    for offset in range(0, size, BATCH):
+        end = min(size, offset + BATCH)
+        store.create_many([make_user(i) for i in range(offset, end)])
+    report("load in batches of 10000", (time.perf_counter() - start) / size, "user")
+
+    extra = [make_user(size + i) for i in range(1000)]
+    start = time.perf_counter()
+    for user in extra:
+        store.create(user)
+    report("create", (time.perf_counter() - start) / len(extra), "user")
+
+    ids = [u.id for u in store.get_page(random.randrange(size - 10_000), 10_000)[1]]
+    random.shuffle(ids)
+    start = time.perf_counter()
+    for id in ids:
+        store.get_by_id(id)
+    report("get_by_id", (time.perf_counter() - start) / len(ids), "get")
+
+    for start_index in [1, size // 2]:
+        seconds = measure(lambda: store.get_page(start_index, 100))
+        report(f"get_page of 100 from {start_index}", seconds)
+    seconds = measure(lambda: store.get_sorted_page("userName", False, 1, 100))
+    report("get_sorted_page of 100 by userName", seconds)
+
+    for filter in filters(size):
+        strategy = query_planner.plan_query(store, filter).strategy
+        matched: list = []
+        run = lambda: matched.append(len(query_planner.filter_records(store, filter)))
+        seconds = measure(run)
+        label = f"{filter[:26]}..{filter[-12:]}" if len(filter) > 40 else filter
+        report(f"{label:<36} {strategy:>5} {matched[0]:>7}", seconds)
+
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [100_000]
+    for size in sizes:
+        bench("MemoryStore", MemoryStore[User](), size)
+        with tempfile.TemporaryDirectory() as directory:
+            store = SqliteStore(User, os.path.join(directory, "store.sqlite3"))
+            bench("SqliteStore", store, size)
+            store.close()
+
+
+if __name__ == "__main__":
+    main()
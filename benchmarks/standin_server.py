@@ -0,0 +1,327 @@
+#!/usr/bin/env python
+"""
+Minimal local stand-in for a downstream SCIM server, for benchmarking delivery
+
+Accepts POST /Users, POST /Groups and PUT, PATCH or DELETE to /Users/<id> or
+/Groups/<id>, failing a configurable fraction of them with 503 and Retry-After, and
+keeps what they write in memory. POST /Bulk takes the same changes batched into a
+BulkRequest, where each operation can fail on its own, and doesn't keep them. GET
+/Users and /Groups page through what is kept, which starts out as a synthetic tenant of
+--tenant-size users.
+
+    $ python benchmarks/standin_server.py --port 8089 --failure-rate 0.1
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Mapping, Optional, Tuple
+
+
+class StandinSCIMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # async clients open all their connections at once, the default of 5 resets some
+    request_queue_size = 128
+
+    def __init__(
+        self,
+        address: Tuple[str, int],
+        failure_rate: float = 0.0,
+        retry_after: float = 0.0,
+        latency: float = 0.0,
+        tenant_size: int = 0,
+    ):
+        super().__init__(address, StandinHandler)
+        self.failure_rate = failure_rate
+        self.retry_after = retry_after
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.received = 0
+        self.rejected = 0
+        self.bulk_requests = 0
+        # endpoint -> id -> resource, in the order they were created
+        self.resources: Dict[str, Dict[str, dict]] = {"Users": {}, "Groups": {}}
+        for i in range(tenant_size):
+            user = tenant_user(i)
+            self.resources["Users"][user["id"]] = user
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    server: StandinSCIMServer
+    # keep-alive, so clients which reuse connections can
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, without this the body waits on
+    # the client's delayed ACK of the headers on every reused connection
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status: int, body=None, headers=None):
+        payload = json.dumps(body).encode() if body is not None else b""
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Type", "application/scim+json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def read_body(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length)) if length else None
+
+    def reject(self) -> bool:
+        with self.server.lock:
+            if random.random() < self.server.failure_rate:
+                self.server.rejected += 1
+                return True
+            self.server.received += 1
+            return False
+
+    def target(self) -> Tuple[Optional[Dict[str, dict]], Optional[str]]:
+        """The resources at the endpoint the request is for, and the id in its path"""
+        parts = urllib.parse.urlsplit(self.path).path.strip("/").split("/")
+        resources = self.server.resources.get(parts[0], None)
+        return resources, parts[1] if len(parts) > 1 else None
+
+    def handle_change(self, status: int):
+        body = self.read_body() or {}
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.reject():
+            self.respond(503, headers={"Retry-After": str(self.server.retry_after)})
+            return
+
+        resources, id = self.target()
+        if resources is None:
+            self.respond(404)
+            return
+        with self.server.lock:
+            if self.command == "POST":
+                resource = dict(body, id=body.get("id", str(uuid.uuid4())))
+            elif id not in resources and self.command == "PATCH":
+                resource = None
+            elif self.command == "PATCH":
+                resource = apply_patch(resources[id], body.get("Operations", []))
+            else:
+                resource = dict(body, id=id)
+            if resource is not None:
+                resources[resource["id"]] = resource
+        if resource is None:
+            self.respond(404)
+        else:
+            self.respond(status, resource)
+
+    def handle_bulk(self):
+        body = self.read_body() or {}
+        # one round trip, however many operations it carries
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.bulk_requests += 1
+
+        results = []
+        for operation in body.get("Operations", []):
+            result = {"method": operation["method"]}
+            if "bulkId" in operation:
+                result["bulkId"] = operation["bulkId"]
+            if self.reject():
+                result["status"] = "503"
+            elif operation["method"] == "POST":
+                id = str(uuid.uuid4())
+                result["status"] = "201"
+                result["location"] = f"{self.server.url}{operation['path']}/{id}"
+            else:
+                result["status"] = "200"
+                result["location"] = f"{self.server.url}{operation['path']}"
+            results.append(result)
+
+        self.respond(
+            200,
+            {
+                "schemas": ["urn:ietf:params:scim:api:messages:2.0:BulkResponse"],
+                "Operations": results,
+            },
+        )
+
+    def do_POST(self):
+        if self.path == "/Bulk":
+            self.handle_bulk()
+        else:
+            self.handle_change(201)
+
+    def do_GET(self):
+        resources, id = self.target()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if resources is None:
+            self.respond(404)
+            return
+        if id is not None:
+            with self.server.lock:
+                resource = resources.get(id, None)
+            self.respond(404 if resource is None else 200, resource)
+            return
+
+        query = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+        start_index = int(query.get("startIndex", ["1"])[0])
+        count = int(query.get("count", ["20"])[0])
+        with self.server.lock:
+            total = len(resources)
+            page = list(
+                itertools.islice(
+                    resources.values(), start_index - 1, start_index - 1 + count
+                )
+            )
+        self.respond(
+            200,
+            {
+                "schemas": ["urn:ietf:params:scim:api:messages:2.0:ListResponse"],
+                "totalResults": total,
+                "startIndex": start_index,
+                "itemsPerPage": len(page),
+                "Resources": page,
+            },
+        )
+
+    def do_PUT(self):
+        self.handle_change(200)
+
+    def do_PATCH(self):
+        self.handle_change(200)
+
+    def do_DELETE(self):
+        resources, id = self.target()
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            found = resources is not None and resources.pop(id, None) is not None
+        self.respond(204 if found else 404)
+
+
+FILTERED_PATH = re.compile(r'^(\w+)\[value eq "(.*)"\]$')
+
+
+def apply_patch(resource: dict, operations: List[Mapping]) -> dict:
+    """
+    Applies the operations PatchOp.from_diff makes: paths are an attribute, a
+    sub-attribute or a multi-valued attribute filtered by value
+    """
+    resource = json.loads(json.dumps(resource))
+    for operation in operations:
+        op, path = operation["op"].lower(), operation["path"]
+        value = operation.get("value", None)
+        filtered = FILTERED_PATH.match(path)
+        if filtered is not None:
+            name, removed = filtered.groups()
+            items = resource.get(name, [])
+            resource[name] = [item for item in items if item.get("value") != removed]
+            continue
+
+        parent, _, name = path.rpartition(".")
+        target = resource.setdefault(parent, {}) if parent else resource
+        if op == "remove":
+            target.pop(name, None)
+        elif op == "add" and isinstance(value, list):
+            target[name] = target.get(name, []) + value
+        else:
+            target[name] = value
+    return resource
+
+
+def tenant_user(i: int) -> dict:
+    return {
+        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+        "id": str(uuid.UUID(int=i)),
+        "userName": f"user{i}@example.com",
+        "displayName": f"User {i}",
+        "active": True,
+        "emails": [{"value": f"user{i}@example.com", "type": "work", "primary": True}],
+        "meta": {
+            "resourceType": "User",
+            "created": "2024-01-01 00:00:00",
+            "lastModified": "2024-01-01 00:00:00",
+            "location": f"/Users/{uuid.UUID(int=i)}",
+        },
+    }
+
+
+def start_standin_server(port: int = 0, **options) -> StandinSCIMServer:
+    server = StandinSCIMServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@contextlib.contextmanager
+def standin_server_process(
+    failure_rate: float = 0.0, latency: float = 0.0, tenant_size: int = 0
+) -> Iterator[str]:
+    """
+    Runs the stand-in in its own process, so it does not compete with the client being
+    measured for the GIL, and yields its url
+    """
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            os.path.abspath(__file__),
+            "--port",
+            str(port),
+            "--failure-rate",
+            str(failure_rate),
+            "--latency",
+            str(latency),
+            "--tenant-size",
+            str(tenant_size),
+        ],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    try:
+        assert process.stdout is not None
+        process.stdout.readline()  # wait until it is listening
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        process.terminate()
+        process.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.0)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--tenant-size", type=int, default=0)
+    arguments = parser.parse_args()
+
+    server = start_standin_server(
+        arguments.port,
+        failure_rate=arguments.failure_rate,
+        retry_after=arguments.retry_after,
+        latency=arguments.latency,
+        tenant_size=arguments.tenant_size,
+    )
+    print(f"stand-in SCIM server listening on {server.url}", flush=True)
+    threading.Event().wait()
@@ -1,3 +1,6 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from sync_app.async_client import AsyncSCIMClient
 from sync_app.client import ClientConfiguration, SCIMClient
 from sync_app.scim.patchop import PatchOp, Operation
 from sync_app.scim.user import User, Name, Email
@@ -6,7 +9,7 @@ from sync_app.scim.resource import ResourceMeta
 from uuid import uuid5, NAMESPACE_X500
 
 
-def create_user_with_group(name, group, client):
+def make_user_with_group(name, group):
     first_name = name.split()[0].capitalize()
     last_name = name.split()[1].capitalize()
     uuid = uuid5(
@@ -37,7 +40,11 @@ def create_user_with_group(name, group, client):
         ],
         groups=[group],
     )
-    response = client.create_user(new_user)
+    return new_user
+
+
+def create_user_with_group(name, group, client):
+    response = client.create_user(make_user_with_group(name, group))
     return response.to_dict()
 
 
@@ -88,10 +95,23 @@ def course_setup(auth_token):
         "Kelly Kapoor",
         "Toby Flenderson",
     ]
-    user_ids = {}
 
-    for user in users:
-        response = create_user_with_group(user, group, scim_dev_client)
-        user_ids[user] = response["id"]
+    # the users do not depend on each other, so they are created concurrently, on an
+    # event loop of its own since the notebook already runs one on this thread
+    async def create_users():
+        async with AsyncSCIMClient(
+            scim_dev_client_config,
+            scim_dev_client_config.pool.connections_per_host,
+        ) as client:
+            return await client.create_users_many(
+                make_user_with_group(user, group) for user in users
+            )
+
+    with ThreadPoolExecutor(1) as executor:
+        created_users = executor.submit(asyncio.run, create_users()).result()
+    user_ids = {
+        user: created_user.to_dict()["id"]
+        for user, created_user in zip(users, created_users)
+    }
 
     return group_id, user_ids
@@ -1,25 +1,50 @@
 #!/usr/bin/env python
 
+import asyncio
 import traceback
 from quart import (
     Quart,
+    Response,
     request,
     jsonify,
 )
 from quart.typing import ResponseValue
+from quart.wrappers.response import IterableBody
 import os
 import toml
 from sync_app.schema import ResourceValidator
 from sync_app.scim.user import User
 from sync_app.scim.group import Group
-from sync_app.handlers import users, groups, common
+from sync_app.handlers import users, groups, common, bulk
 from sync_app import exceptions
+from sync_app.journaled_store import DEFAULT_SNAPSHOT_EVERY, JournaledStore
 from sync_app.memory_store import MemoryStore, ObjectAlreadyInStore, ObjectNotFound
+from sync_app.sqlite_store import SqliteStore
+from sync_app.store import Store
 from sync_app.server import ServerConfiguration, SCIMServer
-from typing import Mapping, Tuple
+from sync_app.http_session import (
+    PoolConfiguration,
+    DEFAULT_CONNECTIONS_PER_HOST,
+    DEFAULT_CONNECT_TIMEOUT,
+    DEFAULT_READ_TIMEOUT,
+)
+from sync_app.scim.bulk import BulkLimits
+from sync_app.scim.service_provider_config import ServiceProviderConfig
+from sync_app.dispatcher import ChangeDispatcher, DEFAULT_WORKERS
+from sync_app.outbox import (
+    Outbox,
+    OutboxDispatcher,
+    DEFAULT_OUTBOX_PATH,
+    DEFAULT_COALESCE_WINDOW,
+)
+from sync_app.parsers.python_filter import set_filter_parser, DEFAULT_FILTER_PARSER
+from typing import Iterable, Mapping, Tuple, Union
 
 app = Quart(__name__)
 config = toml.load(os.path.join(os.path.dirname(__file__), "..", "configuration.toml"))
+set_filter_parser(config.get("filter_parser", DEFAULT_FILTER_PARSER))
+# send list responses as they are serialized instead of building them in memory
+stream_list_responses = config.get("stream_list_responses", False)
 validator = ResourceValidator.load(
     [
         os.path.join(os.path.dirname(__file__), "..", "schemas", f)
@@ -35,34 +60,165 @@ validator = ResourceValidator.load(
         ]
     ]
 )
-user_store = MemoryStore[User]()
-group_store = MemoryStore[Group]()
-scim_server = SCIMServer(
-    ServerConfiguration(config["outbound_server_url"], config["auth_token"])
+# users and groups are kept in memory and lost on restart unless store_path is set,
+# to keep them in SQLite, or journal_directory, to keep them in memory and journal them
+store_path = config.get("store_path", "")
+journal_directory = config.get("journal_directory", "")
+user_store: Store[User]
+group_store: Store[Group]
+if store_path:
+    user_store = SqliteStore(User, store_path)
+    group_store = SqliteStore(Group, store_path)
+elif journal_directory:
+    snapshot_every = config.get("snapshot_every", DEFAULT_SNAPSHOT_EVERY)
+    # seconds a write waits for others to share its fsync, see journaled_store.Journal
+    commit_delay = config.get("journal_commit_delay", 0.0)
+    user_store = JournaledStore(
+        User,
+        journal_directory,
+        snapshot_every=snapshot_every,
+        commit_delay=commit_delay,
+    )
+    group_store = JournaledStore(
+        Group,
+        journal_directory,
+        snapshot_every=snapshot_every,
+        commit_delay=commit_delay,
+    )
+else:
+    user_store = MemoryStore[User]()
+    group_store = MemoryStore[Group]()
+downstream_workers = config.get("downstream_workers", DEFAULT_WORKERS)
+downstream_pool = PoolConfiguration(
+    hosts=1,
+    # enough for every worker to keep its connection open
+    connections_per_host=max(downstream_workers, DEFAULT_CONNECTIONS_PER_HOST),
+    connect_timeout=config.get("downstream_connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+    read_timeout=config.get("downstream_read_timeout", DEFAULT_READ_TIMEOUT),
+)
+downstream = SCIMServer(
+    ServerConfiguration(
+        config["outbound_server_url"], config["auth_token"], downstream_pool
+    )
+)
+# handlers only journal or queue changes, the dispatcher's workers send them downstream
+# an empty outbox_path trades durability for the in memory queue
+outbox_path = config.get("outbox_path", DEFAULT_OUTBOX_PATH)
+# batch changes into /Bulk requests, only for downstream servers which support them
+downstream_bulk_limits = None
+if config.get("bulk_max_operations", 0) > 0:
+    downstream_bulk_limits = BulkLimits(
+        config["bulk_max_operations"],
+        config.get("bulk_max_payload_size", BulkLimits.max_payload_size),
+    )
+scim_server: Union[OutboxDispatcher, ChangeDispatcher]
+if outbox_path:
+    scim_server = OutboxDispatcher(
+        Outbox(outbox_path),
+        downstream,
+        downstream_workers,
+        # seconds to hold a change back so later replacements of the resource can be
+        # folded into it, 0 only folds them into a backlog
+        coalesce_window=config.get("coalesce_window", DEFAULT_COALESCE_WINDOW),
+        bulk=downstream_bulk_limits,
+    )
+else:
+    # sends every change, nothing is coalesced without the outbox
+    scim_server = ChangeDispatcher(downstream, downstream_workers)
+
+# what clients may send to our own /Bulk endpoint
+inbound_bulk_limits = BulkLimits(
+    config.get("inbound_bulk_max_operations", BulkLimits.max_operations),
+    config.get("inbound_bulk_max_payload_size", BulkLimits.max_payload_size),
 )
+service_provider_config = ServiceProviderConfig(bulk=inbound_bulk_limits)
+bulk_endpoints = {
+    "Users": bulk.BulkEndpoint(user_store, "User", User.from_dict, "get_user"),
+    "Groups": bulk.BulkEndpoint(group_store, "Group", Group.from_dict, "get_group"),
+}
+
+
+@app.before_serving
+async def start_dispatcher():
+    await scim_server.start()
+
+
+@app.after_serving
+async def stop_dispatcher():
+    await scim_server.stop()
+
+
+@app.after_serving
+async def close_stores():
+    # lets a snapshot being written finish, so the next start need not replay as much
+    for store in [user_store, group_store]:
+        if isinstance(store, JournaledStore):
+            store.close()
 
 # TODO add Location handling
 
 
 def handle_exceptions(e: Exception) -> Tuple[ResponseValue, int]:
-    if isinstance(e, exceptions.SCIMException):
-        new_exception = e
-    else:
-        new_exception = exceptions.UnknownSCIMException(e)
-
+    new_exception = exceptions.as_scim_exception(e)
     traceback.print_exception(e)
     return jsonify(new_exception.to_dict()), new_exception.code
 
 
+def stream_json(pieces: Iterable[str]) -> Response:
+    return Response(IterableBody(common.stream_chunks(pieces)), mimetype="application/json")
+
+
 @app.route("/")
 async def hello():
     return jsonify({"hello": "world"})
 
 
+@app.route("/stats/downstream", methods=["GET"])
+async def downstream_stats() -> Tuple[ResponseValue, int]:
+    # the outbox counts its rows under the lock deliveries hold while they fsync
+    dispatcher_stats = await asyncio.to_thread(scim_server.stats)
+    stats = {**dispatcher_stats, "connections": downstream.session.stats.to_dict()}
+    return jsonify(stats), 200
+
+
+@app.route("/scim/v2/ServiceProviderConfig", methods=["GET"])
+async def get_service_provider_config() -> Tuple[ResponseValue, int]:
+    return jsonify(service_provider_config.to_dict()), 200
+
+
+@app.route("/scim/v2/Bulk", methods=["POST"])
+async def post_bulk() -> Tuple[ResponseValue, int]:
+    try:
+        # turned away before the body is read
+        if (request.content_length or 0) > inbound_bulk_limits.max_payload_size:
+            raise exceptions.PayloadTooLarge(
+                f"Bulk requests may be at most {inbound_bulk_limits.max_payload_size}"
+                " bytes"
+            )
+        json_data: Mapping = await request.get_json(force=True)
+        request_provider = common.RequestProvider(
+            request.view_args, request.args, json_data
+        )
+        response = await asyncio.to_thread(
+            bulk.handle_bulk,
+            bulk_endpoints,
+            validator,
+            scim_server,
+            inbound_bulk_limits,
+            request_provider,
+        )
+        return jsonify(response), 200
+    except Exception as e:
+        return handle_exceptions(e)
+
+
 @app.route("/scim/v2/Users", methods=["GET"])
 async def get_users() -> Tuple[ResponseValue, int]:
     try:
         request_provider = common.RequestProvider(request.view_args, request.args)
+        if stream_list_responses:
+            pieces = users.handle_stream_users(user_store, request_provider)
+            return stream_json(pieces), 200
         list_response = users.handle_get_users(user_store, request_provider)
         return jsonify(list_response), 200
     except Exception as e:
@@ -77,8 +233,15 @@ async def post_users() -> Tuple[ResponseValue, int]:
         request.view_args, request.args, json_data
     )
     try:
-        new_user = users.handle_post_users(
-            user_store, validator, scim_server, request_provider
+        # handlers which write wait for the store and outbox to reach the disk, they
+        # run on threads so the event loop is not held up and concurrent writes can
+        # share an fsync
+        new_user = await asyncio.to_thread(
+            users.handle_post_users,
+            user_store,
+            validator,
+            scim_server,
+            request_provider,
         )
         return jsonify(new_user.to_dict()), 201
     except Exception as e:
@@ -89,8 +252,13 @@ async def post_users() -> Tuple[ResponseValue, int]:
 async def patch_user(resource_id) -> Tuple[ResponseValue, int]:
     request_data: Mapping = await request.get_json(force=True)
     try:
-        patched_resource = users.handle_patch_user(
-            user_store, validator, resource_id, request_data, scim_server
+        patched_resource = await asyncio.to_thread(
+            users.handle_patch_user,
+            user_store,
+            validator,
+            resource_id,
+            request_data,
+            scim_server,
         )
         return jsonify(patched_resource), 200
     except Exception as e:
@@ -115,8 +283,8 @@ async def put_user(resource_id) -> Tuple[ResponseValue, int]:
         request_provider = common.RequestProvider(
             request.view_args, request.args, json_data
         )
-        user = users.handle_put_user(
-            user_store, validator, scim_server, request_provider
+        user = await asyncio.to_thread(
+            users.handle_put_user, user_store, validator, scim_server, request_provider
         )
         return jsonify(user.to_dict()), 200
     except Exception as e:
@@ -127,6 +295,9 @@ async def put_user(resource_id) -> Tuple[ResponseValue, int]:
 async def get_groups() -> Tuple[ResponseValue, int]:
     try:
         request_provider = common.RequestProvider(request.view_args, request.args)
+        if stream_list_responses:
+            pieces = groups.handle_stream_groups(group_store, request_provider)
+            return stream_json(pieces), 200
         list_response = groups.handle_get_groups(group_store, request_provider)
         return jsonify(list_response), 200
     except Exception as e:
@@ -141,8 +312,12 @@ async def post_groups() -> Tuple[ResponseValue, int]:
         request_provider = common.RequestProvider(
             request.view_args, request.args, request_data
         )
-        new_group = groups.handle_post_groups(
-            group_store, validator, scim_server, request_provider
+        new_group = await asyncio.to_thread(
+            groups.handle_post_groups,
+            group_store,
+            validator,
+            scim_server,
+            request_provider,
         )
         return jsonify(new_group.to_dict()), 201
     except Exception as e:
@@ -156,8 +331,8 @@ async def patch_group(resource_id) -> Tuple[ResponseValue, int]:
         request_provider = common.RequestProvider(
             request.view_args, request.args, request_data
         )
-        patched_resource = groups.handle_patch_group(
-            group_store, validator, request_provider
+        patched_resource = await asyncio.to_thread(
+            groups.handle_patch_group, group_store, validator, request_provider
         )
         return jsonify(patched_resource), 200
     except Exception as e:
@@ -179,8 +354,12 @@ async def put_group(resource_id):
     request_data: Mapping = await request.get_json(force=True)
     try:
         request_provider = common.RequestProvider(request.view_args, request.args)
-        group = groups.handle_put_group(
-            group_store, validator, scim_server, request_provider
+        group = await asyncio.to_thread(
+            groups.handle_put_group,
+            group_store,
+            validator,
+            scim_server,
+            request_provider,
         )
         return jsonify(group.to_dict()), 200
     except Exception as e:
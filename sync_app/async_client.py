@@ -0,0 +1,190 @@
+"""
+asyncio SCIM client
+
+Requests are made with aiohttp on the event loop itself, over one pool of keep-alive
+connections, so callers can fan out many requests at once while at most concurrency
+of them are in flight. Requests and responses are built and read as by SCIMClient.
+"""
+
+import asyncio
+import json
+from typing import Any, Awaitable, Iterable, List, Mapping, Optional, TypeVar, Union
+import aiohttp
+from sync_app.client import (
+    ClientConfiguration,
+    Filter,
+    PageRequest,
+    Sort,
+    posted_resource,
+    query_params,
+    request_headers,
+)
+from sync_app.scim.group import Group
+from sync_app.scim.list_response import ListResponse
+from sync_app.scim.patchop import PatchOp
+from sync_app.scim.user import User
+
+DEFAULT_CONCURRENCY = 16
+
+R = TypeVar("R")
+
+
+class AsyncSCIMClient:
+    config: ClientConfiguration
+    concurrency: int
+
+    def __init__(
+        self, config: ClientConfiguration, concurrency: int = DEFAULT_CONCURRENCY
+    ):
+        assert concurrency > 0, "An async client needs to allow at least one request"
+        self.config = config
+        self.concurrency = concurrency
+        # created on first use so they belong to the loop the client is used from
+        self.session: Optional[aiohttp.ClientSession] = None
+        self.semaphore: Optional[asyncio.Semaphore] = None
+
+    async def __aenter__(self) -> "AsyncSCIMClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def open(self) -> aiohttp.ClientSession:
+        pool = self.config.pool
+        # a connection per request in flight, so none of them has to open its own
+        connections = max(pool.connections_per_host, self.concurrency)
+        return aiohttp.ClientSession(
+            headers=request_headers(self.config.auth_token),
+            connector=aiohttp.TCPConnector(
+                limit=connections, limit_per_host=connections
+            ),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=pool.connect_timeout, sock_read=pool.read_timeout
+            ),
+        )
+
+    async def _request(
+        self,
+        method: str,
+        endpoint: str,
+        params: Optional[Mapping[str, Any]] = None,
+        data: Optional[Mapping] = None,
+    ) -> Any:
+        """The decoded JSON response, raises ClientResponseError for an error status"""
+        if self.session is None:
+            self.session = self.open()
+            self.semaphore = asyncio.Semaphore(self.concurrency)
+        assert self.semaphore is not None
+        content = json.dumps(data).encode() if data is not None else None
+        async with self.semaphore:
+            async with self.session.request(
+                method,
+                self.config.server_url + endpoint,
+                params=params,
+                data=content,
+            ) as response:
+                body = await response.read()
+                response.raise_for_status()
+        return json.loads(body) if body else None
+
+    async def get_user(
+        self,
+        id: str,
+        attributes: Optional[list[str]] = None,
+        excludedAttributes: Optional[list[str]] = None,
+    ) -> User:
+        params = query_params(attributes, excludedAttributes)
+        return User.from_dict(await self._request("get", f"/Users/{id}", params))
+
+    async def get_users(
+        self,
+        filter: Optional[Filter] = None,
+        attributes: Optional[list[str]] = None,
+        excludedAttributes: Optional[list[str]] = None,
+        sorting: Optional[Sort] = None,
+        page: Optional[PageRequest] = None,
+    ) -> ListResponse:
+        params = query_params(attributes, excludedAttributes, filter, sorting, page)
+        raw_list = await self._request("get", "/Users", params)
+        return ListResponse.from_dict(raw_list, User)
+
+    async def get_group(
+        self,
+        id: str,
+        attributes: Optional[list[str]] = None,
+        excludedAttributes: Optional[list[str]] = None,
+    ) -> Group:
+        params = query_params(attributes, excludedAttributes)
+        return Group.from_dict(await self._request("get", f"/Groups/{id}", params))
+
+    async def get_groups(
+        self,
+        filter: Optional[Filter] = None,
+        attributes: Optional[list[str]] = None,
+        excludedAttributes: Optional[list[str]] = None,
+        sorting: Optional[Sort] = None,
+        page: Optional[PageRequest] = None,
+    ) -> ListResponse:
+        params = query_params(attributes, excludedAttributes, filter, sorting, page)
+        raw_list = await self._request("get", "/Groups", params)
+        return ListResponse.from_dict(raw_list, Group)
+
+    async def create_user(self, user: User) -> User:
+        data = posted_resource(user.to_dict())
+        return User.from_dict(await self._request("post", "/Users", data=data))
+
+    async def create_group(self, group: Group) -> Group:
+        assert (
+            group.members == []
+        ), "scim.dev doesn't handle creating groups with members"
+        data = posted_resource(group.to_dict())
+        return Group.from_dict(await self._request("post", "/Groups", data=data))
+
+    async def update_user(self, id: str, ops: PatchOp) -> User:
+        raw_user = await self._request("patch", f"/Users/{id}", data=ops.to_dict())
+        return User.from_dict(raw_user)
+
+    async def update_group(self, id: str, ops: PatchOp) -> Group:
+        raw_group = await self._request("patch", f"/Groups/{id}", data=ops.to_dict())
+        return Group.from_dict(raw_group)
+
+    async def replace_user(self, id: str, user: User) -> User:
+        raw_user = await self._request("put", f"/Users/{id}", data=user.to_dict())
+        return User.from_dict(raw_user)
+
+    async def replace_group(self, id: str, group: Group) -> Group:
+        raw_group = await self._request("put", f"/Groups/{id}", data=group.to_dict())
+        return Group.from_dict(raw_group)
+
+    async def delete_user(self, id: str) -> None:
+        await self._request("delete", f"/Users/{id}")
+
+    async def delete_group(self, id: str) -> None:
+        await self._request("delete", f"/Groups/{id}")
+
+    async def create_users_many(
+        self, users: Iterable[User], return_exceptions: bool = False
+    ) -> List[Union[User, BaseException]]:
+        """
+        Creates users concurrently, returning the created users in the same order.
+        With return_exceptions a failed create is returned in its place instead of
+        raising, as in asyncio.gather.
+        """
+        return await gather(map(self.create_user, users), return_exceptions)
+
+    async def create_groups_many(
+        self, groups: Iterable[Group], return_exceptions: bool = False
+    ) -> List[Union[Group, BaseException]]:
+        """See create_users_many"""
+        return await gather(map(self.create_group, groups), return_exceptions)
+
+
+async def gather(
+    calls: Iterable[Awaitable[R]], return_exceptions: bool
+) -> List[Union[R, BaseException]]:
+    return list(await asyncio.gather(*calls, return_exceptions=return_exceptions))
@@ -1,12 +1,14 @@
+import copy
 import json
-from typing import Optional, Literal, Mapping, Sequence
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional, Literal, Mapping, Sequence, Callable, Iterator
 from sync_app.scim.user import User
 from sync_app.scim.group import Group
 from sync_app.scim.patchop import PatchOp
 from sync_app.scim.list_response import ListResponse
 from dataclasses import dataclass
 from sync_app.parsers.python_filter import PythonFilter
-import requests
+from sync_app.http_session import PoolConfiguration, PooledSession
 
 
 class InvalidFilter(Exception):
@@ -18,8 +20,9 @@ class Sort:
     order: Literal["ascending"] | Literal["descending"]
 
 
+@dataclass
 class PageRequest:
-    start_index: int
+    start_index: int = 1
     results_per_page: int = 20
 
 
@@ -45,24 +48,77 @@ class Filter:
 class ClientConfiguration:
     server_url: str
     auth_token: str
+    pool: PoolConfiguration
 
-    def __init__(self, server_url: str, auth_token: str):
+    def __init__(
+        self,
+        server_url: str,
+        auth_token: str,
+        pool: Optional[PoolConfiguration] = None,
+    ):
         self.server_url = server_url.rstrip("/")
         self.auth_token = auth_token
+        self.pool = pool or PoolConfiguration()
+
+
+def query_params(
+    attributes: Optional[list[str]] = None,
+    excludedAttributes: Optional[list[str]] = None,
+    filter: Optional[Filter] = None,
+    sorting: Optional[Sort] = None,
+    page: Optional[PageRequest] = None,
+) -> dict:
+    """The query string of a GET, shared with AsyncSCIMClient"""
+    params: dict[str, Any] = {}
+    if attributes:
+        params["attributes"] = ",".join(attributes)
+
+    if excludedAttributes:
+        params["excludedAttributes"] = ",".join(excludedAttributes)
+
+    if filter:
+        params["filter"] = filter.filter
+
+    if sorting:
+        params["sortBy"] = sorting.attribute
+        params["sortOrder"] = sorting.order
+
+    if page:
+        params["startIndex"] = page.start_index
+        params["count"] = page.results_per_page
+
+    return params
+
+
+def request_headers(auth_token: str) -> dict:
+    """The headers sent with every request, shared with AsyncSCIMClient"""
+    return {
+        "Content-Type": "application/json",
+        "Authorization": "Bearer " + auth_token,
+        "Accept": "application/scim+json; charset=utf-8",
+    }
+
+
+def posted_resource(resource: Mapping) -> dict:
+    """The body of a POST, our id is sent as the externalId of the new resource"""
+    posted = dict(resource)
+    if "id" in resource:
+        del posted["id"]
+        posted["externalId"] = resource["id"]
+    return posted
 
 
 class SCIMClient:
     root_scim_endpoint: str
+    # keeps connections to the server open between calls
+    session: PooledSession
 
     def __init__(self, config: ClientConfiguration):
         self.config = config
+        self.session = PooledSession(config.pool, self.request_headers())
 
     def request_headers(self):
-        return {
-            "Content-Type": "application/json",
-            "Authorization": "Bearer " + self.config.auth_token,
-            "Accept": "application/scim+json; charset=utf-8",
-        }
+        return request_headers(self.config.auth_token)
 
     def get_user(
         self,
@@ -88,6 +144,28 @@ class SCIMClient:
         raw_list = response.json()
         return ListResponse.from_dict(raw_list, User)
 
+    def iter_users(
+        self,
+        filter: Optional[Filter] = None,
+        attributes: Optional[list[str]] = None,
+        excludedAttributes: Optional[list[str]] = None,
+        sorting: Optional[Sort] = None,
+        page_size: int = PageRequest.results_per_page,
+    ) -> Iterator[User]:
+        """
+        Yields every user matching filter, fetching them page_size at a time. The
+        next page is requested while the caller works through the current one, over
+        a session of its own, so the client can still be used in the meantime.
+        """
+        return self._iter_resources(
+            type(self).get_users,
+            filter,
+            attributes,
+            excludedAttributes,
+            sorting,
+            page_size,
+        )
+
     def get_group(
         self,
         id: str,
@@ -112,6 +190,72 @@ class SCIMClient:
         raw_list = response.json()
         return ListResponse.from_dict(raw_list, Group)
 
+    def iter_groups(
+        self,
+        filter: Optional[Filter] = None,
+        attributes: Optional[list[str]] = None,
+        excludedAttributes: Optional[list[str]] = None,
+        sorting: Optional[Sort] = None,
+        page_size: int = PageRequest.results_per_page,
+    ) -> Iterator[Group]:
+        """See iter_users"""
+        return self._iter_resources(
+            type(self).get_groups,
+            filter,
+            attributes,
+            excludedAttributes,
+            sorting,
+            page_size,
+        )
+
+    def _iter_resources(
+        self,
+        get_page: Callable[..., ListResponse],
+        filter: Optional[Filter],
+        attributes: Optional[list[str]],
+        excludedAttributes: Optional[list[str]],
+        sorting: Optional[Sort],
+        page_size: int,
+    ) -> Iterator:
+        # one page is fetched in the background at a time, by a copy of the client
+        # with a session of its own, sessions can't be shared between threads
+        executor = ThreadPoolExecutor(1, "scim-prefetch")
+        prefetcher = copy.copy(self)
+        prefetcher.session = PooledSession(self.config.pool, self.request_headers())
+
+        def fetch(start_index: int) -> Future:
+            page = PageRequest(start_index, page_size)
+            return executor.submit(
+                get_page,
+                prefetcher,
+                filter,
+                attributes,
+                excludedAttributes,
+                sorting,
+                page,
+            )
+
+        next_page: Optional[Future] = None
+        try:
+            next_page = fetch(1)
+            while next_page is not None:
+                page = next_page.result()
+                resources = list(page.resources)
+                # servers may return fewer than were asked for, carry on after the last
+                start_index = page.startIndex + len(resources)
+                if resources and start_index <= page.totalResults:
+                    next_page = fetch(start_index)
+                else:
+                    next_page = None
+                yield from resources
+        finally:
+            # a caller which stops early leaves at most one page to be thrown away,
+            # the session is closed once the worker is done with it
+            if next_page is not None:
+                next_page.cancel()
+            executor.submit(prefetcher.session.close)
+            executor.shutdown(wait=False)
+
     def _get_resource(
         self,
         endpoint: str,
@@ -121,24 +265,7 @@ class SCIMClient:
         sorting: Optional[Sort] = None,
         page: Optional[PageRequest] = None,
     ):
-        params = {}
-        if attributes:
-            params["attributes"] = ",".join(attributes)
-
-        if excludedAttributes:
-            params["excludedAttributes"] = ",".join(excludedAttributes)
-
-        if filter:
-            params["filter"] = filter.filter
-
-        if sorting:
-            params["sortBy"] = sorting.attribute
-            params["sortOrder"] = sorting.order
-
-        if page:
-            params["startIndex"] = page.start_index
-            params["count"] = page.results_per_page
-
+        params = query_params(attributes, excludedAttributes, filter, sorting, page)
         return self._request("get", endpoint, params=params)
 
     def create_user(self, user: User) -> User:
@@ -155,12 +282,7 @@ class SCIMClient:
         return Group.from_dict(raw_group)
 
     def _post_resource(self, endpoint: str, resource: Mapping):
-        posted_resource = dict(resource)
-        if "id" in resource:
-            del posted_resource["id"]
-            posted_resource["externalId"] = resource["id"]
-
-        return self._request("post", endpoint, data=posted_resource)
+        return self._request("post", endpoint, data=posted_resource(resource))
 
     def update_user(self, id: str, ops: PatchOp) -> User:
         response = self._patch_resource(f"/Users/{id}", ops)
@@ -206,11 +328,12 @@ class SCIMClient:
     ):
         url = self.config.server_url + endpoint
         if data is not None:
-            request_data = json.dumps(data)
+            # encoded so it goes out with the headers, see SCIMServer.send
+            request_data = json.dumps(data).encode()
         else:
             request_data = None
-        response = requests.request(
-            method=method, url=url, headers=self.request_headers(), data=request_data, params=params
+        response = self.session.request(
+            method=method, url=url, data=request_data, params=params
         )
 
         if not response.ok:
@@ -0,0 +1,114 @@
+"""
+Propagates resource changes downstream without blocking the request that made them
+
+Handlers report changes to a ChangeDispatcher, which only queues them. A fixed pool of
+asyncio workers sends them on through the wrapped handler (normally a SCIMServer), so
+at most `workers` downstream requests are in flight at once. Changes to the same
+resource always go to the same worker and are sent in the order they were made.
+Every change is sent, folding replacements of the same resource together needs the
+outbox, see outbox.OutboxDispatcher.
+"""
+
+import asyncio
+import traceback
+from dataclasses import dataclass
+from typing import Any, Callable, List, Mapping, Optional
+from sync_app.scim.resource import ResourceWithMeta
+from sync_app.server import Operation, ResourceChangeHandler
+
+DEFAULT_WORKERS = 8
+
+
+def call_on_loop(
+    loop: Optional[asyncio.AbstractEventLoop], callback: Callable[..., Any], *args: Any
+) -> None:
+    """
+    Runs callback on loop, the only thread asyncio queues and events may be touched
+    from. Handlers report changes from threads of their own, see app.py. Runs it right
+    away when called on loop itself or before the loop has been started.
+    """
+    try:
+        running: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if loop is None or running is loop:
+        callback(*args)
+    else:
+        loop.call_soon_threadsafe(callback, *args)
+
+
+@dataclass(frozen=True)
+class ResourceChange:
+    operation: Operation
+    resource: ResourceWithMeta
+
+
+class ChangeDispatcher:
+    downstream: ResourceChangeHandler
+    queues: List["asyncio.Queue[ResourceChange]"]
+    sent: int
+    failed: int
+
+    def __init__(self, downstream: ResourceChangeHandler, workers: int = DEFAULT_WORKERS):
+        assert workers > 0, "A dispatcher needs at least one worker"
+        self.downstream = downstream
+        self.queues = [asyncio.Queue() for _ in range(workers)]
+        self.tasks: List[asyncio.Task] = []
+        # the loop the workers run on, set by start
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.sent = 0
+        self.failed = 0
+
+    def handle_resource_change(
+        self, operation: Operation, resource: ResourceWithMeta
+    ) -> None:
+        """Queues the change and returns straight away, from any thread"""
+        queue = self.queues[hash(resource.id) % len(self.queues)]
+        call_on_loop(self.loop, queue.put_nowait, ResourceChange(operation, resource))
+
+    async def start(self) -> None:
+        if self.tasks:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.tasks = [asyncio.create_task(self.work(queue)) for queue in self.queues]
+
+    async def stop(self, timeout: Optional[float] = None) -> None:
+        """Waits for every queued change to be sent, then stops the workers"""
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(*(queue.join() for queue in self.queues)), timeout
+            )
+        finally:
+            for task in self.tasks:
+                task.cancel()
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+            self.tasks = []
+
+    async def work(self, queue: "asyncio.Queue[ResourceChange]") -> None:
+        while True:
+            change = await queue.get()
+            try:
+                await self.send(change)
+                self.sent += 1
+            except Exception as e:
+                # one bad change must not take the worker down with it
+                self.failed += 1
+                traceback.print_exception(e)
+            finally:
+                queue.task_done()
+
+    async def send(self, change: ResourceChange) -> None:
+        # the downstream handler makes blocking requests, keep them off the event loop
+        await asyncio.to_thread(
+            self.downstream.handle_resource_change, change.operation, change.resource
+        )
+
+    def stats(self) -> Mapping[str, Optional[int]]:
+        return {
+            "workers": len(self.queues),
+            "pending": sum(queue.qsize() for queue in self.queues),
+            "sent": self.sent,
+            "failed": self.failed,
+            # changes are never folded together here, unlike in OutboxDispatcher
+            "coalesced": None,
+        }
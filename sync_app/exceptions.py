@@ -68,3 +68,20 @@ class ResourceMissing(SCIMException):
 class UnknownSCIMException(SCIMException):
     exception_type = "unknown"
     code = 500
+
+
+class PayloadTooLarge(SCIMException):
+    exception_type = "invalidValue"
+    code = 413
+
+
+class UnresolvedBulkId(SCIMException):
+    exception_type = "invalidValue"
+    code = 409
+
+
+def as_scim_exception(e: Exception) -> SCIMException:
+    """e if it already is one, otherwise the catch all SCIM error wrapping it"""
+    if isinstance(e, SCIMException):
+        return e
+    return UnknownSCIMException(e)
@@ -0,0 +1,268 @@
+"""
+RFC 7644 section 3.7 bulk operations
+
+A bulk request is handled in passes over the whole batch rather than one operation
+at a time. Every operation is prepared first, with POSTs given their ids up front so
+bulkId references to them resolve wherever they appear in the request. The prepared
+resources are then validated together, and finally written in request order, with
+each run of consecutive creates for a store going to it in a single write.
+"""
+
+from dataclasses import dataclass, replace
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Mapping, Optional
+import uuid
+from sync_app import exceptions
+from sync_app.handlers import common
+from sync_app.schema import ResourceValidator, ValidatorResult
+from sync_app.scim.bulk import (
+    BulkLimits,
+    BulkOperation,
+    BulkOperationResult,
+    BulkRequest,
+    BulkResponse,
+)
+from sync_app.scim.resource import ResourceMeta, ResourceType, ResourceWithMeta
+from sync_app.server import Operation, ResourceChangeHandler
+from sync_app.store import Store
+
+BULK_ID_PREFIX = "bulkId:"
+
+
+@dataclass
+class BulkEndpoint:
+    """A resource endpoint bulk operations can target, e.g. /Users"""
+
+    store: Store
+    resource_type: ResourceType
+    from_dict: Callable[[Mapping], ResourceWithMeta]
+    # the view resources at this endpoint are served from, for their location
+    view: str
+
+
+@dataclass
+class PreparedOperation:
+    operation: BulkOperation
+    endpoint: Optional[BulkEndpoint] = None
+    resource_id: Optional[uuid.UUID] = None
+    resource: Optional[Mapping] = None
+    record: Optional[ResourceWithMeta] = None
+    error: Optional[exceptions.SCIMException] = None
+
+
+def resolve_bulk_ids(value: Any, bulk_ids: Mapping[str, uuid.UUID]) -> Any:
+    """Replaces every "bulkId:<bulkId>" in value with the id the bulkId was given"""
+    if isinstance(value, str) and value.startswith(BULK_ID_PREFIX):
+        bulk_id = value[len(BULK_ID_PREFIX) :]
+        if bulk_id not in bulk_ids:
+            raise exceptions.UnresolvedBulkId(f"No POST in the request has {value}")
+        return str(bulk_ids[bulk_id])
+    if isinstance(value, list):
+        return [resolve_bulk_ids(v, bulk_ids) for v in value]
+    if isinstance(value, dict):
+        return {k: resolve_bulk_ids(v, bulk_ids) for k, v in value.items()}
+    return value
+
+
+def prepare(
+    prepared: PreparedOperation,
+    endpoints: Mapping[str, BulkEndpoint],
+    bulk_ids: Mapping[str, uuid.UUID],
+    new_metas: Dict[uuid.UUID, ResourceMeta],
+    request_data: common.RequestProvider,
+) -> None:
+    """Works out the resource an operation writes, with its id and meta filled in"""
+    operation = prepared.operation
+    parts = operation.path.strip("/").split("/")
+    endpoint = endpoints.get(parts[0], None)
+    if endpoint is None or len(parts) > 2:
+        raise exceptions.InvalidValue(f"{operation.path} is not a bulk endpoint")
+    if operation.data is None:
+        raise exceptions.InvalidValue(f"{operation.method} requires data")
+    prepared.endpoint = endpoint
+    resource = dict(resolve_bulk_ids(operation.data, bulk_ids))
+
+    if operation.method == "POST" and len(parts) == 1:
+        assert prepared.resource_id is not None, "POSTs are given an id up front"
+        resource["id"] = str(prepared.resource_id)
+        meta = ResourceMeta.create_meta(
+            endpoint.resource_type,
+            location=request_data.url_for_resource(endpoint.view, prepared.resource_id),
+        )
+        new_metas[prepared.resource_id] = meta
+        resource["meta"] = meta.to_dict()
+    elif operation.method == "PUT" and len(parts) == 2:
+        try:
+            prepared.resource_id = uuid.UUID(resolve_bulk_ids(parts[1], bulk_ids))
+        except ValueError:
+            raise exceptions.InvalidResourceID(f"{parts[1]} is not a valid id")
+        if resource.setdefault("id", str(prepared.resource_id)) != str(
+            prepared.resource_id
+        ):
+            raise exceptions.InvalidValue(
+                "Resource ID specified in path didn't match ID in resource"
+            )
+        if "meta" not in resource:
+            previous = new_metas.get(prepared.resource_id, None)
+            if previous is None:
+                previous = endpoint.store.get_by_id(prepared.resource_id).meta
+            resource["meta"] = replace(previous, lastModified=datetime.now()).to_dict()
+    else:
+        raise exceptions.InvalidValue(
+            f"{operation.method} {operation.path} is not supported in bulk requests"
+        )
+
+    prepared.resource = resource
+
+
+def validation_error(
+    result: ValidatorResult, resource_type: ResourceType
+) -> exceptions.SCIMException:
+    """The error the handler for a single resource of resource_type would give"""
+    for error in result.errors:
+        if "is a required property" in error.message:
+            return exceptions.InvalidValue("Resource is missing a required value")
+    return exceptions.as_scim_exception(
+        exceptions.ResourceValidationError(
+            f"Could not validate resource as {resource_type.lower()}"
+        )
+    )
+
+
+def operation_result(prepared: PreparedOperation) -> BulkOperationResult:
+    operation = prepared.operation
+    if prepared.error is not None:
+        return BulkOperationResult(
+            operation.method,
+            prepared.error.code,
+            operation.bulkId,
+            response={**prepared.error.to_dict(), "status": str(prepared.error.code)},
+        )
+
+    assert prepared.record is not None, "Operations without errors have a record"
+    return BulkOperationResult(
+        operation.method,
+        201 if operation.method == "POST" else 200,
+        operation.bulkId,
+        location=prepared.record.meta.location,
+        version=prepared.record.meta.version,
+    )
+
+
+def handle_bulk(
+    endpoints: Mapping[str, BulkEndpoint],
+    validator: ResourceValidator,
+    scim_server: ResourceChangeHandler,
+    limits: BulkLimits,
+    request_data: common.RequestProvider,
+) -> Mapping:
+    assert request_data.json_body is not None, "JSON body must not be None for bulk"
+    try:
+        bulk = BulkRequest.from_dict(request_data.json_body)
+    except (AssertionError, KeyError, TypeError):
+        raise exceptions.InvalidValue("Request is not a bulk request")
+    if len(bulk.operations) > limits.max_operations:
+        raise exceptions.PayloadTooLarge(
+            f"Bulk requests may have at most {limits.max_operations} operations"
+        )
+
+    # POSTs get their ids before anything else so they can be referenced from anywhere
+    operations = [PreparedOperation(operation) for operation in bulk.operations]
+    bulk_ids: Dict[str, uuid.UUID] = {}
+    for prepared in operations:
+        if prepared.operation.method == "POST":
+            prepared.resource_id = uuid.uuid1()
+            if prepared.operation.bulkId is not None:
+                bulk_ids[prepared.operation.bulkId] = prepared.resource_id
+
+    # POSTs first, a PUT to a resource created in the same request takes its meta
+    new_metas: Dict[uuid.UUID, ResourceMeta] = {}
+    posts_first = sorted(operations, key=lambda p: p.operation.method != "POST")
+    for prepared in posts_first:
+        try:
+            prepare(prepared, endpoints, bulk_ids, new_metas, request_data)
+        except Exception as e:
+            prepared.error = exceptions.as_scim_exception(e)
+
+    valid = [p for p in operations if p.error is None]
+    resources: List[Mapping] = []
+    for prepared in valid:
+        assert prepared.resource is not None, "Prepared operations have a resource"
+        resources.append(prepared.resource)
+    results = validator.validate_all(resources)
+    for prepared, resource, result in zip(valid, resources, results):
+        assert prepared.endpoint is not None
+        if not result.valid:
+            prepared.error = validation_error(result, prepared.endpoint.resource_type)
+            continue
+        try:
+            prepared.record = prepared.endpoint.from_dict(resource)
+        except (AssertionError, KeyError, TypeError, ValueError) as e:
+            prepared.error = exceptions.InvalidValue(
+                f"Could not read resource as {prepared.endpoint.resource_type}: {e!r}"
+            )
+
+    operations = apply(operations, bulk.failOnErrors)
+
+    for prepared in operations:
+        if prepared.error is None:
+            assert prepared.record is not None and prepared.endpoint is not None
+            record = prepared.endpoint.store.get_by_id(prepared.record.get_id())
+            change: Operation = "replace"
+            if prepared.operation.method == "POST":
+                change = "add"
+            scim_server.handle_resource_change(change, record)
+
+    return BulkResponse(operation_result(p) for p in operations).to_dict()
+
+
+def apply(
+    operations: List[PreparedOperation], fail_on_errors: Optional[int]
+) -> List[PreparedOperation]:
+    """
+    Writes the operations which are still error free in request order, recording any
+    store errors. Returns the operations up to the one which brought the errors to
+    fail_on_errors, nothing after it is written.
+    """
+    errors = 0
+    start = 0
+    while start < len(operations):
+        first = operations[start]
+        end = start + 1
+        if first.error is None and first.operation.method == "POST":
+            # never more creates in one write than it would take errors to stop
+            while (
+                end < len(operations)
+                and (fail_on_errors is None or end - start < fail_on_errors - errors)
+                and operations[end].error is None
+                and operations[end].operation.method == "POST"
+                and operations[end].endpoint is first.endpoint
+            ):
+                end += 1
+            create(operations[start:end])
+        elif first.error is None:
+            update(first)
+
+        for i in range(start, end):
+            errors += operations[i].error is not None
+            if fail_on_errors is not None and errors >= fail_on_errors:
+                return operations[: i + 1]
+        start = end
+    return operations
+
+
+def create(creates: List[PreparedOperation]) -> None:
+    """Creates the records of POSTs to the same endpoint together"""
+    endpoint = creates[0].endpoint
+    assert endpoint is not None
+    errors = endpoint.store.create_many([p.record for p in creates])
+    for prepared, error in zip(creates, errors):
+        prepared.error = error
+
+
+def update(prepared: PreparedOperation) -> None:
+    assert prepared.endpoint is not None
+    try:
+        prepared.endpoint.store.update(prepared.record)
+    except Exception as e:
+        prepared.error = exceptions.as_scim_exception(e)
@@ -1,15 +1,31 @@
-from typing import Mapping, Iterable, Optional, TypeAlias
+from typing import (
+    AsyncGenerator,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    TypeAlias,
+    TypeVar,
+)
 from dataclasses import dataclass
 from quart import url_for
+import sys
 import uuid
 from sync_app import exceptions
+from sync_app import query_planner
 from sync_app.parsers.python_filter import (
     PythonFilter,
     AttributePath,
     delete_attribute_in_path,
     get_attribute_from_path,
     set_attribute_in_path,
+    resolve_attribute,
+    sortable_value,
 )
+from sync_app.scim.list_response import ListResponse
+from sync_app.store import Store, HasId
 
 # this is a hack over a real "returned" system
 # which would require a real attribute system
@@ -18,6 +34,13 @@ REQUIRED_ATTRIBUTES = [["id"], ["schemas"]]
 
 QueryStringMapping: TypeAlias = Mapping[str, str]
 
+SORT_ORDERS = ("ascending", "descending")
+
+# streamed list responses are written out in chunks of at least this many characters
+STREAM_CHUNK_SIZE = 64 * 1024
+
+T = TypeVar("T", bound="HasId")
+
 
 @dataclass
 class QueryParameters:
@@ -25,6 +48,19 @@ class QueryParameters:
     excluded_attributes: Optional[Iterable[AttributePath]] = None
     filter: Optional[str] = None
     resource_id: Optional[uuid.UUID] = None
+    start_index: int = 1
+    # None when the request has no count, and gets every match
+    count: Optional[int] = None
+    # dotted attribute path, e.g. "meta.lastModified"
+    sort_by: Optional[str] = None
+    sort_order: str = "ascending"
+
+
+def parse_integer_parameter(query_parameters: Mapping[str, str], name: str) -> int:
+    try:
+        return int(query_parameters[name])
+    except ValueError:
+        raise exceptions.InvalidValue(f"{name} must be an integer")
 
 
 def parse_query_parameters(query_parameters: Mapping[str, str]) -> QueryParameters:
@@ -38,6 +74,27 @@ def parse_query_parameters(query_parameters: Mapping[str, str]) -> QueryParamete
     if "filter" in query_parameters:
         parameters.filter = query_parameters["filter"]
 
+    # RFC 7644 3.4.2.4, out of range values are clamped rather than rejected
+    if "startIndex" in query_parameters:
+        parameters.start_index = max(
+            1, parse_integer_parameter(query_parameters, "startIndex")
+        )
+    if "count" in query_parameters:
+        parameters.count = max(0, parse_integer_parameter(query_parameters, "count"))
+
+    # RFC 7644 3.4.2.3
+    if "sortBy" in query_parameters and query_parameters["sortBy"]:
+        parameters.sort_by = ".".join(
+            PythonFilter.parse_filter_to_path(query_parameters["sortBy"])
+        )
+    if "sortOrder" in query_parameters:
+        sort_order = query_parameters["sortOrder"].lower()
+        if sort_order not in SORT_ORDERS:
+            raise exceptions.InvalidValue(
+                f"sortOrder must be one of {', '.join(SORT_ORDERS)}"
+            )
+        parameters.sort_order = sort_order
+
     if "resource_id" in query_parameters:
         try:
             parameters.resource_id = uuid.UUID(query_parameters["resource_id"])
@@ -74,11 +131,96 @@ class RequestProvider:
         return url_for(endpoint, resource_id=str(id))
 
 
+def sort_records(records: Iterable[T], attribute: str, ascending: bool) -> List[T]:
+    """Sorts records into the same order Store.get_sorted_page returns them in"""
+    path = tuple(attribute.split("."))
+
+    def key(record: T):
+        value = sortable_value(path, resolve_attribute(path, record.to_dict()))
+        # nulls sort last, ties are broken by id like in the store's indexes
+        return (value is None, value if value is not None else "", record.get_id())
+
+    return sorted(records, key=key, reverse=not ascending)
+
+
+def list_resources(store: Store[T], parameters: QueryParameters) -> ListResponse:
+    """
+    Runs the filter, sorting and paging in a list request against the store. Only
+    the requested page ends up in the response so only it gets serialized.
+    """
+    ascending = parameters.sort_order == "ascending"
+    # a page the size of the whole store when no count was asked for
+    count = sys.maxsize if parameters.count is None else parameters.count
+    matches: Optional[List[T]] = None
+
+    if parameters.filter:
+        matches = query_planner.filter_records(store, parameters.filter)
+        if parameters.sort_by:
+            matches = sort_records(matches, parameters.sort_by, ascending)
+    elif parameters.sort_by:
+        sorted_page = store.get_sorted_page(
+            parameters.sort_by, ascending, parameters.start_index, count
+        )
+        if sorted_page is None:
+            matches = sort_records(store.get_all(), parameters.sort_by, ascending)
+        else:
+            total, page = sorted_page
+    else:
+        total, page = store.get_page(parameters.start_index, count)
+
+    if matches is not None:
+        total = len(matches)
+        offset = parameters.start_index - 1
+        page = matches[offset : offset + count]
+
+    return ListResponse(
+        totalResults=total,
+        resources=page,
+        startIndex=parameters.start_index,
+        itemsPerPage=len(page),
+    )
+
+
+async def stream_chunks(
+    pieces: Iterable[str], chunk_size: int = STREAM_CHUNK_SIZE
+) -> AsyncGenerator[bytes, None]:
+    """
+    Adapts the pieces of a streamed response to an async generator Quart can send,
+    joining small pieces so every write is a reasonable size
+    """
+    buffer: List[str] = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= chunk_size:
+            yield "".join(buffer).encode()
+            buffer = []
+            buffered = 0
+
+    if buffer:
+        yield "".join(buffer).encode()
+
+
 def parse_attribute_paths(raw_paths: str) -> Iterable[AttributePath]:
     paths = raw_paths.split(",")
     return [PythonFilter.parse_filter_to_path(path) for path in paths]
 
 
+def resource_filter(
+    parameters: QueryParameters,
+) -> Optional[Callable[[Mapping], Mapping]]:
+    """The attributes/excludedAttributes filtering a request asks for, if any"""
+    if not (parameters.attributes or parameters.excluded_attributes):
+        return None
+
+    return lambda resource: filter_resource(
+        resource,
+        include=parameters.attributes,
+        exclude=parameters.excluded_attributes,
+    )
+
+
 def filter_resource(
     resource: Mapping,
     include: Optional[Iterable[AttributePath]] = None,
@@ -1,14 +1,14 @@
 from quart import url_for
 from sync_app.schema import ResourceValidator
 from sync_app.scim.resource import ResourceMeta
-from sync_app.server import SCIMServer
+from sync_app.server import ResourceChangeHandler
 from sync_app.parsers.python_filter import (
     PythonFilter,
 )
 from sync_app.scim.group import Group
 from sync_app.scim.list_response import ListResponse
 from sync_app.store import Store
-from typing import Mapping
+from typing import Iterator, Mapping
 from sync_app.handlers import common
 from sync_app import exceptions
 import uuid
@@ -28,7 +28,7 @@ def validate_group(validator: ResourceValidator, resource: Mapping) -> Group:
 def handle_post_groups(
     store: Store[Group],
     validator: ResourceValidator,
-    scim_server: SCIMServer,
+    scim_server: ResourceChangeHandler,
     request_data: common.RequestProvider,
 ) -> Group:
     assert (
@@ -69,40 +69,29 @@ def handle_get_group(
 
 
 def handle_get_groups(store: Store[Group], request_provider: common.RequestProvider):
-    # process input
-    all_groups = store.get_all()
-
-    if request_provider.args.filter:
-        query_filter = PythonFilter.parse_filter_to_predicate(
-            request_provider.args.filter
-        )
-        filtered = [group for group in all_groups if query_filter(group.to_dict())]
-    else:
-        filtered = list(all_groups)
-
-    # generate response
-    result = ListResponse.from_list(filtered).to_dict()
+    # process input and generate response
+    result = common.list_resources(store, request_provider.args).to_dict()
 
     # filter output
-    if request_provider.args.attributes or request_provider.args.excluded_attributes:
-        if "Resources" in result:
-            modified_resources = [
-                common.filter_resource(
-                    f,
-                    include=request_provider.args.attributes,
-                    exclude=request_provider.args.excluded_attributes,
-                )
-                for f in result["Resources"]
-            ]
-            result["Resources"] = modified_resources
+    transform = common.resource_filter(request_provider.args)
+    if transform is not None and "Resources" in result:
+        result["Resources"] = [transform(r) for r in result["Resources"]]
 
     return result
 
 
+def handle_stream_groups(
+    store: Store[Group], request_provider: common.RequestProvider
+) -> Iterator[str]:
+    """See handle_stream_users"""
+    list_response = common.list_resources(store, request_provider.args)
+    return list_response.iter_json(common.resource_filter(request_provider.args))
+
+
 def handle_put_group(
     group_store: Store[Group],
     validator: ResourceValidator,
-    scim_server: SCIMServer,
+    scim_server: ResourceChangeHandler,
     request_data: common.RequestProvider,
 ) -> Group:
     assert (
@@ -1,14 +1,14 @@
 from quart import url_for
 from sync_app.schema import ResourceValidator
 from sync_app.scim.resource import ResourceMeta
-from sync_app.server import SCIMServer
+from sync_app.server import ResourceChangeHandler
 from sync_app.parsers.python_filter import (
     PythonFilter,
 )
 from sync_app.scim.user import User
 from sync_app.scim.list_response import ListResponse
 from sync_app.store import Store
-from typing import Mapping, Optional, TypeAlias
+from typing import Iterator, Mapping, Optional, TypeAlias
 from sync_app.handlers import common
 from sync_app import exceptions
 import uuid
@@ -29,7 +29,7 @@ def validate_user(validator: ResourceValidator, resource: Mapping) -> User:
 def handle_post_users(
     store: Store[User],
     validator: ResourceValidator,
-    scim_server: SCIMServer,
+    scim_server: ResourceChangeHandler,
     request_data: common.RequestProvider,
 ) -> User:
     assert (
@@ -76,36 +76,32 @@ def handle_get_users(
     user_store: Store[User],
     request_data: common.RequestProvider,
 ) -> Mapping:
-    all_users = user_store.get_all()
-
-    if request_data.args.filter:
-        query_filter = PythonFilter.parse_filter_to_predicate(request_data.args.filter)
-        filtered = [user for user in all_users if query_filter(user.to_dict())]
-    else:
-        filtered = list(all_users)
-
-    result = ListResponse.from_list(filtered).to_dict()
+    result = common.list_resources(user_store, request_data.args).to_dict()
 
     # filter output
-    if request_data.args.attributes or request_data.args.excluded_attributes:
-        if "Resources" in result:
-            modified_resources = [
-                common.filter_resource(
-                    f,
-                    include=request_data.args.attributes,
-                    exclude=request_data.args.excluded_attributes,
-                )
-                for f in result["Resources"]
-            ]
-            result["Resources"] = modified_resources
+    transform = common.resource_filter(request_data.args)
+    if transform is not None and "Resources" in result:
+        result["Resources"] = [transform(r) for r in result["Resources"]]
 
     return result
 
 
+def handle_stream_users(
+    user_store: Store[User],
+    request_data: common.RequestProvider,
+) -> Iterator[str]:
+    """
+    Like handle_get_users but returns the JSON response in pieces, the query runs
+    before this returns so errors are raised before anything is sent
+    """
+    list_response = common.list_resources(user_store, request_data.args)
+    return list_response.iter_json(common.resource_filter(request_data.args))
+
+
 def handle_put_user(
     user_store: Store[User],
     validator: ResourceValidator,
-    scim_server: SCIMServer,
+    scim_server: ResourceChangeHandler,
     request_data: common.RequestProvider,
 ) -> User:
     assert request_data.json_body is not None, "JSON body must not be None for PUT user"
@@ -127,6 +123,6 @@ def handle_patch_user(
     validator: ResourceValidator,
     userId: str,
     resource: Mapping,
-    scim_server: SCIMServer,
+    scim_server: ResourceChangeHandler,
 ) -> User:
     raise NotImplementedError("Patch is not yet supported on this server")
@@ -0,0 +1,134 @@
+"""
+Pooled keep-alive HTTP sessions for talking to SCIM servers
+
+The module level requests functions open a new connection for every call. A
+PooledSession keeps connections to each host open between requests, up to a
+configurable number per host, applies default timeouts, and counts how many of its
+requests were sent over a connection that was already open.
+"""
+
+import threading
+from dataclasses import dataclass
+from typing import Mapping, Optional, Type
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool
+
+# hosts connections are kept open to, the least recently used host's are dropped
+DEFAULT_POOL_HOSTS = 10
+DEFAULT_CONNECTIONS_PER_HOST = 10
+# seconds
+DEFAULT_CONNECT_TIMEOUT = 5.0
+DEFAULT_READ_TIMEOUT = 30.0
+
+
+@dataclass
+class PoolConfiguration:
+    hosts: int = DEFAULT_POOL_HOSTS
+    # connections kept open to each host, more than this many concurrent requests
+    # open extra connections which are closed afterwards, or wait if block is set
+    connections_per_host: int = DEFAULT_CONNECTIONS_PER_HOST
+    block: bool = False
+    connect_timeout: float = DEFAULT_CONNECT_TIMEOUT
+    read_timeout: float = DEFAULT_READ_TIMEOUT
+
+
+class ConnectionStats:
+    """How many requests a session sent and how many connections it opened for them"""
+
+    requests: int
+    connections: int
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.connections = 0
+
+    def count_request(self) -> None:
+        with self.lock:
+            self.requests += 1
+
+    def count_connection(self) -> None:
+        with self.lock:
+            self.connections += 1
+
+    def reuse_rate(self) -> float:
+        """The fraction of requests sent over a connection that was already open"""
+        with self.lock:
+            if self.requests == 0:
+                return 0.0
+            return max(0.0, 1 - self.connections / self.requests)
+
+    def to_dict(self) -> Mapping:
+        return {
+            "requests": self.requests,
+            "connections": self.connections,
+            "reuse_rate": self.reuse_rate(),
+        }
+
+
+def counting_pool(
+    pool_class: Type[HTTPConnectionPool], stats: ConnectionStats
+) -> Type[HTTPConnectionPool]:
+    """A subclass of pool_class which counts the connections it opens in stats"""
+
+    class CountingConnectionPool(pool_class):  # type: ignore[valid-type, misc]
+        def _new_conn(self):
+            stats.count_connection()
+            return super()._new_conn()
+
+    return CountingConnectionPool
+
+
+class PooledAdapter(HTTPAdapter):
+    def __init__(self, pool: PoolConfiguration, stats: ConnectionStats):
+        self.pool = pool
+        self.stats = stats
+        super().__init__(
+            pool_connections=pool.hosts,
+            pool_maxsize=pool.connections_per_host,
+            pool_block=pool.block,
+        )
+
+    def init_poolmanager(self, *args, **kwargs) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            scheme: counting_pool(pool_class, self.stats)
+            for scheme, pool_class in self.poolmanager.pool_classes_by_scheme.items()
+        }
+
+    def send(
+        self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None
+    ) -> requests.Response:
+        if timeout is None:
+            timeout = (self.pool.connect_timeout, self.pool.read_timeout)
+        self.stats.count_request()
+        return super().send(
+            request,
+            stream=stream,
+            timeout=timeout,
+            verify=verify,
+            cert=cert,
+            proxies=proxies,
+        )
+
+
+class PooledSession(requests.Session):
+    """
+    A requests.Session sending headers with every request and keeping connections
+    open as pool allows, one is meant to be shared by everything talking to a server
+    """
+
+    stats: ConnectionStats
+
+    def __init__(
+        self,
+        pool: Optional[PoolConfiguration] = None,
+        headers: Optional[Mapping[str, str]] = None,
+    ):
+        super().__init__()
+        self.stats = ConnectionStats()
+        adapter = PooledAdapter(pool or PoolConfiguration(), self.stats)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+        self.headers.update(headers or {})
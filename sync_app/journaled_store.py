@@ -0,0 +1,390 @@
+"""
+MemoryStore which survives a restart by journaling every change to disk
+
+Each create, update and delete is appended to a journal as a line of JSON, the whole
+record for a put and its id for a delete, so replaying a journal over any earlier
+state of the store leaves it the same. A change is only acknowledged once the journal
+has been fsynced, writers arriving while an fsync is in progress wait for it and are
+all covered by the next one rather than each paying for their own.
+
+Once enough changes have been journaled the store starts a new journal segment and
+writes a snapshot of every record as of the switch, in mmap_snapshot's format and on a
+thread of its own, then deletes the snapshot and segments it replaces. A restart maps
+the newest snapshot and replays the segments written since over it, which only reads
+the records they change, and starts serving requests while the rest of the snapshot
+is read into memory in the background, see SnapshotStore.
+
+    <directory>/<table>.<generation>.snapshot   records as of the start of the segment
+    <directory>/<table>.<generation>.journal    changes since
+"""
+
+import gc
+import json
+import os
+import re
+import threading
+import time
+import traceback
+from typing import (
+    Any,
+    Dict,
+    IO,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+from uuid import UUID
+from sync_app import exceptions
+from sync_app.mmap_snapshot import LOAD_BATCH, SnapshotStore, write_snapshot
+from sync_app.store import HasId
+
+DEFAULT_STORE_DIRECTORY = "store"
+# journaled changes after which a snapshot is taken and the journal started afresh
+DEFAULT_SNAPSHOT_EVERY = 100_000
+
+T = TypeVar("T", bound="HasId")
+
+
+def encode(entry: Mapping) -> bytes:
+    return (json.dumps(entry, separators=(",", ":")) + "\n").encode()
+
+
+class Journal:
+    """
+    Append-only file of JSON lines, fsynced in groups: whoever finds no fsync in
+    progress runs one for everything appended so far, after waiting commit_delay for
+    more writers to join it, and everyone else waits for that
+    """
+
+    def __init__(self, path: str, commit_delay: float = 0.0):
+        self.commit_delay = commit_delay
+        self.condition = threading.Condition()
+        # entries appended and entries known to be on disk since the journal opened
+        self.appended = 0
+        self.synced = 0
+        self.syncing = False
+        self.syncs = 0
+        self.file = self.open(path)
+
+    @staticmethod
+    def open(path: str) -> IO[bytes]:
+        file = open(path, "ab", buffering=0)
+        # fsyncing entries acknowledges them, which is no use if a crash can still
+        # take the segment itself out of the directory
+        fsync_directory(os.path.dirname(path) or ".")
+        return file
+
+    def append(self, entries: Sequence[Mapping]) -> int:
+        """Appends entries without waiting for them to reach the disk, see commit"""
+        data = b"".join(encode(entry) for entry in entries)
+        with self.condition:
+            self.file.write(data)
+            self.appended += len(entries)
+            return self.appended
+
+    def commit(self, position: int) -> None:
+        """Returns once every entry up to position has been fsynced"""
+        with self.condition:
+            while self.synced < position and self.syncing:
+                self.condition.wait()
+            if self.synced >= position:
+                return
+            self.syncing = True
+
+        synced = 0
+        try:
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+            with self.condition:
+                target = self.appended
+                file = self.file
+            os.fsync(file.fileno())
+            synced = target
+            self.syncs += 1
+        finally:
+            with self.condition:
+                self.synced = max(self.synced, synced)
+                self.syncing = False
+                self.condition.notify_all()
+
+    def rotate(self, path: str) -> None:
+        """Makes everything appended so far durable and appends to path from now on"""
+        with self.condition:
+            self.sync_and_close()
+            self.file = self.open(path)
+
+    def sync_and_close(self) -> None:
+        while self.syncing:
+            self.condition.wait()
+        os.fsync(self.file.fileno())
+        self.file.close()
+        self.synced = self.appended
+
+    def close(self) -> None:
+        with self.condition:
+            self.sync_and_close()
+
+
+def read_lines(path: str) -> Tuple[List[Any], int]:
+    """
+    Returns every complete entry in the file at path and the length of the file they
+    take up, a line cut short by a crash and anything after it is left out
+    """
+    entries = []
+    length = 0
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                break
+            length += len(line)
+    return entries, length
+
+
+def fsync_directory(directory: str) -> None:
+    """Makes renames and deletions of files in directory durable"""
+    descriptor = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+class JournaledStore(SnapshotStore[T]):
+    """
+    MemoryStore of records journaled under directory, see the module docstring. Reads
+    are served as by SnapshotStore, from memory once the snapshot has been read.
+    """
+
+    def __init__(
+        self,
+        record_type: Type[T],
+        directory: str = DEFAULT_STORE_DIRECTORY,
+        table: str = "",
+        snapshot_every: int = DEFAULT_SNAPSHOT_EVERY,
+        commit_delay: float = 0.0,
+    ):
+        super().__init__(record_type)
+        self.directory = directory
+        self.table = table or record_type.__name__.lower() + "s"
+        self.snapshot_every = snapshot_every
+        # MemoryStore's lock is held while a change is applied and appended so the
+        # journal is in the same order as the changes, not while waiting for the fsync
+        self.snapshot_thread: Optional[threading.Thread] = None
+
+        os.makedirs(directory, exist_ok=True)
+        # recovery only allocates records that live as long as the store, collecting
+        # garbage over and over while it does takes up a third of the time
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            self.generation, self.journaled = self.recover()
+        finally:
+            if collecting:
+                gc.enable()
+        self.journal = Journal(self.journal_path(self.generation), commit_delay)
+        self.start_hydrating()
+
+    def path(self, generation: int, kind: str) -> str:
+        return os.path.join(self.directory, f"{self.table}.{generation:08}.{kind}")
+
+    def snapshot_path(self, generation: int) -> str:
+        return self.path(generation, "snapshot")
+
+    def journal_path(self, generation: int) -> str:
+        return self.path(generation, "journal")
+
+    def generations(self, kind: str) -> List[int]:
+        pattern = re.compile(rf"{re.escape(self.table)}\.(\d+)\.{kind}")
+        matches = (pattern.fullmatch(name) for name in os.listdir(self.directory))
+        return sorted(int(match.group(1)) for match in matches if match)
+
+    def recover(self) -> Tuple[int, int]:
+        """
+        Loads the newest snapshot and replays every journal segment written since.
+        Returns the generation to carry on journaling to and how many changes it
+        already holds.
+        """
+        for name in os.listdir(self.directory):
+            # a snapshot that was still being written
+            if name.startswith(self.table + ".") and name.endswith(".snapshot.tmp"):
+                os.remove(os.path.join(self.directory, name))
+
+        snapshots = self.generations("snapshot")
+        generation = snapshots[-1] if snapshots else 0
+        if snapshots:
+            try:
+                self.open_base(self.snapshot_path(generation))
+            except ValueError:
+                # written as JSON lines, before snapshots were mapped
+                self.load_snapshot(self.snapshot_path(generation))
+
+        segments = [g for g in self.generations("journal") if g >= generation]
+        replayed = 0
+        for segment in segments:
+            path = self.journal_path(segment)
+            entries, length = read_lines(path)
+            if length < os.path.getsize(path):
+                # cut off by a crash before it was acknowledged, drop it so later
+                # changes are not appended after a partial line
+                os.truncate(path, length)
+            self.replay(entries)
+            replayed = len(entries)
+        if segments:
+            generation = segments[-1]
+
+        self.remove_before(generation)
+        return generation, replayed
+
+    def load_snapshot(self, path: str) -> None:
+        with open(path, "rb") as file:
+            resources = []
+            for line in file:
+                resources.append(json.loads(line))
+                if len(resources) == LOAD_BATCH:
+                    self.load(resources)
+                    resources = []
+            self.load(resources)
+
+    def load(self, resources: Sequence[Mapping]) -> None:
+        super().create_many([self.from_dict(r) for r in resources], resources)
+
+    def replay(self, entries: Sequence[Mapping]) -> None:
+        """
+        Applies journaled changes in order, runs of records new to the store are
+        created together the way a snapshot is loaded
+        """
+        created: Dict[str, Mapping] = {}
+        for entry in entries:
+            if entry["op"] == "put":
+                resource = entry["resource"]
+                id = resource["id"]
+                if not self.holds(UUID(id)) and id not in created:
+                    created[id] = resource
+                    if len(created) == LOAD_BATCH:
+                        self.load(list(created.values()))
+                        created = {}
+                    continue
+
+            self.load(list(created.values()))
+            created = {}
+            if entry["op"] == "put":
+                super().update(self.from_dict(entry["resource"]))
+            elif self.holds(UUID(entry["id"])):
+                super().delete_by_id(UUID(entry["id"]))
+        self.load(list(created.values()))
+
+    def remove_before(self, generation: int) -> None:
+        """Deletes the snapshots and journal segments generation supersedes"""
+        for kind in ["snapshot", "journal"]:
+            for old in self.generations(kind):
+                if old < generation:
+                    os.remove(self.path(old, kind))
+        fsync_directory(self.directory)
+
+    def journal_changes(self, entries: Sequence[Mapping]) -> int:
+        """Appends entries, starting a snapshot if they fill the journal segment"""
+        position = self.journal.append(entries)
+        self.journaled += len(entries)
+        # a snapshot needs every record in memory, until then the segment grows on
+        if (
+            self.journaled >= self.snapshot_every
+            and self.base is None
+            and not self.snapshotting()
+        ):
+            self.start_snapshot()
+        return position
+
+    def create(self, new_record: T) -> None:
+        with self.lock:
+            super().create(new_record)
+            position = self.journal_changes(
+                [{"op": "put", "resource": new_record.to_dict()}]
+            )
+        self.journal.commit(position)
+
+    def create_many(
+        self, new_records: Sequence[T], resources: Optional[Sequence[Mapping]] = None
+    ) -> List[Optional[exceptions.SCIMException]]:
+        """Like MemoryStore.create_many, with a single fsync for the whole batch"""
+        if resources is None:
+            resources = [record.to_dict() for record in new_records]
+        with self.lock:
+            errors = super().create_many(new_records, resources)
+            position = self.journal_changes(
+                [
+                    {"op": "put", "resource": resource}
+                    for resource, error in zip(resources, errors)
+                    if error is None
+                ]
+            )
+        self.journal.commit(position)
+        return errors
+
+    def update(self, updated_record: T) -> None:
+        with self.lock:
+            super().update(updated_record)
+            position = self.journal_changes(
+                [{"op": "put", "resource": updated_record.to_dict()}]
+            )
+        self.journal.commit(position)
+
+    def delete_by_id(self, key: UUID) -> None:
+        with self.lock:
+            super().delete_by_id(key)
+            position = self.journal_changes([{"op": "delete", "id": str(key)}])
+        self.journal.commit(position)
+
+    def snapshotting(self) -> bool:
+        return self.snapshot_thread is not None and self.snapshot_thread.is_alive()
+
+    def start_snapshot(self) -> threading.Thread:
+        """
+        Starts a new journal segment and writes the records as they are now to a
+        snapshot in the background. Must be called holding the lock, once hydrated.
+        """
+        # in insertion order, which the snapshot's positions carry over to a restart
+        records = [self.datastore[id] for _, id in self.insertion_order]
+        self.generation += 1
+        self.journaled = 0
+        self.journal.rotate(self.journal_path(self.generation))
+        self.snapshot_thread = threading.Thread(
+            target=self.write_snapshot,
+            args=(self.generation, records),
+            name=f"{self.table} snapshot",
+            daemon=True,
+        )
+        self.snapshot_thread.start()
+        return self.snapshot_thread
+
+    def write_snapshot(self, generation: int, records: Sequence[T]) -> None:
+        try:
+            # only a complete snapshot ever has its final name
+            write_snapshot(self.snapshot_path(generation), records, self.key_attributes)
+            self.remove_before(generation)
+        except Exception as e:
+            # the journal segments it would have replaced are still there
+            traceback.print_exception(e)
+
+    def snapshot(self) -> None:
+        """Takes a snapshot and waits for it to be written"""
+        self.loaded.wait()
+        with self.lock:
+            if self.snapshot_thread is not None:
+                self.snapshot_thread.join()
+            thread = self.start_snapshot()
+        thread.join()
+
+    def close(self) -> None:
+        self.stop_hydrating()
+        with self.lock:
+            if self.snapshot_thread is not None:
+                self.snapshot_thread.join()
+            self.journal.close()
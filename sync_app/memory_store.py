@@ -1,7 +1,28 @@
-from typing import Protocol, TypeVar, Iterable, Generic, Sequence
-from sync_app.store import HasId
+from typing import (
+    Callable,
+    Concatenate,
+    ParamSpec,
+    Protocol,
+    TypeVar,
+    Iterable,
+    Generic,
+    Sequence,
+    Hashable,
+    Tuple,
+    Optional,
+    Any,
+    List,
+    Mapping,
+)
+from sync_app.store import HasId, RangeBound
+from sync_app.parsers.filter_ast import Expression
+from sync_app.parsers.python_filter import resolve_attribute, sortable_value
+from sync_app.sorted_index import SortedIndex
 from sync_app import exceptions
 from uuid import UUID
+import collections.abc
+import functools
+import threading
 
 
 class ObjectAlreadyInStore(Exception):
@@ -13,41 +34,384 @@ class ObjectNotFound(Exception):
 
 
 T = TypeVar("T", bound="HasId")
+S = TypeVar("S", bound="MemoryStore")
+P = ParamSpec("P")
+R = TypeVar("R")
+
+
+def locked(method: Callable[Concatenate[S, P], R]) -> Callable[Concatenate[S, P], R]:
+    """Runs method holding the store's lock"""
+
+    @functools.wraps(method)
+    def wrapper(self: S, *args: P.args, **kwargs: P.kwargs) -> R:
+        with self.lock:
+            return method(self, *args, **kwargs)
+
+    return wrapper
 
 
 class MemoryStore(Generic[T]):
     datastore: dict[UUID, T]
+    # attribute name -> attribute value -> id of the record holding it
+    # "id" is never indexed here since datastore is already keyed by it
+    unique_indexes: dict[str, dict[Hashable, UUID]]
+    # filter path -> attribute value -> ids of every record holding it, the ids are
+    # kept in a dict rather than a set so results come back in insertion order
+    secondary_indexes: dict[str, dict[Hashable, dict[UUID, None]]]
+    # filter path -> (attribute value, id) pairs in ascending order
+    sorted_indexes: dict[str, SortedIndex[Tuple[Any, UUID]]]
+    # filter path -> ids of the records with no value there, in ascending order
+    sorted_nulls: dict[str, SortedIndex[UUID]]
+    # (sequence number, id) of every record in insertion order, get_page slices it
+    insertion_order: SortedIndex[Tuple[int, UUID]]
+    # id -> sequence number the record was created with
+    sequence_numbers: dict[UUID, int]
+    next_sequence_number: int
+    # held by every public method so the store can be shared between threads, e.g. by
+    # handlers run off the event loop
+    lock: threading.RLock
 
     def __init__(self):
+        self.lock = threading.RLock()
         self.datastore = {}
-        pass
+        self.insertion_order = SortedIndex()
+        self.sequence_numbers = {}
+        self.next_sequence_number = 0
+        self.unique_indexes = {}
+        self.secondary_indexes = {}
+        self.sorted_indexes = {}
+        self.sorted_nulls = {}
+
+    @staticmethod
+    def unique_values(record: T) -> Iterable[Tuple[str, Hashable]]:
+        for attribute in record.unique_attributes:
+            if attribute == "id":
+                continue
+            value = getattr(record, attribute, None)
+            if value is not None:
+                yield attribute, value
+
+    @staticmethod
+    def secondary_values(record: T, resource: Mapping) -> Iterable[Tuple[str, Hashable]]:
+        values = set()
+        for attribute in record.indexed_attributes:
+            value = resolve_attribute(tuple(attribute.split(".")), resource)
+            for v in value if isinstance(value, list) else [value]:
+                # the typing alias would be checked the slow way on every value
+                if v is not None and isinstance(v, collections.abc.Hashable):
+                    values.add((attribute, v))
+        return values
+
+    @staticmethod
+    def sorted_values(record: T, resource: Mapping) -> Iterable[Tuple[str, Any]]:
+        """Yields every ordered attribute of record, None when it sorts as null"""
+        for attribute in record.sorted_attributes:
+            path = tuple(attribute.split("."))
+            yield attribute, sortable_value(path, resolve_attribute(path, resource))
+
+    def check_unique(self, record: T) -> None:
+        id = record.get_id()
+        for attribute, value in self.unique_values(record):
+            holder = self.unique_indexes.get(attribute, {}).get(value, None)
+            if holder is not None and holder != id:
+                raise exceptions.ResourceConflict(
+                    f"Could not store record, {attribute} {value!r} is already in use"
+                )
+
+    def index(self, record: T) -> None:
+        # index the serialized form since that is what filters are evaluated against
+        resource = record.to_dict()
+        self.index_values(record, resource)
+        self.index_sorted([(record, resource)])
+
+    def index_values(self, record: T, resource: Mapping) -> None:
+        """Adds record to the unique and secondary indexes"""
+        id = record.get_id()
+        for attribute, value in self.unique_values(record):
+            self.unique_indexes.setdefault(attribute, {})[value] = id
+        for attribute, value in self.secondary_values(record, resource):
+            index = self.secondary_indexes.setdefault(attribute, {})
+            index.setdefault(value, {})[id] = None
+
+    def index_sorted(self, records: Sequence[Tuple[T, Mapping]]) -> None:
+        """
+        Adds records, each with its serialized form, to the ordered indexes. A batch is
+        sorted once and handed to each index together.
+        """
+        added: dict[str, list[Tuple[Any, UUID]]] = {}
+        added_nulls: dict[str, list[UUID]] = {}
+        for record, resource in records:
+            id = record.get_id()
+            for attribute, value in self.sorted_values(record, resource):
+                if value is None:
+                    added_nulls.setdefault(attribute, []).append(id)
+                else:
+                    added.setdefault(attribute, []).append((value, id))
+                if attribute not in self.sorted_indexes:
+                    self.sorted_indexes[attribute] = SortedIndex()
+                    self.sorted_nulls[attribute] = SortedIndex()
 
+        for attribute, new_entries in added.items():
+            self.sorted_indexes[attribute].update(sorted(new_entries))
+        for attribute, new_ids in added_nulls.items():
+            self.sorted_nulls[attribute].update(sorted(new_ids))
+
+    def unindex(self, record: T) -> None:
+        id = record.get_id()
+        for attribute, value in self.unique_values(record):
+            del self.unique_indexes[attribute][value]
+
+        resource = record.to_dict()
+        for attribute, value in self.secondary_values(record, resource):
+            ids = self.secondary_indexes[attribute][value]
+            del ids[id]
+            if not ids:
+                del self.secondary_indexes[attribute][value]
+        for attribute, value in self.sorted_values(record, resource):
+            if value is None:
+                self.sorted_nulls[attribute].remove(id)
+            else:
+                self.sorted_indexes[attribute].remove((value, id))
+
+    def number(self, ids: List[UUID]) -> None:
+        """Puts newly created records at the end of the insertion order"""
+        numbered = []
+        for id in ids:
+            self.sequence_numbers[id] = self.next_sequence_number
+            numbered.append((self.next_sequence_number, id))
+            self.next_sequence_number += 1
+        self.insertion_order.update(numbered)
+
+    @locked
     def create(self, new_record: T) -> None:
         id = new_record.get_id()
-        if not all([new_record.compare_unique(x) for x in self.datastore.values()]):
+        if id in self.datastore:
             raise exceptions.ResourceConflict(
                 "Could not create record {record}".format(record=new_record)
             )
+        self.check_unique(new_record)
 
         self.datastore[id] = new_record
+        self.number([id])
+        self.index(new_record)
+
+    @locked
+    def create_many(
+        self, new_records: Sequence[T], resources: Optional[Sequence[Mapping]] = None
+    ) -> List[Optional[exceptions.SCIMException]]:
+        """
+        Creates every record in new_records which does not conflict with the store or
+        an earlier record in the batch, updating the ordered indexes once for all of
+        them. Returns the error each record could not be created with, or None.
+        resources are the serialized forms of new_records, if the caller has them.
+        """
+        errors: List[Optional[exceptions.SCIMException]] = []
+        created = []
+        for i, record in enumerate(new_records):
+            id = record.get_id()
+            try:
+                if id in self.datastore:
+                    raise exceptions.ResourceConflict(
+                        "Could not create record {record}".format(record=record)
+                    )
+                self.check_unique(record)
+            except exceptions.ResourceConflict as e:
+                errors.append(e)
+                continue
 
+            resource = resources[i] if resources is not None else record.to_dict()
+            self.datastore[id] = record
+            # unique values go in right away so later records in the batch see them
+            self.index_values(record, resource)
+            created.append((record, resource))
+            errors.append(None)
+
+        self.number([record.get_id() for record, _ in created])
+        self.index_sorted(created)
+        return errors
+
+    @locked
     def get_by_id(self, key: UUID) -> T:
         if key not in self.datastore:
             raise exceptions.ResourceMissing(f"Could not find {key} in store")
 
         return self.datastore[key]
 
+    @locked
     def update(self, updated_record: T) -> None:
-        if not updated_record.get_id() in self.datastore:
+        id = updated_record.get_id()
+        if not id in self.datastore:
             raise exceptions.ResourceMissing()
-        self.delete_by_id(updated_record.get_id())
-        self.create(updated_record)
+        self.check_unique(updated_record)
+
+        self.unindex(self.datastore[id])
+        self.datastore[id] = updated_record
+        self.index(updated_record)
 
+    @locked
     def delete_by_id(self, key: UUID) -> None:
         if not key in self.datastore:
             raise exceptions.ResourceMissing()
 
-        del self.datastore[key]
+        self.unindex(self.datastore.pop(key))
+        self.insertion_order.remove((self.sequence_numbers.pop(key), key))
 
+    @locked
     def get_all(self) -> Sequence[T]:
         return list(self.datastore.values())
+
+    @locked
+    def get_page(self, start_index: int, count: int) -> Tuple[int, Sequence[T]]:
+        """Returns the total number of records and count records from 1-based start_index"""
+        offset = start_index - 1
+        entries = self.insertion_order[offset : offset + count]
+        return len(self.datastore), [self.datastore[id] for _, id in entries]
+
+    @locked
+    def lookup(self, attribute: str, value: Any) -> Optional[Sequence[T]]:
+        """
+        Returns every record whose attribute equals value, or None when the attribute
+        is not indexed and the caller has to scan instead
+        """
+        if attribute == "id":
+            try:
+                record = self.datastore.get(UUID(str(value)), None)
+            except ValueError:
+                return []
+            # filters compare against the canonical string form of the id
+            if record is None or str(record.get_id()) != value:
+                return []
+            return [record]
+
+        if attribute in self.unique_indexes:
+            id = self.unique_indexes[attribute].get(value, None)
+            return [self.datastore[id]] if id is not None else []
+
+        if attribute in self.secondary_indexes:
+            ids = self.secondary_indexes[attribute].get(value, ())
+            return [self.datastore[id] for id in ids]
+
+        return None
+
+    @locked
+    def lookup_size(self, attribute: str, value: Any) -> Optional[int]:
+        """
+        The number of records lookup would return, without building the list. None
+        when the attribute is not indexed.
+        """
+        if attribute == "id":
+            return len(self.lookup(attribute, value) or ())
+
+        if attribute in self.unique_indexes:
+            return int(value in self.unique_indexes[attribute])
+
+        if attribute in self.secondary_indexes:
+            return len(self.secondary_indexes[attribute].get(value, ()))
+
+        return None
+
+    def range_positions(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound],
+        upper: Optional[RangeBound],
+    ) -> Optional[Tuple[int, int]]:
+        """Where the entries between the bounds start and end in the ordered index"""
+        if attribute not in self.sorted_indexes:
+            return None
+
+        entries = self.sorted_indexes[attribute]
+        key = lambda entry: entry[0]
+        start, end = 0, len(entries)
+
+        if lower is not None:
+            find = entries.bisect_left if lower.inclusive else entries.bisect_right
+            start = find(lower.value, key=key)
+        if upper is not None:
+            find = entries.bisect_right if upper.inclusive else entries.bisect_left
+            end = find(upper.value, key=key)
+
+        return start, max(start, end)
+
+    @locked
+    def range_lookup(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[Sequence[T]]:
+        """
+        Returns every record whose attribute lies between the bounds in ascending
+        order, or None when the attribute has no ordered index
+        """
+        positions = self.range_positions(attribute, lower, upper)
+        if positions is None:
+            return None
+
+        start, end = positions
+        entries = self.sorted_indexes[attribute]
+        return [self.datastore[id] for _, id in entries[start:end]]
+
+    @locked
+    def range_size(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[int]:
+        """The number of records range_lookup would return, found by bisecting alone"""
+        positions = self.range_positions(attribute, lower, upper)
+        if positions is None:
+            return None
+        start, end = positions
+        return end - start
+
+    @locked
+    def get_sorted_page(
+        self, attribute: str, ascending: bool, start_index: int, count: int
+    ) -> Optional[Tuple[int, Sequence[T]]]:
+        """
+        Like get_page but ordered by attribute, records without a value come last in
+        ascending order and first in descending order. Returns None when the attribute
+        has no ordered index and the caller has to sort instead.
+        """
+        if attribute not in self.sorted_indexes:
+            return None
+
+        entries = self.sorted_indexes[attribute]
+        nulls = self.sorted_nulls[attribute]
+        # descending order is the exact reverse of ascending order, nulls included
+        segments: List[Tuple[SortedIndex[Any], bool]] = [(entries, True), (nulls, False)]
+        if not ascending:
+            segments.reverse()
+
+        ids: list[UUID] = []
+        position = start_index - 1
+        for segment, keyed in segments:
+            size = len(segment)
+            if position >= size:
+                position -= size
+                continue
+
+            end = min(size, position + count - len(ids))
+            if ascending:
+                chunk = segment[position:end]
+            else:
+                chunk = segment[size - end : size - position][::-1]
+            if keyed:
+                ids.extend(id for _, id in chunk)
+            else:
+                ids.extend(chunk)
+            position = 0
+            if len(ids) >= count:
+                break
+
+        return len(self.datastore), [self.datastore[id] for id in ids]
+
+    def query(self, expression: Expression) -> Optional[Tuple[Sequence[T], bool]]:
+        """
+        Stores which can run a filter themselves return the records it matches, and
+        whether no more of it needs evaluating. Filters on a MemoryStore are planned
+        against its indexes instead, see query_planner.
+        """
+        return None
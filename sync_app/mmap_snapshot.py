@@ -0,0 +1,544 @@
+"""
+Binary snapshot of a store's records which is read through mmap, so a store can start
+answering requests without first parsing every record
+
+    header      magic, version, record count, offset and length of the directory
+    records     each record's serialized form as compact JSON, in insertion order
+    positions   (offset, length) of every record, in insertion order
+    ids         (id, position) of every record, ordered by id
+    keys        for each unique attribute besides id, the attribute's values one
+                after another and (offset, length, position) of each, ordered by value
+    directory   JSON giving the offsets of the sections above
+
+All integers are little-endian. Lookups by id or a unique attribute bisect the mmapped
+index, only the record found is parsed. JournaledStore writes its snapshots in this
+format and serves them through SnapshotStore until they have been read into memory.
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+from uuid import UUID
+from sync_app import exceptions
+from sync_app.memory_store import MemoryStore, locked
+from sync_app.sorted_index import SortedIndex
+from sync_app.store import HasId, RangeBound
+
+MAGIC = b"SCIMSNAP"
+VERSION = 1
+# magic, version, record count, directory offset, directory length
+HEADER = struct.Struct("<8sIIQQ")
+# offset and length of a record
+POSITION = struct.Struct("<QI")
+# id and position of a record
+ID_ENTRY = struct.Struct("<16sI")
+# offset and length of a value and the position of the record holding it
+KEY_ENTRY = struct.Struct("<QII")
+# records read into memory at once, see MemoryStore.create_many
+LOAD_BATCH = 10_000
+
+T = TypeVar("T", bound="HasId")
+
+
+def key_attributes(record_type: Type[HasId]) -> Tuple[str, ...]:
+    return tuple(a for a in record_type.unique_attributes if a != "id")
+
+
+def write_snapshot(
+    path: str, records: Sequence[HasId], attributes: Sequence[str]
+) -> None:
+    """
+    Writes records to a snapshot at path, indexed by id and by each of attributes,
+    replacing whatever was there only once the snapshot is complete
+    """
+    positions = bytearray()
+    ids: List[Tuple[bytes, int]] = []
+    keys: Dict[str, List[Tuple[bytes, int]]] = {a: [] for a in attributes}
+
+    with open(path + ".tmp", "wb") as file:
+        file.write(bytes(HEADER.size))
+        for position, record in enumerate(records):
+            data = json.dumps(record.to_dict(), separators=(",", ":")).encode()
+            positions += POSITION.pack(file.tell(), len(data))
+            file.write(data)
+            ids.append((record.get_id().bytes, position))
+            for attribute in attributes:
+                value = getattr(record, attribute, None)
+                if isinstance(value, str):
+                    keys[attribute].append((value.encode(), position))
+
+        directory: Dict[str, Any] = {"positions": file.tell()}
+        file.write(positions)
+        directory["ids"] = file.tell()
+        ids.sort()
+        file.write(b"".join(ID_ENTRY.pack(id, position) for id, position in ids))
+
+        directory["keys"] = {}
+        for attribute, values in keys.items():
+            values.sort()
+            entries = bytearray()
+            for value, position in values:
+                entries += KEY_ENTRY.pack(file.tell(), len(value), position)
+                file.write(value)
+            section = {"entries": file.tell(), "count": len(values)}
+            directory["keys"][attribute] = section
+            file.write(entries)
+
+        directory_offset = file.tell()
+        encoded = json.dumps(directory).encode()
+        file.write(encoded)
+        file.seek(0)
+        file.write(
+            HEADER.pack(MAGIC, VERSION, len(ids), directory_offset, len(encoded))
+        )
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(path + ".tmp", path)
+
+
+class SortedIds:
+    """The ids section as a sequence of id bytes, for bisect"""
+
+    def __init__(self, snapshot: "Snapshot"):
+        self.snapshot = snapshot
+
+    def __len__(self) -> int:
+        return self.snapshot.count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.snapshot.ids + i * ID_ENTRY.size
+        return self.snapshot.map[start : start + 16]
+
+
+class SortedKeys:
+    """One attribute's keys section as a sequence of value bytes, for bisect"""
+
+    def __init__(self, snapshot: "Snapshot", entries: int, count: int):
+        self.map = snapshot.map
+        self.entries = entries
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def entry(self, i: int) -> Tuple[int, int, int]:
+        return KEY_ENTRY.unpack_from(self.map, self.entries + i * KEY_ENTRY.size)
+
+    def __getitem__(self, i: int) -> bytes:
+        offset, length, _ = self.entry(i)
+        return self.map[offset : offset + length]
+
+
+class Snapshot:
+    """A snapshot file written by write_snapshot, mapped into memory"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            # raises ValueError for an empty file
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.map) < HEADER.size:
+            self.map.close()
+            raise ValueError(f"{path} is not a version {VERSION} store snapshot")
+        magic, version, self.count, offset, length = HEADER.unpack_from(self.map)
+        if magic != MAGIC or version != VERSION:
+            self.map.close()
+            raise ValueError(f"{path} is not a version {VERSION} store snapshot")
+
+        directory = json.loads(self.map[offset : offset + length])
+        self.positions: int = directory["positions"]
+        self.ids: int = directory["ids"]
+        self.keys = {
+            attribute: SortedKeys(self, section["entries"], section["count"])
+            for attribute, section in directory["keys"].items()
+        }
+
+    def resource(self, position: int) -> Mapping:
+        start = self.positions + position * POSITION.size
+        offset, length = POSITION.unpack_from(self.map, start)
+        return json.loads(self.map[offset : offset + length])
+
+    def find_id(self, id: UUID) -> Optional[int]:
+        """The position of the record with id, None when there isn't one"""
+        ids = SortedIds(self)
+        i = bisect.bisect_left(ids, id.bytes)
+        if i == self.count or ids[i] != id.bytes:
+            return None
+        return ID_ENTRY.unpack_from(self.map, self.ids + i * ID_ENTRY.size)[1]
+
+    def find_key(self, attribute: str, value: str) -> Optional[int]:
+        """The position of the record whose attribute is value, None if there is none"""
+        keys = self.keys[attribute]
+        encoded = value.encode()
+        i = bisect.bisect_left(keys, encoded)
+        if i == len(keys) or keys[i] != encoded:
+            return None
+        return keys.entry(i)[2]
+
+    def close(self) -> None:
+        self.map.close()
+
+
+class SnapshotStore(MemoryStore[T]):
+    """
+    MemoryStore over a snapshot, its base, which records are read from as they are
+    asked for until hydrate has read every one of them into memory. Changes are only
+    ever made in memory: a record created, or changed from what the base holds, is kept
+    like in any MemoryStore, and a record deleted from the base by its position there.
+    Records from the base keep their position as their sequence number, so the
+    insertion order is that of the snapshot followed by the records created since,
+    whether or not they have been read yet.
+
+    Until it is hydrated the store finds records by id or a unique attribute, and pages
+    through them, without reading the rest of the base. Other attributes are reported
+    as not indexed, so filters and sorting on them scan get_all, which reads the rest
+    of the base into touched for hydrate to pick up rather than parse again.
+    """
+
+    def __init__(self, record_type: Type[T]):
+        super().__init__()
+        self.from_dict: Callable[[Mapping], T] = record_type.from_dict  # type: ignore
+        self.key_attributes = key_attributes(record_type)
+        self.base: Optional[Snapshot] = None
+        # records read from the base so far by position, until it is hydrated
+        self.touched: Dict[int, T] = {}
+        # positions of the records deleted from the base
+        self.deleted: SortedIndex[int] = SortedIndex()
+        # set while every record is in memory
+        self.loaded = threading.Event()
+        self.loaded.set()
+        self.hydrate_thread: Optional[threading.Thread] = None
+        self.stopping = False
+
+    @locked
+    def open_base(self, path: str) -> None:
+        """Serves the records of the snapshot at path, before any other is created"""
+        assert self.base is None and not self.datastore
+        self.base = Snapshot(path)
+        self.next_sequence_number = self.base.count
+        self.loaded.clear()
+
+    def record_at(self, position: int) -> T:
+        assert self.base is not None
+        record = self.touched.get(position)
+        if record is None:
+            record = self.from_dict(self.base.resource(position))
+            self.touched[position] = record
+        return record
+
+    def from_base(self, position: Optional[int]) -> Optional[T]:
+        """The record at position in the base, None if it is deleted or in memory"""
+        if position is None or position in self.deleted:
+            return None
+        record = self.record_at(position)
+        return None if record.get_id() in self.datastore else record
+
+    def base_position(self, id: UUID) -> Optional[int]:
+        """Where the record with id is in the base, None unless it is read from there"""
+        if self.base is None or id in self.datastore:
+            return None
+        position = self.base.find_id(id)
+        if position is None or position in self.deleted:
+            return None
+        return position
+
+    def holds(self, id: UUID) -> bool:
+        return id in self.datastore or self.base_position(id) is not None
+
+    def at_position(self, position: int) -> T:
+        """The record from position in the base, from memory if it has been read"""
+        entries = self.insertion_order
+        i = entries.bisect_left((position,))
+        if i < len(entries) and entries[i][0] == position:
+            return self.datastore[entries[i][1]]
+        return self.record_at(position)
+
+    def restore(
+        self, records: Sequence[T], resources: Sequence[Mapping], positions: List[int]
+    ) -> None:
+        """Puts records from the base into memory, keeping their place in the order"""
+        for record, resource, position in zip(records, resources, positions):
+            id = record.get_id()
+            self.datastore[id] = record
+            self.sequence_numbers[id] = position
+            self.index_values(record, resource)
+        self.insertion_order.update(
+            sorted((p, r.get_id()) for p, r in zip(positions, records))
+        )
+        self.index_sorted(list(zip(records, resources)))
+
+    def hydrate_batch(self, base: Snapshot, positions: range) -> None:
+        resources = [base.resource(p) for p in positions]
+        records = [
+            self.touched.get(p) or self.from_dict(r)
+            for p, r in zip(positions, resources)
+        ]
+        with self.lock:
+            # anything changed or deleted since is in memory already or gone
+            kept = [
+                i
+                for i, (p, r) in enumerate(zip(positions, records))
+                if p not in self.deleted and r.get_id() not in self.datastore
+            ]
+            self.restore(
+                [records[i] for i in kept],
+                [resources[i] for i in kept],
+                [positions[i] for i in kept],
+            )
+
+    def hydrate(self) -> None:
+        """
+        Reads every record left in the base into memory and closes it. The records are
+        parsed without the lock, which is only held while each batch is added.
+        """
+        base = self.base
+        if base is None:
+            return
+
+        for start in range(0, base.count, LOAD_BATCH):
+            if self.stopping:
+                return
+            self.hydrate_batch(base, range(start, min(base.count, start + LOAD_BATCH)))
+
+        with self.lock:
+            # not closed, get_all may still be reading it, the map goes with the last
+            # reference to it
+            self.base = None
+            self.touched = {}
+            self.deleted = SortedIndex()
+        self.loaded.set()
+
+    def start_hydrating(self) -> None:
+        """Hydrates the store on a thread of its own, loaded is set once it is done"""
+        if self.base is None:
+            return
+        self.hydrate_thread = threading.Thread(
+            target=self.hydrate, name="snapshot hydration", daemon=True
+        )
+        self.hydrate_thread.start()
+
+    def stop_hydrating(self) -> None:
+        self.stopping = True
+        if self.hydrate_thread is not None:
+            self.hydrate_thread.join()
+
+    def check_unique(self, record: T) -> None:
+        super().check_unique(record)
+        if self.base is None:
+            return
+        for attribute in self.key_attributes:
+            value = getattr(record, attribute, None)
+            if not isinstance(value, str):
+                continue
+            holder = self.from_base(self.base.find_key(attribute, value))
+            if holder is not None and holder.get_id() != record.get_id():
+                raise exceptions.ResourceConflict(
+                    f"Could not store record, {attribute} {value!r} is already in use"
+                )
+
+    @locked
+    def create(self, new_record: T) -> None:
+        if self.base_position(new_record.get_id()) is not None:
+            raise exceptions.ResourceConflict(
+                "Could not create record {record}".format(record=new_record)
+            )
+        super().create(new_record)
+
+    @locked
+    def create_many(
+        self, new_records: Sequence[T], resources: Optional[Sequence[Mapping]] = None
+    ) -> List[Optional[exceptions.SCIMException]]:
+        if self.base is None:
+            return super().create_many(new_records, resources)
+
+        # records already in the base are turned away, the rest created together
+        errors: List[Optional[exceptions.SCIMException]] = []
+        new = []
+        for i, record in enumerate(new_records):
+            errors.append(None)
+            if self.base_position(record.get_id()) is None:
+                new.append(i)
+            else:
+                errors[i] = exceptions.ResourceConflict(
+                    "Could not create record {record}".format(record=record)
+                )
+
+        created = super().create_many(
+            [new_records[i] for i in new],
+            [resources[i] for i in new] if resources is not None else None,
+        )
+        for i, error in zip(new, created):
+            errors[i] = error
+        return errors
+
+    @locked
+    def get_by_id(self, key: UUID) -> T:
+        position = self.base_position(key)
+        if position is None:
+            return super().get_by_id(key)
+        return self.record_at(position)
+
+    @locked
+    def update(self, updated_record: T) -> None:
+        position = self.base_position(updated_record.get_id())
+        if position is None:
+            super().update(updated_record)
+            return
+
+        # memory holds the record from now on, in its place from the base
+        self.check_unique(updated_record)
+        self.restore([updated_record], [updated_record.to_dict()], [position])
+
+    @locked
+    def delete_by_id(self, key: UUID) -> None:
+        if self.base is None:
+            super().delete_by_id(key)
+            return
+
+        position = self.base.find_id(key)
+        if key in self.datastore:
+            super().delete_by_id(key)
+        elif position is None or position in self.deleted:
+            raise exceptions.ResourceMissing()
+        if position is not None and position not in self.deleted:
+            self.deleted.add(position)
+
+    def get_all(self) -> Sequence[T]:
+        """
+        Every record, in insertion order while there is a base. The records not read
+        from the base yet are parsed without the lock, which is only held once they
+        all have been to put the list together.
+        """
+        with self.lock:
+            base = self.base
+            touched = self.touched
+        if base is None:
+            return super().get_all()
+
+        for position in range(base.count):
+            if position not in touched:
+                touched[position] = self.from_dict(base.resource(position))
+
+        with self.lock:
+            if self.base is None:
+                # hydrated while the base was read
+                return super().get_all()
+            deleted = set(self.deleted)
+            records = []
+            for position in range(base.count):
+                if position not in deleted:
+                    record = self.record_at(position)
+                    # the record from memory if it was changed or read in since
+                    records.append(self.datastore.get(record.get_id(), record))
+            first_created = self.insertion_order.bisect_left((base.count,))
+            created = self.insertion_order[first_created : len(self.insertion_order)]
+            records.extend(self.datastore[id] for _, id in created)
+            return records
+
+    @locked
+    def get_page(self, start_index: int, count: int) -> Tuple[int, Sequence[T]]:
+        base = self.base
+        if base is None:
+            return super().get_page(start_index, count)
+
+        # every record from the base, read or not, comes before those created since
+        in_base = base.count - len(self.deleted)
+        first_created = self.insertion_order.bisect_left((base.count,))
+        total = in_base + len(self.insertion_order) - first_created
+
+        offset = start_index - 1
+        # the first position with offset records from the base before it
+        position = bisect.bisect_left(
+            range(base.count),
+            offset + 1,
+            key=lambda p: p + 1 - self.deleted.bisect_right(p),
+        )
+        records: List[T] = []
+        while len(records) < count and position < base.count:
+            if position not in self.deleted:
+                records.append(self.at_position(position))
+            position += 1
+
+        start = first_created + max(0, offset - in_base)
+        entries = self.insertion_order[start : start + count - len(records)]
+        records.extend(self.datastore[id] for _, id in entries)
+        return total, records
+
+    @locked
+    def lookup(self, attribute: str, value: Any) -> Optional[Sequence[T]]:
+        if self.base is None:
+            return super().lookup(attribute, value)
+        if attribute != "id" and attribute not in self.key_attributes:
+            # the base has no index for it
+            return None
+
+        found = super().lookup(attribute, value)
+        if found:
+            return found
+        if attribute == "id":
+            try:
+                position = self.base.find_id(UUID(str(value)))
+            except ValueError:
+                return []
+        elif isinstance(value, str):
+            position = self.base.find_key(attribute, value)
+        else:
+            return []
+
+        record = self.from_base(position)
+        # filters compare against the canonical string form of the id
+        if record is None or attribute == "id" and str(record.get_id()) != value:
+            return []
+        return [record]
+
+    @locked
+    def lookup_size(self, attribute: str, value: Any) -> Optional[int]:
+        if self.base is None:
+            return super().lookup_size(attribute, value)
+        # at most one record, which is read from the base if it is not in memory
+        found = self.lookup(attribute, value)
+        return None if found is None else len(found)
+
+    @locked
+    def range_lookup(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[Sequence[T]]:
+        if self.base is not None:
+            return None
+        return super().range_lookup(attribute, lower, upper)
+
+    @locked
+    def range_size(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[int]:
+        if self.base is not None:
+            return None
+        return super().range_size(attribute, lower, upper)
+
+    @locked
+    def get_sorted_page(
+        self, attribute: str, ascending: bool, start_index: int, count: int
+    ) -> Optional[Tuple[int, Sequence[T]]]:
+        if self.base is not None:
+            return None
+        return super().get_sorted_page(attribute, ascending, start_index, count)
@@ -0,0 +1,593 @@
+"""
+Durable queue of changes waiting to be sent downstream
+
+OutboxDispatcher commits every change to a SQLite journal before the handler that made
+it returns, so an acknowledged change survives the process going away. Its workers
+drain the journal, retrying failed deliveries with exponential backoff, or after as long
+as the server asks for with Retry-After, until they go through or are given up on.
+Changes to the same resource are delivered one at a time in the order they were made,
+and a replacement of a resource which still has a change waiting is folded into it, so
+only the latest version of the resource is sent. Holding changes back for a coalesce
+window gives later replacements time to be folded in, ChangeDispatcher folds nothing.
+The version each resource was last delivered at is kept so replacements can be sent
+as a PATCH of just what changed. Given BulkLimits, changes to different resources
+which are due together go out in RFC 7644 /Bulk requests.
+"""
+
+import asyncio
+import json
+import random
+import sqlite3
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from collections import Counter
+from typing import (
+    Callable,
+    Collection,
+    Dict,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    get_args,
+)
+import requests
+from sync_app.scim.resource import ResourceWithMeta
+from sync_app.scim.bulk import BulkLimits, BulkOperation, BulkRequest, BulkResponse
+from sync_app.dispatcher import call_on_loop
+from sync_app.server import ChangeRequest, Operation, SCIMServer
+
+DEFAULT_OUTBOX_PATH = "outbox.sqlite3"
+DEFAULT_WORKERS = 8
+DEFAULT_MAX_ATTEMPTS = 10
+# seconds, the delay doubles with every failed attempt up to MAX_DELAY
+BASE_DELAY = 0.5
+MAX_DELAY = 300.0
+# longest a worker sleeps before checking the journal again
+POLL_INTERVAL = 1.0
+# seconds a change waits for later changes to the same resource to fold into it, as
+# configured by the app. OutboxDispatcher itself sends changes as soon as they are due
+# unless given a window, folding them only into a backlog that has built up anyway.
+DEFAULT_COALESCE_WINDOW = 0.5
+
+# statuses worth trying again, anything else below 200 or from 300 up is given up on
+RETRYABLE_STATUSES = frozenset([408, 425, 429, 500, 502, 503, 504])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outbox (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    resource_key TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    body TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS outbox_resource ON outbox (resource_key, seq);
+CREATE TABLE IF NOT EXISTS downstream_versions (
+    resource_key TEXT PRIMARY KEY,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    seq INTEGER PRIMARY KEY,
+    resource_key TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    body TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    last_error TEXT
+);
+"""
+
+
+DeliveryOutcome = Literal["delivered", "patched", "skipped", "retried", "failed"]
+
+
+@dataclass(frozen=True)
+class OutboxEntry:
+    seq: int
+    # "<resourceType>/<id>", what changes are ordered and coalesced by
+    resource_key: str
+    operation: Operation
+    change: ChangeRequest
+    attempts: int
+
+
+def resource_key(resource: ResourceWithMeta) -> str:
+    return f"{resource.meta.resourceType}/{resource.id}"
+
+
+ENTRY_COLUMNS = "seq, resource_key, operation, method, path, body, attempts"
+
+
+def entry_from_row(row) -> OutboxEntry:
+    seq, key, operation, method, path, body, attempts = row
+    return OutboxEntry(
+        seq, key, operation, ChangeRequest(method, path, json.loads(body)), attempts
+    )
+
+
+class Outbox:
+    """SQLite journal of undelivered changes, oldest first"""
+
+    def __init__(self, path: str = DEFAULT_OUTBOX_PATH):
+        # autocommit, every statement is its own durable transaction
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.executescript(SCHEMA)
+        self.lock = threading.Lock()
+
+    def append(
+        self, key: str, operation: Operation, change: ChangeRequest, due: float
+    ) -> int:
+        with self.lock:
+            cursor = self.connection.execute(
+                "INSERT INTO outbox"
+                " (resource_key, operation, method, path, body, next_attempt)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    operation,
+                    change.method,
+                    change.path,
+                    json.dumps(change.body),
+                    due,
+                ),
+            )
+        assert cursor.lastrowid is not None
+        return cursor.lastrowid
+
+    def last_pending(self, key: str) -> Optional[OutboxEntry]:
+        """The most recent change to the resource which has not been delivered"""
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {ENTRY_COLUMNS} FROM outbox WHERE resource_key = ?"
+                " ORDER BY seq DESC LIMIT 1",
+                (key,),
+            ).fetchone()
+        return entry_from_row(row) if row is not None else None
+
+    def replace(self, entry: OutboxEntry, change: ChangeRequest, due: float) -> None:
+        """Swaps in a newer version of an undelivered change, no earlier than due"""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE outbox SET method = ?, path = ?, body = ?,"
+                " next_attempt = MAX(next_attempt, ?) WHERE seq = ?",
+                (change.method, change.path, json.dumps(change.body), due, entry.seq),
+            )
+
+    def next_due(self, now: float, exclude: Collection[str] = ()) -> Optional[OutboxEntry]:
+        """
+        The oldest change that is due and is the oldest change still pending for its
+        resource, skipping resources in exclude
+        """
+        entries = self.due(now, exclude, 1)
+        return entries[0] if entries else None
+
+    def due(
+        self, now: float, exclude: Collection[str] = (), limit: int = 1
+    ) -> List[OutboxEntry]:
+        """Up to limit changes as next_due picks them, one per resource, oldest first"""
+        with self.lock:
+            rows = self.connection.execute(
+                f"SELECT {ENTRY_COLUMNS} FROM outbox o"
+                " WHERE next_attempt <= ? AND seq ="
+                " (SELECT MIN(seq) FROM outbox p WHERE p.resource_key = o.resource_key)"
+                " ORDER BY seq LIMIT ?",
+                # every excluded resource can hold back at most one row
+                (now, len(exclude) + limit),
+            ).fetchall()
+
+        entries = [entry_from_row(row) for row in rows]
+        return [e for e in entries if e.resource_key not in exclude][:limit]
+
+    def next_attempt(self) -> Optional[float]:
+        with self.lock:
+            (next_attempt,) = self.connection.execute(
+                "SELECT MIN(next_attempt) FROM outbox"
+            ).fetchone()
+        return next_attempt
+
+    def complete(self, entry: OutboxEntry) -> None:
+        """Removes a delivered change, recording its body as what downstream now has"""
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute("DELETE FROM outbox WHERE seq = ?", (entry.seq,))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO downstream_versions (resource_key, body)"
+                " VALUES (?, ?)",
+                (entry.resource_key, json.dumps(entry.change.body)),
+            )
+
+    def downstream_version(self, key: str) -> Optional[Mapping]:
+        """The resource as it was last delivered downstream, if it has been"""
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT body FROM downstream_versions WHERE resource_key = ?", (key,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def retry(self, entry: OutboxEntry, at: float, error: str) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "UPDATE outbox SET attempts = ?, last_error = ? WHERE seq = ?",
+                (entry.attempts + 1, error, entry.seq),
+            )
+            # later changes to the resource wait behind this one
+            self.connection.execute(
+                "UPDATE outbox SET next_attempt = MAX(next_attempt, ?)"
+                " WHERE resource_key = ?",
+                (at, entry.resource_key),
+            )
+
+    def bury(self, entry: OutboxEntry, error: str) -> None:
+        """Gives up on a change, keeping it in dead_letters for inspection"""
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.connection.execute(
+                "INSERT INTO dead_letters"
+                " SELECT seq, resource_key, operation, method, path, body, ?, ?"
+                " FROM outbox"
+                " WHERE seq = ?",
+                (entry.attempts + 1, error, entry.seq),
+            )
+            self.connection.execute("DELETE FROM outbox WHERE seq = ?", (entry.seq,))
+
+    def pending(self) -> int:
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def dead(self) -> int:
+        with self.lock:
+            return self.connection.execute(
+                "SELECT COUNT(*) FROM dead_letters"
+            ).fetchone()[0]
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+
+def retry_after(response: requests.Response, now: float) -> Optional[float]:
+    """Seconds the server asked us to wait with Retry-After, if it did"""
+    value = response.headers.get("Retry-After", None)
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - now)
+    except (TypeError, ValueError):
+        return None
+
+
+def backoff(attempts: int, base_delay: float = BASE_DELAY, max_delay: float = MAX_DELAY):
+    """Delay before retrying after attempts failures, jittered so retries spread out"""
+    delay = min(max_delay, base_delay * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+# a change on its way downstream, as sent on its own and as part of a bulk request
+Delivery = Tuple[OutboxEntry, ChangeRequest, BulkOperation]
+
+
+def pack(deliveries: Sequence[Delivery], limits: BulkLimits) -> List[List[Delivery]]:
+    """
+    Splits deliveries, in order, into batches which each fit in one bulk request. A
+    change too large to share a request with any other ends up in a batch of its own.
+    """
+    envelope = len(json.dumps(BulkRequest([]).to_dict()))
+    batches: List[List[Delivery]] = []
+    batch: List[Delivery] = []
+    size = envelope
+    for delivery in deliveries:
+        # the operation and the ", " separating it from the next
+        operation_size = len(json.dumps(delivery[2].to_dict())) + 2
+        if batch and (
+            len(batch) >= limits.max_operations
+            or size + operation_size > limits.max_payload_size
+        ):
+            batches.append(batch)
+            batch, size = [], envelope
+        batch.append(delivery)
+        size += operation_size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class OutboxDispatcher:
+    outbox: Outbox
+    server: SCIMServer
+    workers: int
+    max_attempts: int
+
+    def __init__(
+        self,
+        outbox: Outbox,
+        server: SCIMServer,
+        workers: int = DEFAULT_WORKERS,
+        max_attempts: int = DEFAULT_MAX_ATTEMPTS,
+        base_delay: float = BASE_DELAY,
+        max_delay: float = MAX_DELAY,
+        coalesce_window: float = 0.0,
+        bulk: Optional[BulkLimits] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        assert workers > 0, "A dispatcher needs at least one worker"
+        self.outbox = outbox
+        self.server = server
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.coalesce_window = coalesce_window
+        # None sends every change in a request of its own
+        self.bulk = bulk
+        self.clock = clock
+        # resource key -> seq of the change being delivered for it, later changes to
+        # the resource have to wait and cannot be folded into that one
+        self.in_flight: Dict[str, int] = {}
+        # held while changes are claimed for delivery and while one is journaled, so a
+        # replacement is never folded into a change a worker has just taken
+        self.claims = threading.Lock()
+        self.wake = asyncio.Event()
+        # the loop the workers run on, set by start
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopping = False
+        self.tasks: List[asyncio.Task] = []
+        self.outcomes: Counter = Counter()
+        # downstream requests saved by folding changes together
+        self.coalesced = 0
+
+    def handle_resource_change(
+        self, operation: Operation, resource: ResourceWithMeta
+    ) -> None:
+        """
+        Journals the change, once this returns it will be delivered eventually. Blocks
+        until the journal is on disk, so handlers call it off the event loop.
+        """
+        key = resource_key(resource)
+        due = self.clock() + self.coalesce_window
+
+        with self.claims:
+            if operation == "replace" and self.coalesce(key, resource, due):
+                self.coalesced += 1
+            else:
+                change = self.server.change_request(operation, resource)
+                if change is None:
+                    return
+                self.outbox.append(key, operation, change, due)
+        call_on_loop(self.loop, self.wake.set)
+
+    def coalesce(self, key: str, resource: ResourceWithMeta, due: float) -> bool:
+        """
+        Folds a replacement of resource into its newest undelivered change, which then
+        sends the latest version instead. False if there is nothing to fold it into.
+        """
+        previous = self.outbox.last_pending(key)
+        if previous is None or self.in_flight.get(key, None) == previous.seq:
+            return False
+
+        # a pending add stays an add, it just creates the latest version
+        change = self.server.change_request(previous.operation, resource)
+        if change is None:
+            return False
+        self.outbox.replace(previous, change, due)
+        return True
+
+    async def start(self) -> None:
+        if self.tasks:
+            return
+        self.loop = asyncio.get_running_loop()
+        self.stopping = False
+        self.tasks = [asyncio.create_task(self.work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        """Lets deliveries in progress finish, anything else stays in the journal"""
+        self.stopping = True
+        self.wake.set()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    async def drain(self, timeout: Optional[float] = None) -> None:
+        """Waits until every journaled change has been delivered or given up on"""
+
+        async def empty():
+            while await asyncio.to_thread(self.outbox.pending) > 0:
+                await asyncio.sleep(0.01)
+
+        await asyncio.wait_for(empty(), timeout)
+
+    async def work(self) -> None:
+        while not self.stopping:
+            self.wake.clear()
+            limit = self.bulk.max_operations if self.bulk is not None else 1
+            # the journal is only ever read and written off the event loop, its lock
+            # may be held by a delivery or a handler waiting for an fsync
+            entries = await asyncio.to_thread(self.claim, limit)
+            if not entries:
+                await self.sleep()
+                continue
+
+            try:
+                if len(entries) == 1:
+                    outcomes = [await asyncio.to_thread(self.deliver, entries[0])]
+                else:
+                    outcomes = await asyncio.to_thread(self.deliver_batch, entries)
+                # counted here rather than in deliver's thread so they are not racy
+                self.outcomes.update(outcomes)
+            except Exception as e:
+                # leave them in the journal, they are retried once they are due again
+                traceback.print_exception(e)
+            finally:
+                for entry in entries:
+                    del self.in_flight[entry.resource_key]
+                self.wake.set()
+
+    def claim(self, limit: int) -> List[OutboxEntry]:
+        """Marks up to limit due changes in flight and returns them for delivery"""
+        with self.claims:
+            entries = self.outbox.due(self.clock(), self.in_flight, limit)
+            for entry in entries:
+                self.in_flight[entry.resource_key] = entry.seq
+        return entries
+
+    async def sleep(self) -> None:
+        """Waits for a new or finished change, or for the next retry to come due"""
+        timeout = POLL_INTERVAL
+        next_attempt = await asyncio.to_thread(self.outbox.next_attempt)
+        if next_attempt is not None and next_attempt > self.clock():
+            timeout = min(timeout, next_attempt - self.clock())
+        try:
+            await asyncio.wait_for(self.wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def deliver(self, entry: OutboxEntry) -> DeliveryOutcome:
+        """Sends a change downstream and records how it went in the journal"""
+        request = self.minimal_request(entry)
+        if request is None:
+            self.outbox.complete(entry)
+            return "skipped"
+        return self.send(entry, request)
+
+    def deliver_batch(self, entries: Sequence[OutboxEntry]) -> List[DeliveryOutcome]:
+        """
+        Sends changes to different resources downstream in as few bulk requests as
+        self.bulk allows, and records how each of them went in the journal
+        """
+        assert self.bulk is not None, "Batches are only delivered in bulk mode"
+        outcomes: List[DeliveryOutcome] = []
+        deliveries: List[Delivery] = []
+        for entry in entries:
+            request = self.minimal_request(entry)
+            if request is None:
+                self.outbox.complete(entry)
+                outcomes.append("skipped")
+            else:
+                operation = self.server.bulk_operation(request, str(entry.seq))
+                deliveries.append((entry, request, operation))
+
+        for batch in pack(deliveries, self.bulk):
+            if len(batch) == 1:
+                entry, request, _ = batch[0]
+                outcomes.append(self.send(entry, request))
+            else:
+                outcomes.extend(self.send_bulk(batch))
+        return outcomes
+
+    def minimal_request(self, entry: OutboxEntry) -> Optional[ChangeRequest]:
+        # worked out on every attempt, downstream may have moved on since the last one
+        return self.server.delta_request(
+            entry.change, self.outbox.downstream_version(entry.resource_key)
+        )
+
+    def send(self, entry: OutboxEntry, request: ChangeRequest) -> DeliveryOutcome:
+        try:
+            response = self.server.send(request)
+        except requests.RequestException as e:
+            return self.reschedule(entry, None, repr(e))
+
+        return self.settle(
+            entry,
+            request,
+            response.status_code,
+            retry_after(response, self.clock()),
+            response.text,
+        )
+
+    def send_bulk(self, batch: Sequence[Delivery]) -> List[DeliveryOutcome]:
+        try:
+            response = self.server.send_bulk(BulkRequest(o for _, _, o in batch))
+        except requests.RequestException as e:
+            return [self.reschedule(entry, None, repr(e)) for entry, _, _ in batch]
+
+        if response.status_code == 413:
+            # downstream takes less than max_payload_size, fall back to one at a time
+            return [self.send(entry, request) for entry, request, _ in batch]
+
+        if not 200 <= response.status_code < 300:
+            delay = retry_after(response, self.clock())
+            return [
+                self.settle(entry, request, response.status_code, delay, response.text)
+                for entry, request, _ in batch
+            ]
+
+        try:
+            results = {
+                result.bulkId: result
+                for result in BulkResponse.from_dict(response.json()).operations
+            }
+        except (ValueError, KeyError, TypeError, AssertionError) as e:
+            error = f"Unreadable bulk response: {e!r}"
+            return [self.reschedule(entry, None, error) for entry, _, _ in batch]
+
+        outcomes = []
+        for entry, request, operation in batch:
+            result = results.get(operation.bulkId, None)
+            if result is None:
+                # downstream stopped early, e.g. after failOnErrors errors
+                error = "Not processed by bulk request"
+                outcomes.append(self.reschedule(entry, None, error))
+            else:
+                detail = json.dumps(result.response)
+                outcomes.append(
+                    self.settle(entry, request, result.status, None, detail)
+                )
+        return outcomes
+
+    def settle(
+        self,
+        entry: OutboxEntry,
+        request: ChangeRequest,
+        status: int,
+        delay: Optional[float],
+        detail: str,
+    ) -> DeliveryOutcome:
+        """Records the status downstream answered request for entry with"""
+        if 200 <= status < 300:
+            self.outbox.complete(entry)
+            return "patched" if request.method == "PATCH" else "delivered"
+
+        if status in RETRYABLE_STATUSES:
+            return self.reschedule(entry, delay, f"HTTP {status}")
+
+        self.outbox.bury(entry, f"HTTP {status}: {detail}")
+        return "failed"
+
+    def reschedule(
+        self, entry: OutboxEntry, delay: Optional[float], error: str
+    ) -> DeliveryOutcome:
+        if entry.attempts + 1 >= self.max_attempts:
+            self.outbox.bury(entry, error)
+            return "failed"
+
+        if delay is None:
+            delay = backoff(entry.attempts + 1, self.base_delay, self.max_delay)
+        self.outbox.retry(entry, self.clock() + delay, error)
+        return "retried"
+
+    def stats(self) -> Mapping[str, int]:
+        return {
+            "workers": self.workers,
+            "pending": self.outbox.pending(),
+            "in_flight": len(self.in_flight),
+            **{outcome: self.outcomes[outcome] for outcome in get_args(DeliveryOutcome)},
+            "coalesced": self.coalesced,
+            "dead": self.outbox.dead(),
+        }
@@ -0,0 +1,150 @@
+"""
+Compact, parser independent representation of RFC 7644 filters
+
+The abnf parse tree is large and is shaped by the grammar rather than by the meaning of
+the filter. Everything downstream of parsing (compiling predicates, planning queries)
+works on these nodes instead.
+"""
+
+import json
+from dataclasses import dataclass
+from abnf.parser import NodeVisitor, Node
+from typing import List, Tuple, TypeAlias, Union
+
+FilterPath: TypeAlias = Tuple[str, ...]
+FilterValue: TypeAlias = Union[None, bool, float, str]
+
+
+@dataclass(frozen=True)
+class Comparison:
+    path: FilterPath
+    operator: str
+    value: FilterValue
+
+
+@dataclass(frozen=True)
+class Present:
+    path: FilterPath
+
+
+@dataclass(frozen=True)
+class And:
+    operands: Tuple["Expression", ...]
+
+
+@dataclass(frozen=True)
+class Or:
+    operands: Tuple["Expression", ...]
+
+
+@dataclass(frozen=True)
+class Not:
+    operand: "Expression"
+
+
+@dataclass(frozen=True)
+class AttributeGroup:
+    path: FilterPath
+    filter: "Expression"
+
+
+Expression: TypeAlias = Union[Comparison, Present, And, Or, Not, AttributeGroup]
+
+
+def strip_space_nodes(nodes: List[Node]) -> List[Node]:
+    return [n for n in nodes if n.name != "SP"]
+
+
+def conjunction(operands: List[Expression]) -> Expression:
+    if len(operands) == 1:
+        return operands[0]
+    return And(tuple(operands))
+
+
+def disjunction(operands: List[Expression]) -> Expression:
+    if len(operands) == 1:
+        return operands[0]
+    return Or(tuple(operands))
+
+
+class FilterASTBuilder(NodeVisitor):
+    """Converts an abnf filter parse tree into Expression nodes"""
+
+    def visit_filter(self, node: Node) -> Expression:
+        assert len(node.children) == 1, "Filters should have only 1 child"
+        return self.visit(node.children[0])
+
+    def visit_expression(self, node: Node) -> Expression:
+        assert len(node.children) == 1, "Expressions should have only 1 child"
+        return self.visit(node.children[0])
+
+    def visit_precedencegroup(self, node: Node) -> Expression:
+        children = strip_space_nodes(node.children)
+        assert len(children) == 3, "Precdence groups should have exactly 3 children"
+        return self.visit(children[1])
+
+    def visit_prefixlogicalexpression(self, node: Node) -> Expression:
+        assert (
+            node.children[0].value.lower() == "not"
+        ), "Not is the only valid prefix logical operator"
+        return Not(self.visit(node.children[-1]))
+
+    def visit_infixlogicalexpression(self, node: Node) -> Expression:
+        # "and" binds tighter than "or" so split the flat chain on "or"
+        operations: List[List[Expression]] = [[self.visit(node.children[0])]]
+
+        for predicate in node.children[1:]:
+            op = predicate.children[1].value.lower()
+            operand = self.visit(predicate.children[3])
+
+            if op == "or":
+                operations.append([operand])
+
+            elif op == "and":
+                operations[-1].append(operand)
+
+        return disjunction([conjunction(ands) for ands in operations])
+
+    def visit_postfixassertion(self, node: Node) -> Expression:
+        assert (
+            node.children[2].value.lower() == "pr"
+        ), "PR is the only valid postfix assertion"
+        return Present(self.visit(node.children[0]))
+
+    def visit_infixassertion(self, node: Node) -> Expression:
+        return Comparison(
+            path=self.visit(node.children[0]),
+            operator=node.children[2].value.lower(),
+            value=self.visit(node.children[4]),
+        )
+
+    def visit_infixassertionvalue(self, node: Node) -> FilterValue:
+        assert len(node.children) == 1, "Infix assertions should only have one child"
+        return self.visit(node.children[0])
+
+    def visit_attributegroup(self, node: Node) -> Expression:
+        children = strip_space_nodes(node.children)
+        return AttributeGroup(path=self.visit(children[0]), filter=self.visit(children[2]))
+
+    def visit_attributepath(self, node: Node) -> FilterPath:
+        # Ignore URL: prefixing for now
+        return tuple(
+            str(segment.value)
+            for segment in node.children
+            if segment.name == "attributePathSegment"
+        )
+
+    def visit_false(self, _) -> bool:
+        return False
+
+    def visit_null(self, _) -> None:
+        return None
+
+    def visit_true(self, _) -> bool:
+        return True
+
+    def visit_number(self, node: Node) -> float:
+        return float(node.value)
+
+    def visit_string(self, node: Node) -> str:
+        return json.loads(node.value)
@@ -0,0 +1,250 @@
+"""
+Hand written tokenizer and recursive descent parser for the RFC 7644 filter grammar
+
+Produces the same Expression nodes as FilterASTBuilder does for the abnf grammar in
+scim_query_filter.py. The differences from it are:
+
+- runs of spaces are accepted wherever the grammar allows a single SP, the optional [SP]
+  included, so `userName  eq "a"` and `not  (userName pr)` parse
+- URI prefixes of attribute paths are checked against RFC 3986 with a regular expression,
+  prefixes holding parentheses or brackets (IP literal hosts) are not accepted
+"""
+
+import json
+import re
+from dataclasses import dataclass
+from sync_app import exceptions
+from sync_app.parsers.filter_ast import (
+    Expression,
+    Comparison,
+    Present,
+    Not,
+    AttributeGroup,
+    FilterPath,
+    FilterValue,
+    conjunction,
+    disjunction,
+)
+from typing import List, Optional
+
+COMPARISON_OPERATORS = frozenset(["eq", "ne", "co", "sw", "ew", "gt", "lt", "ge", "le"])
+LOGICAL_OPERATORS = frozenset(["and", "or"])
+LITERALS: dict = {"true": True, "false": False, "null": None}
+
+TOKEN_PATTERN = re.compile(
+    r"""
+    (?P<space>\x20+)
+    |(?P<punctuation>[()\[\]])
+    |(?P<string>"(?:[^"\\\x00-\x1f]|\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})*")
+    |(?P<number>-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][+-]?[0-9]+)?)
+    |(?P<word>[A-Za-z][A-Za-z0-9._:\-/?\#%@!$&'*+,;=~]*)
+    """,
+    re.VERBOSE,
+)
+# RFC 3986 URI, a scheme followed by an authority and path, or by a path alone
+PCHAR = r"(?:[A-Za-z0-9\-._~!$&'()*+,;=:@]|%[0-9A-Fa-f]{2})"
+URI_PATTERN = re.compile(
+    rf"""
+    [A-Za-z][A-Za-z0-9+.\-]*:
+    (?:
+        //(?:(?:[A-Za-z0-9\-._~!$&'()*+,;=:]|%[0-9A-Fa-f]{{2}})*@)?
+        (?:[A-Za-z0-9\-._~!$&'()*+,;=]|%[0-9A-Fa-f]{{2}})*(?::[0-9]*)?
+        (?:/{PCHAR}*)*
+        |/?(?:{PCHAR}+(?:/{PCHAR}*)*)?
+    )
+    (?:\?(?:{PCHAR}|[/?])*)?
+    (?:\#(?:{PCHAR}|[/?])*)?
+    \Z
+    """,
+    re.VERBOSE,
+)
+SEGMENT_PATTERN = re.compile(r"[A-Za-z][A-Za-z0-9_\-]*\Z")
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+    position: int
+    space_before: bool
+
+
+def tokenize(filter: str) -> List[Token]:
+    tokens = []
+    position = 0
+    space_before = False
+    end = len(filter)
+    match = TOKEN_PATTERN.match
+
+    while position < end:
+        m = match(filter, position)
+        if m is None:
+            raise exceptions.InvalidSCIMFilter(
+                f"Unexpected character {filter[position]!r} at position {position}"
+            )
+
+        kind = m.lastgroup
+        assert kind is not None, "every alternative in the token pattern is named"
+        if kind == "space":
+            space_before = True
+        else:
+            tokens.append(Token(kind, m.group(), position, space_before))
+            space_before = False
+        position = m.end()
+
+    tokens.append(Token("end", "", end, space_before))
+    return tokens
+
+
+def parse_path(token: Token) -> FilterPath:
+    text = token.text
+    uri = None
+    if ":" in text:
+        # Ignore URI prefixing, matching the abnf visitors
+        uri, text = text.rsplit(":", 1)
+
+    segments = tuple(text.split("."))
+    valid_uri = uri is None or URI_PATTERN.match(uri)
+    if not valid_uri or not all(SEGMENT_PATTERN.match(s) for s in segments):
+        raise exceptions.InvalidSCIMFilter(
+            f"Invalid attribute path {token.text!r} at position {token.position}"
+        )
+
+    return segments
+
+
+class FilterParser:
+    tokens: List[Token]
+    index: int
+
+    def __init__(self, filter: str):
+        self.tokens = tokenize(filter)
+        self.index = 0
+
+    def error(self, expected: str) -> exceptions.InvalidSCIMFilter:
+        token = self.tokens[self.index]
+        found = repr(token.text) if token.kind != "end" else "end of filter"
+        return exceptions.InvalidSCIMFilter(
+            f"Expected {expected} but found {found} at position {token.position}"
+        )
+
+    def peek(self) -> Token:
+        return self.tokens[self.index]
+
+    def advance(self) -> Token:
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def expect(self, text: str) -> Token:
+        if self.peek().text != text:
+            raise self.error(repr(text))
+        return self.advance()
+
+    def expect_spaced(self, description: str) -> Token:
+        token = self.peek()
+        if not token.space_before or token.kind == "end":
+            raise self.error(description)
+        return self.advance()
+
+    def keyword(self, token: Token) -> Optional[str]:
+        return token.text.lower() if token.kind == "word" else None
+
+    def expect_unspaced(self, description: str) -> None:
+        if self.peek().space_before:
+            raise self.error(description)
+
+    def parse(self) -> Expression:
+        self.expect_unspaced("no space before the filter")
+        expression = self.parse_filter()
+        if self.peek().kind != "end":
+            raise self.error("end of filter")
+        self.expect_unspaced("no space after the filter")
+        return expression
+
+    def parse_filter(self) -> Expression:
+        # "and" binds tighter than "or", see FilterASTBuilder.visit_infixlogicalexpression
+        operations: List[List[Expression]] = [[self.parse_expression()]]
+
+        while True:
+            token = self.peek()
+            op = self.keyword(token)
+            if op not in LOGICAL_OPERATORS or not token.space_before:
+                break
+            self.advance()
+            if not self.peek().space_before:
+                raise self.error("a space after the logical operator")
+            operand = self.parse_expression()
+
+            if op == "or":
+                operations.append([operand])
+            else:
+                operations[-1].append(operand)
+
+        return disjunction([conjunction(ands) for ands in operations])
+
+    def parse_expression(self) -> Expression:
+        token = self.peek()
+
+        if token.text == "(":
+            return self.parse_precedence_group()
+
+        if token.kind != "word":
+            raise self.error("an attribute path or '('")
+
+        if self.keyword(token) == "not" and self.tokens[self.index + 1].text == "(":
+            self.advance()
+            return Not(self.parse_precedence_group())
+
+        path = parse_path(self.advance())
+
+        if self.peek().text == "[" and not self.peek().space_before:
+            self.advance()
+            self.expect_unspaced("no space after '['")
+            subfilter = self.parse_filter()
+            self.expect_unspaced("no space before ']'")
+            self.expect("]")
+            return AttributeGroup(path=path, filter=subfilter)
+
+        operator_token = self.expect_spaced("an operator")
+        operator = self.keyword(operator_token)
+
+        if operator == "pr":
+            return Present(path)
+
+        if operator not in COMPARISON_OPERATORS:
+            self.index -= 1
+            raise self.error("a comparison operator")
+
+        value = self.parse_value(self.expect_spaced("a value"))
+        return Comparison(path=path, operator=operator, value=value)
+
+    def parse_precedence_group(self) -> Expression:
+        self.expect("(")
+        expression = self.parse_filter()
+        self.expect(")")
+        return expression
+
+    def parse_value(self, token: Token) -> FilterValue:
+        if token.kind == "string":
+            return json.loads(token.text)
+
+        if token.kind == "number":
+            return float(token.text)
+
+        if token.kind == "word" and token.text in LITERALS:
+            return LITERALS[token.text]
+
+        self.index -= 1
+        raise self.error("a value")
+
+
+def parse_filter(filter: str) -> Expression:
+    return FilterParser(filter).parse()
+
+
+def parse_attribute_path(query: str) -> FilterPath:
+    tokens = tokenize(query)
+    if len(tokens) != 2 or tokens[0].kind != "word" or tokens[0].space_before:
+        raise exceptions.InvalidSCIMFilter(f"Invalid attribute path {query!r}")
+    return parse_path(tokens[0])
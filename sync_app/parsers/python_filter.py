@@ -1,13 +1,145 @@
-from abnf.parser import NodeVisitor, Node
+from abnf.parser import NodeVisitor, Node, ParseError
 from sync_app.parsers.scim_query_filter import Rule as SCIMQueryRule
+from sync_app.parsers import filter_parser
+from sync_app.parsers.filter_ast import (
+    FilterASTBuilder,
+    Expression,
+    Comparison,
+    Present,
+    And,
+    Or,
+    Not,
+    AttributeGroup,
+    FilterPath,
+    FilterValue,
+    strip_space_nodes,
+)
 from sync_app import exceptions
-
-from typing import List, TypeAlias, Mapping, Tuple, Callable, Type, Sequence
+from collections import OrderedDict, abc
+from datetime import datetime, timezone
+import operator as operators
+import os
+import threading
+
+from typing import (
+    Any,
+    List,
+    TypeAlias,
+    Mapping,
+    Tuple,
+    Callable,
+    Type,
+    Sequence,
+    Generic,
+    TypeVar,
+    Hashable,
+)
 
 AttributePathSegment: TypeAlias = str
 AttributePath = List[AttributePathSegment]
 MappingPredicate = Callable[[Mapping], bool]
 
+V = TypeVar("V")
+
+
+class FilterCache(Generic[V]):
+    """Bounded, thread safe LRU cache for the results of parsing filter strings"""
+
+    maxsize: int
+    hits: int
+    misses: int
+    evictions: int
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._entries: OrderedDict[Hashable, V] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], V]) -> V:
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+
+        # parse outside of the lock, at worst two threads parse the same filter
+        value = factory()
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def stats(self) -> Mapping[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+predicate_cache: FilterCache[MappingPredicate] = FilterCache()
+ast_cache: FilterCache[Expression] = FilterCache()
+path_cache: FilterCache[Tuple[AttributePathSegment, ...]] = FilterCache()
+
+
+def abnf_parse_filter(filter: str) -> Expression:
+    try:
+        result = SCIMQueryRule("filter").parse_all(filter)
+    except ParseError as e:
+        raise exceptions.InvalidSCIMFilter(f"Could not parse filter {filter!r}") from e
+    return FilterASTBuilder().visit(result)
+
+
+def abnf_parse_attribute_path(query: str) -> FilterPath:
+    try:
+        result = SCIMQueryRule("attributepath").parse_all(query)
+    except ParseError as e:
+        raise exceptions.InvalidSCIMFilter(f"Invalid attribute path {query!r}") from e
+    return tuple(PythonFilter().visit(result))
+
+
+FilterParserBackend: TypeAlias = Tuple[
+    Callable[[str], Expression], Callable[[str], FilterPath]
+]
+
+FILTER_PARSERS: Mapping[str, FilterParserBackend] = {
+    "abnf": (abnf_parse_filter, abnf_parse_attribute_path),
+    "native": (filter_parser.parse_filter, filter_parser.parse_attribute_path),
+}
+DEFAULT_FILTER_PARSER = os.environ.get("SCIM_FILTER_PARSER", "native")
+selected_filter_parser = DEFAULT_FILTER_PARSER
+
+
+def set_filter_parser(name: str) -> None:
+    """Selects which parser turns filter strings into ASTs, see FILTER_PARSERS"""
+    global selected_filter_parser
+    if name not in FILTER_PARSERS:
+        raise ValueError(f"Unknown filter parser {name}")
+    selected_filter_parser = name
+
+
+def get_filter_parser() -> str:
+    return selected_filter_parser
+
 
 def get_attribute_from_path(path: AttributePath, resource):
     for segment in path:
@@ -69,10 +201,6 @@ def path_in_resource(path, resource):
     return bool(get_attribute_from_path(path, resource))
 
 
-def strip_space_nodes(nodes: List[Node]):
-    return [n for n in nodes if n.name != "SP"]
-
-
 class SubattributeQueryExtractor(NodeVisitor):
     @staticmethod
     def parse_filter(query: str):
@@ -107,19 +235,38 @@ class SubattributeQueryExtractor(NodeVisitor):
 
 
 class PythonFilter(NodeVisitor):
+    """
+    Reference engine which evaluates filters by visiting the parse tree
+
+    parse_filter_to_predicate compiles through the filter AST instead so the parse
+    tree is only walked once per query rather than once per record.
+    """
+
     @staticmethod
-    def parse_filter_to_predicate(filter: str):
-        parser = SCIMQueryRule("filter")
-        result = parser.parse_all(filter)
-        visitor = PythonFilter()
-        return visitor.visit(result)
+    def parse_filter_to_predicate(filter: str) -> MappingPredicate:
+        # compiled predicates are stateless closures so they are safe to share
+        return predicate_cache.get_or_create(
+            (selected_filter_parser, filter),
+            lambda: compile_predicate(PythonFilter.parse_filter_to_ast(filter)),
+        )
+
+    @staticmethod
+    def parse_filter_to_ast(filter: str) -> Expression:
+        # ASTs are immutable so they are cached alongside the predicates
+        parse, _ = FILTER_PARSERS[selected_filter_parser]
+        return ast_cache.get_or_create(
+            (selected_filter_parser, filter), lambda: parse(filter)
+        )
 
     @staticmethod
     def parse_filter_to_path(query: str) -> AttributePath:
-        parser = SCIMQueryRule("attributepath")
-        result = parser.parse_all(query)
-        visitor = PythonFilter()
-        return visitor.visit(result)
+        _, parse = FILTER_PARSERS[selected_filter_parser]
+        # cache an immutable copy, callers get their own list
+        return list(
+            path_cache.get_or_create(
+                (selected_filter_parser, query), lambda: parse(query)
+            )
+        )
 
     def visit_filter(self, node: Node) -> MappingPredicate:
         assert len(node.children) == 1, "Filters should have only 1 child"
@@ -305,3 +452,255 @@ class PythonFilter(NodeVisitor):
 
     def visit_string(self, node: Node) -> str:
         return str(node.value[1:-1])
+
+
+NUMBER_TYPES = (int, float, complex)
+# attributes with the SCIM dateTime type, compared as datetimes rather than strings
+DATETIME_ATTRIBUTES = frozenset([("meta", "created"), ("meta", "lastModified")])
+ORDERING_OPERATORS: Mapping[str, Callable] = {
+    "gt": operators.gt,
+    "lt": operators.lt,
+    "ge": operators.ge,
+    "le": operators.le,
+}
+DATETIME_OPERATORS: Mapping[str, Callable] = {
+    "eq": operators.eq,
+    "ne": operators.ne,
+    **ORDERING_OPERATORS,
+}
+STRING_OPERATORS: Mapping[str, Callable] = {
+    "co": lambda attribute, value: value in attribute,
+    "sw": lambda attribute, value: attribute.startswith(value),
+    "ew": lambda attribute, value: attribute.endswith(value),
+}
+
+
+def parse_datetime(value) -> datetime:
+    """Parses a SCIM dateTime into an aware UTC datetime, naive values are taken as UTC"""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if not isinstance(value, datetime):
+        raise ValueError(f"{value!r} is not a dateTime")
+
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def sortable_value(path: FilterPath, value) -> Any:
+    """
+    The value records are ordered by on path, or None when it is missing or cannot be
+    ordered against other records, in which case the record sorts as null
+    """
+    if path in DATETIME_ATTRIBUTES:
+        try:
+            return parse_datetime(value)
+        except ValueError:
+            return None
+    return value if isinstance(value, str) else None
+
+
+def resolve_attribute(path: FilterPath, resource):
+    """
+    Like get_attribute_from_path but multi-valued attributes are traversed, so
+    emails.value resolves to the list of every email value
+    """
+    for segment in path:
+        if isinstance(resource, list):
+            values = [v.get(segment) for v in resource if isinstance(v, abc.Mapping)]
+            resource = [v for v in values if v is not None]
+            if not resource:
+                return None
+        elif isinstance(resource, abc.Mapping):
+            resource = resource.get(segment, None)
+            if resource is None:
+                return None
+        else:
+            return None
+
+    return resource
+
+
+def compile_attribute_getter(path: FilterPath) -> Callable[[Mapping], object]:
+    if len(path) == 1:
+        (head,) = path
+        return lambda r: r.get(head, None)
+
+    return lambda r: resolve_attribute(path, r)
+
+
+def compile_value_test(operator: str, value: FilterValue) -> Callable[[object], bool]:
+    """Builds the test a single attribute value must pass, see visit_infixassertion"""
+    if operator == "eq":
+        return lambda attribute_value: attribute_value == value
+
+    if operator == "ne":
+        return lambda attribute_value: attribute_value != value
+
+    if value is None:
+        # always reject attributes with None except for equality checks
+        return lambda attribute_value: False
+
+    if operator not in ORDERING_OPERATORS and operator not in STRING_OPERATORS:
+        raise exceptions.InvalidSCIMFilter(f"Unknown filter operator {operator}")
+
+    numeric_value = isinstance(value, NUMBER_TYPES)
+    if operator in ORDERING_OPERATORS:
+        compare = ORDERING_OPERATORS[operator]
+    else:
+        string_compare = STRING_OPERATORS[operator]
+        compare = lambda attribute_value, value: string_compare(
+            str(attribute_value), value
+        )
+
+    def test(attribute_value) -> bool:
+        if attribute_value is None:
+            return False
+
+        if not PythonFilter.types_comparable(attribute_value, value):
+            raise exceptions.InvalidSCIMFilter(
+                f"Attribute value could not be compared to filter with the specified operation {attribute_value}, {value}"
+            )
+
+        if operator in STRING_OPERATORS and (
+            numeric_value or isinstance(attribute_value, NUMBER_TYPES)
+        ):
+            # reject numbers from string operations
+            return False
+
+        return compare(attribute_value, value)
+
+    return test
+
+
+def compile_datetime_comparison(expression: Comparison) -> MappingPredicate:
+    try:
+        value = parse_datetime(expression.value)
+    except ValueError:
+        raise exceptions.InvalidSCIMFilter(
+            f"{expression.value!r} is not a valid dateTime for {'.'.join(expression.path)}"
+        )
+
+    get = compile_attribute_getter(expression.path)
+    compare = DATETIME_OPERATORS[expression.operator]
+    # missing or unparsable attributes only ever satisfy "ne"
+    missing = expression.operator == "ne"
+
+    def comparison(r):
+        attribute_value = get(r)
+        if attribute_value is None:
+            return missing
+        try:
+            return compare(parse_datetime(attribute_value), value)
+        except ValueError:
+            return missing
+
+    return comparison
+
+
+def compile_comparison(expression: Comparison) -> MappingPredicate:
+    if (
+        expression.path in DATETIME_ATTRIBUTES
+        and expression.operator in DATETIME_OPERATORS
+        and isinstance(expression.value, str)
+    ):
+        return compile_datetime_comparison(expression)
+
+    get = compile_attribute_getter(expression.path)
+    test = compile_value_test(expression.operator, expression.value)
+    if expression.operator == "ne":
+        # ne is the negation of eq, as it is in visit_infixassertion, so a
+        # multi-valued attribute is only unequal when none of its values are equal
+        equal = compile_value_test("eq", expression.value)
+
+        def inequality(r):
+            attribute_value = get(r)
+            if type(attribute_value) is list:
+                return not any(equal(v) for v in attribute_value)
+            return test(attribute_value)
+
+        return inequality
+
+    def comparison(r):
+        attribute_value = get(r)
+        if type(attribute_value) is list:
+            # multi-valued attributes match if any of their values match
+            return any(test(v) for v in attribute_value)
+        return test(attribute_value)
+
+    return comparison
+
+
+def compile_present(expression: Present) -> MappingPredicate:
+    get = compile_attribute_getter(expression.path)
+    return lambda r: bool(get(r))
+
+
+def compile_and(expression: And) -> MappingPredicate:
+    predicates = tuple(compile_predicate(e) for e in expression.operands)
+    if len(predicates) == 2:
+        first, second = predicates
+        return lambda r: first(r) and second(r)
+
+    def conjunction(r):
+        for predicate in predicates:
+            if not predicate(r):
+                return False
+        return True
+
+    return conjunction
+
+
+def compile_or(expression: Or) -> MappingPredicate:
+    predicates = tuple(compile_predicate(e) for e in expression.operands)
+    if len(predicates) == 2:
+        first, second = predicates
+        return lambda r: first(r) or second(r)
+
+    def disjunction(r):
+        for predicate in predicates:
+            if predicate(r):
+                return True
+        return False
+
+    return disjunction
+
+
+def compile_not(expression: Not) -> MappingPredicate:
+    predicate = compile_predicate(expression.operand)
+    return lambda r: not predicate(r)
+
+
+def compile_attribute_group(expression: AttributeGroup) -> MappingPredicate:
+    get = compile_attribute_getter(expression.path)
+    subpredicate = compile_predicate(expression.filter)
+
+    def subquery(r):
+        attribute_value = get(r)
+        if isinstance(attribute_value, list):
+            return any(
+                subpredicate(v) for v in attribute_value if isinstance(v, abc.Mapping)
+            )
+        if isinstance(attribute_value, abc.Mapping):
+            return subpredicate(attribute_value)
+        return False
+
+    return subquery
+
+
+COMPILERS: Mapping[Type, Callable[..., MappingPredicate]] = {
+    Comparison: compile_comparison,
+    Present: compile_present,
+    And: compile_and,
+    Or: compile_or,
+    Not: compile_not,
+    AttributeGroup: compile_attribute_group,
+}
+
+
+def compile_predicate(expression: Expression) -> MappingPredicate:
+    """
+    Turns a filter AST into a tree of closures. All of the work that only depends on
+    the filter is done here so evaluating a record never touches the AST again.
+    """
+    return COMPILERS[type(expression)](expression)
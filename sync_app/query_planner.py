@@ -0,0 +1,314 @@
+"""
+Chooses how a filter is answered from a Store
+
+Equality tests on indexed attributes are answered from the store's indexes and only the
+rest of the filter is evaluated, against just the records the index returned. Anything
+the planner does not understand falls back to evaluating the whole filter on every record.
+Stores with a query engine of their own, like SqliteStore, are handed the filter first.
+"""
+
+from dataclasses import dataclass, field
+from sync_app.parsers.python_filter import (
+    PythonFilter,
+    MappingPredicate,
+    compile_predicate,
+    parse_datetime,
+    DATETIME_ATTRIBUTES,
+)
+from sync_app.parsers.filter_ast import (
+    Expression,
+    Comparison,
+    And,
+    Or,
+    AttributeGroup,
+    FilterValue,
+    conjunction,
+)
+from sync_app.store import Store, HasId, RangeBound
+from typing import (
+    Any,
+    Generic,
+    Iterator,
+    List,
+    Literal,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+    Union,
+)
+
+T = TypeVar("T", bound="HasId")
+
+
+RANGE_OPERATORS = frozenset(["gt", "ge", "lt", "le"])
+
+
+@dataclass(frozen=True)
+class IndexLookup:
+    attribute: str
+    value: FilterValue
+
+    def to_dict(self) -> Mapping:
+        return {"attribute": self.attribute, "value": self.value}
+
+
+@dataclass(frozen=True)
+class RangeLookup:
+    attribute: str
+    lower: Optional[RangeBound] = None
+    upper: Optional[RangeBound] = None
+
+    def to_dict(self) -> Mapping:
+        def bound(b: Optional[RangeBound]) -> Optional[Mapping]:
+            if b is None:
+                return None
+            value = b.value.isoformat() if hasattr(b.value, "isoformat") else b.value
+            return {"value": value, "inclusive": b.inclusive}
+
+        return {
+            "attribute": self.attribute,
+            "lower": bound(self.lower),
+            "upper": bound(self.upper),
+        }
+
+
+Lookup = Union[IndexLookup, RangeLookup]
+
+
+@dataclass
+class QueryPlan(Generic[T]):
+    strategy: Literal["query", "index", "scan"]
+    candidates: Sequence[T]
+    # predicate the candidates still have to pass, None when the index is exact
+    residual: Optional[Expression]
+    predicate: Optional[MappingPredicate] = None
+    lookups: List[Lookup] = field(default_factory=list)
+
+    def execute(self) -> List[T]:
+        if self.predicate is None:
+            return list(self.candidates)
+        predicate = self.predicate
+        return [r for r in self.candidates if predicate(r.to_dict())]
+
+    def explain(self) -> Mapping:
+        return {
+            "strategy": self.strategy,
+            "indexes": [lookup.to_dict() for lookup in self.lookups],
+            "candidates": len(self.candidates),
+            "residual": repr(self.residual) if self.residual is not None else None,
+        }
+
+
+def conjuncts(expression: Expression) -> Tuple[Expression, ...]:
+    if isinstance(expression, And):
+        return tuple(c for operand in expression.operands for c in conjuncts(operand))
+    return (expression,)
+
+
+def indexable(value: FilterValue) -> bool:
+    # booleans hash like numbers and null means "absent", neither can be looked up
+    return isinstance(value, (str, float)) and not isinstance(value, bool)
+
+
+def equality_lookups(expression: Expression) -> List[Tuple[IndexLookup, bool]]:
+    """
+    Equality tests every record matching expression must pass, paired with whether
+    the lookup alone is enough to satisfy the expression
+    """
+    if (
+        isinstance(expression, Comparison)
+        and expression.operator == "eq"
+        and indexable(expression.value)
+    ):
+        return [(IndexLookup(".".join(expression.path), expression.value), True)]
+
+    if isinstance(expression, AttributeGroup):
+        # emails[type eq "work" and value eq "x"] implies emails.value eq "x" but the
+        # whole group still has to hold for a single email
+        prefix = ".".join(expression.path)
+        return [
+            (IndexLookup(f"{prefix}.{lookup.attribute}", lookup.value), False)
+            for operand in conjuncts(expression.filter)
+            for lookup, _ in equality_lookups(operand)
+        ]
+
+    return []
+
+
+def range_value(expression: Expression) -> Optional[Any]:
+    """The bound a range comparison puts on its attribute, if it can use an index"""
+    if not isinstance(expression, Comparison) or expression.operator not in RANGE_OPERATORS:
+        return None
+    if not isinstance(expression.value, str):
+        return None
+    if expression.path not in DATETIME_ATTRIBUTES:
+        return expression.value
+
+    try:
+        return parse_datetime(expression.value)
+    except ValueError:
+        # left to the predicate, which reports the invalid filter
+        return None
+
+
+def tighter(current: Optional[RangeBound], bound: RangeBound, lower: bool) -> RangeBound:
+    """Picks the more restrictive of two bounds on the same side of a range"""
+    if current is None:
+        return bound
+    if bound.value == current.value:
+        # an exclusive bound excludes more than an inclusive one
+        return bound if current.inclusive else current
+    if lower:
+        return bound if bound.value > current.value else current
+    return bound if bound.value < current.value else current
+
+
+def range_lookups(
+    operands: Tuple[Expression, ...]
+) -> List[Tuple[RangeLookup, List[int]]]:
+    """Combines the range comparisons on each attribute into a single lookup"""
+    ranges: dict = {}
+    for i, operand in enumerate(operands):
+        value = range_value(operand)
+        if value is None:
+            continue
+        assert isinstance(operand, Comparison)
+
+        attribute = ".".join(operand.path)
+        lookup, indices = ranges.get(attribute, (RangeLookup(attribute), []))
+        bound = RangeBound(value, operand.operator in ("ge", "le"))
+        if operand.operator in ("gt", "ge"):
+            lookup = RangeLookup(attribute, tighter(lookup.lower, bound, True), lookup.upper)
+        else:
+            lookup = RangeLookup(attribute, lookup.lower, tighter(lookup.upper, bound, False))
+        ranges[attribute] = (lookup, indices + [i])
+
+    return list(ranges.values())
+
+
+def candidate_lookups(
+    operands: Tuple[Expression, ...]
+) -> Iterator[Tuple[Lookup, List[int]]]:
+    """Every lookup which could answer operands, with the operands it satisfies"""
+    for i, operand in enumerate(operands):
+        for lookup, exact in equality_lookups(operand):
+            yield lookup, [i] if exact else []
+    yield from range_lookups(operands)
+
+
+def estimate(store: Store[T], lookup: Lookup) -> Optional[int]:
+    if isinstance(lookup, IndexLookup):
+        return store.lookup_size(lookup.attribute, lookup.value)
+    return store.range_size(lookup.attribute, lookup.lower, lookup.upper)
+
+
+def run_lookup(store: Store[T], lookup: Lookup) -> Optional[Sequence[T]]:
+    if isinstance(lookup, IndexLookup):
+        return store.lookup(lookup.attribute, lookup.value)
+    return store.range_lookup(lookup.attribute, lookup.lower, lookup.upper)
+
+
+def plan_conjunction(
+    store: Store[T], expression: Expression
+) -> Optional[Tuple[Lookup, Sequence[T], Optional[Expression]]]:
+    """
+    Picks the lookup with the fewest candidates by the sizes the store's indexes
+    report, only the chosen one is run
+    """
+    operands = conjuncts(expression)
+    best: Optional[Tuple[int, Lookup, List[int]]] = None
+
+    for lookup, used in candidate_lookups(operands):
+        size = estimate(store, lookup)
+        if size is None or (best is not None and size >= best[0]):
+            continue
+        best = (size, lookup, used)
+        if size <= 1:
+            # a unique lookup, only one matching nothing at all could beat it
+            break
+
+    if best is None:
+        return None
+
+    _, lookup, used = best
+    records = run_lookup(store, lookup)
+    assert records is not None, "a lookup the store could size can be run"
+    remaining = [o for i, o in enumerate(operands) if i not in used]
+    residual = conjunction(remaining) if remaining else None
+    return lookup, records, residual
+
+
+def plan_expression(
+    store: Store[T],
+    expression: Expression,
+    scan_predicate: Optional[MappingPredicate] = None,
+) -> QueryPlan[T]:
+    queried = store.query(expression)
+    if queried is not None:
+        records, exact = queried
+        if exact:
+            return QueryPlan(strategy="query", candidates=records, residual=None)
+        return QueryPlan(
+            strategy="query",
+            candidates=records,
+            residual=expression,
+            predicate=scan_predicate or compile_predicate(expression),
+        )
+
+    if isinstance(expression, Or):
+        # a union is only worth it if every branch can use an index
+        branches = [plan_conjunction(store, e) for e in expression.operands]
+        if all(branch is not None for branch in branches):
+            candidates: dict = {}
+            lookups = []
+            for branch in branches:
+                assert branch is not None
+                lookup, records, _ = branch
+                lookups.append(lookup)
+                candidates.update((r.get_id(), r) for r in records)
+
+            return QueryPlan(
+                strategy="index",
+                candidates=list(candidates.values()),
+                residual=expression,
+                predicate=compile_predicate(expression),
+                lookups=lookups,
+            )
+
+    else:
+        planned = plan_conjunction(store, expression)
+        if planned is not None:
+            lookup, records, residual = planned
+            return QueryPlan(
+                strategy="index",
+                candidates=records,
+                residual=residual,
+                predicate=compile_predicate(residual) if residual else None,
+                lookups=[lookup],
+            )
+
+    return QueryPlan(
+        strategy="scan",
+        candidates=store.get_all(),
+        residual=expression,
+        predicate=scan_predicate or compile_predicate(expression),
+    )
+
+
+def plan_query(store: Store[T], filter: str) -> QueryPlan[T]:
+    return plan_expression(
+        store,
+        PythonFilter.parse_filter_to_ast(filter),
+        # reuse the cached predicate for the full scan case
+        PythonFilter.parse_filter_to_predicate(filter),
+    )
+
+
+def filter_records(store: Store[T], filter: str) -> List[T]:
+    return plan_query(store, filter).execute()
+
+
+def explain(store: Store[T], filter: str) -> Mapping:
+    return plan_query(store, filter).explain()
@@ -0,0 +1,328 @@
+"""
+One way reconciliation of a target SCIM server with a source
+
+Both sides are pulled as streams with SCIMClient's prefetching iterators. The target is
+read first and only a digest of each of its records is kept: its id, the keys a source
+record can match it by and a hash of its content. The source is then matched against
+the digests one record at a time as it arrives, by externalId, which holds the source
+id for records SCIMClient created, or else by userName or displayName. Records whose
+hashes agree are skipped without a request, the others become a create or a PATCH of
+just what differs, and target records nothing matched are deleted at the end. Memory
+is linear in the number of records and none of them is held in full.
+
+Writes go out on a thread pool with at most concurrency of them in flight, reading the
+source waits while the pool is full. The target client's pool should allow as many
+connections per host, see PoolConfiguration.
+"""
+
+import hashlib
+import json
+import threading
+import traceback
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Dict, Generic, Iterator, Mapping, Optional, TypeVar
+from sync_app.client import SCIMClient
+from sync_app.scim.group import Group
+from sync_app.scim.patchop import READ_ONLY_ATTRIBUTES, Operation, PatchOp
+from sync_app.scim.resource import ResourceWithMeta
+from sync_app.scim.user import User
+
+DEFAULT_CONCURRENCY = 16
+DEFAULT_PAGE_SIZE = 100
+
+# the target's externalId is the source's id, so it can't be compared between the two
+UNCOMPARED_ATTRIBUTES = READ_ONLY_ATTRIBUTES | {"externalId"}
+
+R = TypeVar("R", bound=ResourceWithMeta)
+
+
+@dataclass
+class ReconcileReport:
+    dry_run: bool = False
+    # source records
+    scanned: int = 0
+    target_scanned: int = 0
+    created: int = 0
+    patched: int = 0
+    deleted: int = 0
+    # source records identical to the target's
+    skipped: int = 0
+    failed: int = 0
+    lock: threading.Lock = field(
+        default_factory=threading.Lock, repr=False, compare=False
+    )
+
+    @property
+    def changed(self) -> int:
+        return self.created + self.patched + self.deleted
+
+    def count(self, outcome: str) -> None:
+        with self.lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def to_dict(self) -> Mapping:
+        return {
+            "dry_run": self.dry_run,
+            "scanned": self.scanned,
+            "target_scanned": self.target_scanned,
+            "created": self.created,
+            "patched": self.patched,
+            "deleted": self.deleted,
+            "skipped": self.skipped,
+            "failed": self.failed,
+        }
+
+
+def content_hash(content: Mapping) -> bytes:
+    canonical = json.dumps(content, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(canonical.encode(), digest_size=16).digest()
+
+
+def user_content(user: User) -> Mapping:
+    """The attributes of user which are reconciled"""
+    content = dict(user.to_dict())
+    for name in UNCOMPARED_ATTRIBUTES:
+        content.pop(name, None)
+    return content
+
+
+def group_content(group: Group, user_ids: Mapping[str, str]) -> Mapping:
+    """The attributes of group which are reconciled, members given by target id"""
+    members = sorted(user_ids.get(m.value, m.value) for m in group.members)
+    return {
+        "displayName": group.displayName,
+        "members": [{"value": member} for member in members],
+    }
+
+
+@dataclass(frozen=True)
+class TargetRecord:
+    id: str
+    externalId: Optional[str]
+    # userName or displayName
+    name: str
+    content_hash: bytes
+
+
+class TargetIndex:
+    """The target's records by the keys source records are matched to them with"""
+
+    def __init__(self):
+        self.by_external_id: Dict[str, TargetRecord] = {}
+        self.by_name: Dict[str, TargetRecord] = {}
+        # by id, matching a record takes it out
+        self.unmatched: Dict[str, TargetRecord] = {}
+
+    def add(self, record: TargetRecord) -> None:
+        if record.externalId is not None:
+            self.by_external_id[record.externalId] = record
+        self.by_name[record.name] = record
+        self.unmatched[record.id] = record
+
+    def match(self, external_id: str, name: str) -> Optional[TargetRecord]:
+        """The unmatched record with external_id, or failing that name"""
+        for index, key in ((self.by_external_id, external_id), (self.by_name, name)):
+            record = index.get(key, None)
+            if record is not None and record.id in self.unmatched:
+                del self.unmatched[record.id]
+                return record
+        return None
+
+
+@dataclass
+class ResourceKind(Generic[R]):
+    """How to list, compare and write one type of resource"""
+
+    name: str
+    iterate: Callable[[SCIMClient], Iterator[R]]
+    name_of: Callable[[R], str]
+    source_content: Callable[[R], Mapping]
+    target_content: Callable[[R], Mapping]
+    get: Callable[[SCIMClient, str], R]
+    # returns the id the target gave the record
+    create: Callable[[SCIMClient, R], str]
+    patch: Callable[[SCIMClient, str, PatchOp], Any]
+    delete: Callable[[SCIMClient, str], None]
+    # told the source id and target id of every record matched or created
+    matched: Callable[[str, str], None] = lambda source_id, target_id: None
+
+
+class Reconciler:
+    """Makes target's users and groups match source's"""
+
+    source: SCIMClient
+    target: SCIMClient
+    concurrency: int
+    dry_run: bool
+    # source user id -> target user id, for translating group members
+    user_ids: Dict[str, str]
+
+    def __init__(
+        self,
+        source: SCIMClient,
+        target: SCIMClient,
+        concurrency: int = DEFAULT_CONCURRENCY,
+        dry_run: bool = False,
+        page_size: int = DEFAULT_PAGE_SIZE,
+    ):
+        assert concurrency > 0, "Reconciling needs to allow at least one request"
+        self.source = source
+        self.target = target
+        self.concurrency = concurrency
+        self.dry_run = dry_run
+        self.page_size = page_size
+        self.user_ids = {}
+
+    def run(self) -> Mapping[str, ReconcileReport]:
+        # users first, so the members of groups can be given by their target ids
+        return {"users": self.reconcile_users(), "groups": self.reconcile_groups()}
+
+    def reconcile_users(self) -> ReconcileReport:
+        return self.reconcile(
+            ResourceKind(
+                name="users",
+                iterate=lambda client: client.iter_users(page_size=self.page_size),
+                name_of=lambda user: user.userName,
+                source_content=user_content,
+                target_content=user_content,
+                get=lambda client, id: client.get_user(id),
+                create=lambda client, user: str(client.create_user(user).id),
+                patch=lambda client, id, patch: client.update_user(id, patch),
+                delete=lambda client, id: client.delete_user(id),
+                matched=self.user_ids.__setitem__,
+            )
+        )
+
+    def reconcile_groups(self) -> ReconcileReport:
+        return self.reconcile(
+            ResourceKind(
+                name="groups",
+                iterate=lambda client: client.iter_groups(page_size=self.page_size),
+                name_of=lambda group: group.displayName,
+                source_content=lambda group: group_content(group, self.user_ids),
+                target_content=lambda group: group_content(group, {}),
+                get=lambda client, id: client.get_group(id),
+                create=self.create_group,
+                patch=lambda client, id, patch: client.update_group(id, patch),
+                delete=lambda client, id: client.delete_group(id),
+            )
+        )
+
+    def create_group(self, client: SCIMClient, group: Group) -> str:
+        # groups are created empty, see SCIMClient.create_group
+        members = group_content(group, self.user_ids)["members"]
+        created = client.create_group(
+            Group(group.meta, group.id, group.displayName, None, group.externalId)
+        )
+        if members:
+            patch = PatchOp([Operation("add", "members", members)])
+            client.update_group(str(created.id), patch)
+        return str(created.id)
+
+    def reconcile(self, kind: ResourceKind) -> ReconcileReport:
+        report = ReconcileReport(dry_run=self.dry_run)
+        index = TargetIndex()
+        for record in kind.iterate(self.target):
+            report.target_scanned += 1
+            index.add(
+                TargetRecord(
+                    str(record.id),
+                    record.externalId,
+                    kind.name_of(record),
+                    content_hash(kind.target_content(record)),
+                )
+            )
+
+        with Writes(self.concurrency, report, self.dry_run) as writes:
+            for record in kind.iterate(self.source):
+                report.scanned += 1
+                source_id = str(record.id)
+                content = kind.source_content(record)
+                match = index.match(source_id, kind.name_of(record))
+                if match is None:
+                    writes.submit(
+                        "created",
+                        partial(kind.create, self.target, record),
+                        partial(kind.matched, source_id),
+                    )
+                    continue
+
+                kind.matched(source_id, match.id)
+                if match.content_hash == content_hash(content):
+                    report.count("skipped")
+                else:
+                    writes.submit(
+                        "patched", partial(self.patch, kind, match.id, content)
+                    )
+
+            for unmatched in index.unmatched.values():
+                writes.submit(
+                    "deleted", partial(kind.delete, self.target, unmatched.id)
+                )
+
+        return report
+
+    def patch(self, kind: ResourceKind, id: str, content: Mapping) -> bool:
+        """Patches what differs from content into target record id"""
+        current = kind.target_content(kind.get(self.target, id))
+        patch = PatchOp.from_diff(current, content)
+        # the same content in another order hashes differently
+        if not patch.operations:
+            return False
+        kind.patch(self.target, id, patch)
+        return True
+
+
+class Writes:
+    """Runs writes to the target with at most concurrency of them in flight"""
+
+    def __init__(self, concurrency: int, report: ReconcileReport, dry_run: bool):
+        self.report = report
+        self.dry_run = dry_run
+        self.executor = ThreadPoolExecutor(concurrency, "scim-reconcile")
+        self.slots = threading.Semaphore(concurrency)
+
+    def __enter__(self) -> "Writes":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.executor.shutdown(wait=True)
+
+    def submit(
+        self,
+        outcome: str,
+        write: Callable[[], Any],
+        on_done: Optional[Callable[[Any], None]] = None,
+    ) -> None:
+        if self.dry_run:
+            self.report.count(outcome)
+            return
+
+        # blocks the caller, and so the reading of the source, while the pool is full
+        self.slots.acquire()
+        future = self.executor.submit(write)
+        future.add_done_callback(lambda f: self.done(f, outcome, on_done))
+
+    def done(
+        self,
+        future: Future,
+        outcome: str,
+        on_done: Optional[Callable[[Any], None]],
+    ) -> None:
+        self.slots.release()
+        try:
+            result = future.result()
+        except Exception as e:
+            traceback.print_exception(e)
+            self.report.count("failed")
+            return
+
+        # a patch that turned out to have nothing to change
+        if result is False:
+            self.report.count("skipped")
+            return
+        self.report.count(outcome)
+        if on_done is not None:
+            on_done(result)
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 import json
 import jsonschema
+from jsonschema.protocols import Validator
+from referencing import Registry, Resource as ReferencedResource
+from referencing.jsonschema import DRAFT7
 from typing import Iterable, OrderedDict, Optional, TypeAlias, Mapping, List, TypeVar
 from dataclasses import dataclass
 from sync_app.scim.resource import Resource
@@ -11,6 +14,8 @@ COMMON_SCHEMA = "urn:ietf:params:scim:schemas:core:2.0:Common"
 class JSONSchema:
     schema: Mapping
     id: str
+    # built once and reused, jsonschema.validate would rebuild it on every call
+    validator: Validator
 
     @staticmethod
     def load(path: str, schemaValidator: Optional["JSONSchema"] = None) -> "JSONSchema":
@@ -29,9 +34,28 @@ class JSONSchema:
         self.schema = schema
         self.id = schema["$id"]
         self.validatingSchema = schema["$schema"]
+        self.validator = self.build_validator()
+
+    def build_validator(self, registry: Optional[Registry] = None) -> Validator:
+        validator_class = jsonschema.validators.validator_for(self.schema)
+        # the schema itself only has to be checked once rather than on every validate
+        validator_class.check_schema(self.schema)
+        if registry is None:
+            return validator_class(self.schema)
+        return validator_class(self.schema, registry=registry)
+
+    def use_registry(self, registry: Registry) -> None:
+        """Lets $refs in this schema resolve to the other schemas in registry"""
+        self.validator = self.build_validator(registry)
+
+    def to_resource(self) -> ReferencedResource:
+        return ReferencedResource.from_contents(self.schema, default_specification=DRAFT7)
 
     def validate(self, instance: Mapping) -> bool:
-        jsonschema.validate(instance, self.schema)
+        # raises the same error jsonschema.validate would
+        error = jsonschema.exceptions.best_match(self.validator.iter_errors(instance))
+        if error is not None:
+            raise error
         # No exception means the schema is valid
         return True
 
@@ -55,6 +79,8 @@ class ValidatorResult:
 
 class ResourceValidator:
     schemas: IdToSchema
+    # every loaded schema by $id, shared by all of their validators
+    registry: Registry
 
     @staticmethod
     def load(paths: Iterable[str]) -> "ResourceValidator":
@@ -67,6 +93,11 @@ class ResourceValidator:
 
     def __init__(self, schemas: Iterable[JSONSchema]):
         self.schemas = {schema.id: schema for schema in schemas}
+        self.registry = Registry().with_resources(
+            (schema.id, schema.to_resource()) for schema in self.schemas.values()
+        )
+        for schema in self.schemas.values():
+            schema.use_registry(self.registry)
         self.validate_schemas()
 
     def validate_schemas(self) -> ValidatorResult:
@@ -103,7 +134,7 @@ class ResourceValidator:
             schema_to_check = self.schemas.get(schemaId, None)
             if schema_to_check is None:
                 raise SchemaNotFoundInValidator(
-                    "While processing {meta!r}".format(meta=resource["meta"])
+                    "While processing {meta!r}".format(meta=resource.get("meta"))
                 )
             try:
                 schema_to_check.validate(resource)
@@ -111,3 +142,18 @@ class ResourceValidator:
                 errors.append(e)
 
         return ValidatorResult(len(errors) == 0, errors)
+
+    def validate_all(self, resources: Iterable[Mapping]) -> List[ValidatorResult]:
+        """
+        Validates a batch of resources in one pass. A resource which cannot be checked
+        at all, for lacking or naming unknown schemas, comes back invalid rather than
+        failing the whole batch.
+        """
+        results = []
+        for resource in resources:
+            try:
+                results.append(self.validate(resource))
+            except (ResourceMissingSchemas, SchemaNotFoundInValidator) as e:
+                error = jsonschema.ValidationError(f"Could not validate resource: {e!r}")
+                results.append(ValidatorResult(False, [error]))
+        return results
@@ -0,0 +1,127 @@
+from typing import Mapping, Literal, Optional, Iterable, Any, List
+from sync_app.scim.resource import Resource
+from dataclasses import dataclass
+
+BULK_REQUEST_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:BulkRequest"
+BULK_RESPONSE_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:BulkResponse"
+
+BulkMethod = Literal["POST", "PUT", "PATCH", "DELETE"]
+
+
+@dataclass(frozen=True)
+class BulkLimits:
+    """The bulk limits a service provider advertises, RFC 7643 section 5"""
+
+    max_operations: int = 1000
+    # bytes
+    max_payload_size: int = 1048576
+
+
+@dataclass
+class BulkOperation:
+    method: BulkMethod
+    # relative to the service provider's base url, e.g. "/Users/<id>"
+    path: str
+    bulkId: Optional[str] = None
+    data: Optional[Mapping] = None
+    version: Optional[str] = None
+
+    def to_dict(self) -> Mapping:
+        operation: dict = {"method": self.method, "path": self.path}
+        if self.bulkId is not None:
+            operation["bulkId"] = self.bulkId
+        if self.version is not None:
+            operation["version"] = self.version
+        if self.data is not None:
+            operation["data"] = self.data
+        return operation
+
+    @staticmethod
+    def from_dict(operation: Mapping) -> "BulkOperation":
+        return BulkOperation(
+            method=operation["method"],
+            path=operation["path"],
+            bulkId=operation.get("bulkId", None),
+            data=operation.get("data", None),
+            version=operation.get("version", None),
+        )
+
+
+class BulkRequest(Resource):
+    operations: List[BulkOperation]
+    failOnErrors: Optional[int]
+
+    def __init__(
+        self, operations: Iterable[BulkOperation], failOnErrors: Optional[int] = None
+    ):
+        super().__init__([BULK_REQUEST_SCHEMA])
+        self.operations = list(operations)
+        self.failOnErrors = failOnErrors
+
+    def to_dict(self) -> Mapping:
+        result: dict = {"schemas": [BULK_REQUEST_SCHEMA]}
+        if self.failOnErrors is not None:
+            result["failOnErrors"] = self.failOnErrors
+        result["Operations"] = [o.to_dict() for o in self.operations]
+        return result
+
+    @staticmethod
+    def from_dict(resource: Mapping) -> "BulkRequest":
+        assert BULK_REQUEST_SCHEMA in resource["schemas"], "not a bulk request"
+        return BulkRequest(
+            operations=[BulkOperation.from_dict(o) for o in resource["Operations"]],
+            failOnErrors=resource.get("failOnErrors", None),
+        )
+
+
+@dataclass
+class BulkOperationResult:
+    method: BulkMethod
+    # HTTP status code of the operation, sent as a string on the wire
+    status: int
+    bulkId: Optional[str] = None
+    location: Optional[str] = None
+    version: Optional[str] = None
+    response: Optional[Any] = None
+
+    def to_dict(self) -> Mapping:
+        result: dict = {"method": self.method, "status": str(self.status)}
+        for name in ["bulkId", "location", "version", "response"]:
+            value = getattr(self, name)
+            if value is not None:
+                result[name] = value
+        return result
+
+    @staticmethod
+    def from_dict(result: Mapping) -> "BulkOperationResult":
+        return BulkOperationResult(
+            method=result["method"],
+            # some servers send a number despite the RFC, accept both
+            status=int(result["status"]),
+            bulkId=result.get("bulkId", None),
+            location=result.get("location", None),
+            version=result.get("version", None),
+            response=result.get("response", None),
+        )
+
+
+class BulkResponse(Resource):
+    operations: List[BulkOperationResult]
+
+    def __init__(self, operations: Iterable[BulkOperationResult]):
+        super().__init__([BULK_RESPONSE_SCHEMA])
+        self.operations = list(operations)
+
+    def to_dict(self) -> Mapping:
+        return {
+            "schemas": [BULK_RESPONSE_SCHEMA],
+            "Operations": [o.to_dict() for o in self.operations],
+        }
+
+    @staticmethod
+    def from_dict(resource: Mapping) -> "BulkResponse":
+        assert BULK_RESPONSE_SCHEMA in resource["schemas"], "not a bulk response"
+        operations = resource["Operations"]
+        return BulkResponse(
+            operations=[BulkOperationResult.from_dict(o) for o in operations]
+        )
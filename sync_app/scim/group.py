@@ -1,15 +1,34 @@
 from sync_app.scim.resource import ResourceWithMeta, ResourceMeta, ResourceRef
-from typing import Iterable, OrderedDict, Optional, TypeAlias, Mapping, List
+from typing import (
+    Iterable,
+    OrderedDict,
+    Optional,
+    TypeAlias,
+    Mapping,
+    List,
+    ClassVar,
+    Tuple,
+)
 from dataclasses import dataclass, asdict
 from uuid import UUID
 
 GROUP_RESOURCE_TYPE = "Group"
 GROUP_SCHEMA = "urn:ietf:params:scim:schemas:core:2.0:Group"
+# shared by every group
+GROUP_SCHEMAS = (GROUP_SCHEMA,)
 
 
 class Group(ResourceWithMeta):
+    __slots__ = ("displayName", "members")
     displayName: str
     members: List[ResourceRef]
+    unique_attributes: ClassVar[Tuple[str, ...]] = ("id",)
+    indexed_attributes: ClassVar[Tuple[str, ...]] = ("externalId", "displayName")
+    sorted_attributes: ClassVar[Tuple[str, ...]] = (
+        "displayName",
+        "meta.created",
+        "meta.lastModified",
+    )
 
     def __init__(
         self,
@@ -17,8 +36,9 @@ class Group(ResourceWithMeta):
         group_id: UUID,
         displayName: str,
         members: Optional[List[ResourceRef]] = None,
+        externalId: Optional[str] = None,
     ):
-        super().__init__([GROUP_SCHEMA], meta, group_id)
+        super().__init__(GROUP_SCHEMAS, meta, group_id, externalId)
         self.displayName = displayName
 
         if members:
@@ -46,6 +66,7 @@ class Group(ResourceWithMeta):
             group_id=UUID(resource["id"]),
             displayName=group["displayName"],
             members=members,
+            externalId=resource.get("externalId", None),
         )
 
     def to_dict(self):
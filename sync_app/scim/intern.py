@@ -0,0 +1,54 @@
+"""
+Sharing of the values that repeat across the resources held by a store. Every user of a
+tenant carries the same resource type, schema URIs and email types and refers to the same
+few groups, so rather than each record holding copies of its own, those are interned (for
+strings) or hash-consed (for immutable objects) as resources are built.
+"""
+import sys
+import weakref
+from functools import partial
+from typing import Callable, Dict, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+def intern_str(value: Optional[str]) -> Optional[str]:
+    """The one shared copy of a string, for values out of a small vocabulary"""
+    # sys.intern only takes exact strs, anything else is left for validation to reject
+    if type(value) is str:
+        return sys.intern(value)
+    return value
+
+
+class HashConsTable(Generic[V]):
+    """
+    Canonical instance per key of an immutable value. Entries are weakly held, so a
+    value goes away with the last resource referring to it.
+    """
+
+    def __init__(self):
+        # a plain dict of weakrefs, WeakValueDictionary lookups cost about twice as much
+        self._entries: Dict[Hashable, weakref.ref] = {}
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], V]) -> V:
+        entry = self._entries.get(key)
+        if entry is not None:
+            value = entry()
+            if value is not None:
+                return value
+
+        # no lock, two threads racing here at worst build two equal values
+        value = factory()
+        self._entries[key] = weakref.ref(value, partial(self._discard, key))
+        return value
+
+    def _discard(self, key: Hashable, entry: weakref.ref) -> None:
+        # the key may already have been taken over by a newer value
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
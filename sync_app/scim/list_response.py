@@ -1,5 +1,8 @@
+import json
 from typing import (
+    Callable,
     Iterable,
+    Iterator,
     OrderedDict,
     Optional,
     TypeAlias,
@@ -9,7 +12,7 @@ from typing import (
     List,
     TypeVar,
 )
-from sync_app.scim.resource import Resource, ResourceWithMeta
+from sync_app.scim.resource import Resource, ResourceWithMeta, SerializableResource
 
 
 T = TypeVar("T", bound="Resource")
@@ -20,14 +23,14 @@ LIST_RESPONSE_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:ListResponse"
 class ListResponse(Resource):
     schemas: Iterable[str]
     totalResults: int
-    resources: Sequence[Resource]
+    resources: Sequence[SerializableResource]
     startIndex: int
     itemsPerPage: int
 
     def __init__(
         self,
         totalResults: int,
-        resources: Sequence[Resource],
+        resources: Sequence[SerializableResource],
         startIndex: int,
         itemsPerPage: int,
     ):
@@ -55,13 +58,44 @@ class ListResponse(Resource):
         result["startIndex"] = self.startIndex
         return result
 
+    def iter_json(
+        self, transform: Optional[Callable[[Mapping], Mapping]] = None
+    ) -> Iterator[str]:
+        """
+        Yields the JSON encoding of to_dict() in pieces, one resource at a time, so a
+        large listing is never held in memory as a whole. transform is applied to
+        each serialized resource before it is encoded.
+        """
+        envelope: dict = {
+            "schemas": list(self.schemas),
+            "totalResults": self.totalResults,
+        }
+        if self.totalResults == 0:
+            yield json.dumps(envelope)
+            return
+
+        envelope["itemsPerPage"] = self.itemsPerPage
+        envelope["startIndex"] = self.startIndex
+        # reopen the envelope object so the resources can follow
+        yield json.dumps(envelope)[:-1] + ', "Resources": ['
+
+        separator = ""
+        for r in self.resources:
+            resource = r.to_dict()
+            if transform is not None:
+                resource = transform(resource)
+            yield separator + json.dumps(resource)
+            separator = ", "
+
+        yield "]}"
+
     @staticmethod
     def from_list(
         l: Sequence[T], startIndex: int = 1, itemsPerPage=20
     ) -> "ListResponse":
         return ListResponse(
             totalResults=len(l),
-            resources=l[startIndex - 1 : itemsPerPage],
+            resources=l[startIndex - 1 : startIndex - 1 + itemsPerPage],
             startIndex=startIndex,
             itemsPerPage=itemsPerPage,
         )
@@ -72,9 +106,11 @@ class ListResponse(Resource):
             LIST_RESPONSE_SCHEMA in resource["schemas"]
         ), "object is not a list response"
 
+        # an empty response may leave out everything but totalResults
+        resources = [list_type.from_dict(r) for r in resource.get("Resources", [])]
         return ListResponse(
             totalResults=resource["totalResults"],
-            resources=[list_type.from_dict(r) for r in resource["Resources"]],
-            startIndex=resource["startIndex"],
-            itemsPerPage=resource["itemsPerPage"],
+            resources=resources,
+            startIndex=resource.get("startIndex", 1),
+            itemsPerPage=resource.get("itemsPerPage", len(resources)),
         )
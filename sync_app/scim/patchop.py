@@ -1,9 +1,13 @@
-from typing import Mapping, Literal, Optional, Iterable, Any
+import json
+from typing import Mapping, Literal, Optional, Iterable, Any, List, Sequence, Hashable
 from sync_app.scim.resource import Resource
 from dataclasses import dataclass, asdict
 
 PATCHOP_SCHEMA = "urn:ietf:params:scim:api:messages:2.0:PatchOp"
 
+# attributes the service provider manages, a client never patches these
+READ_ONLY_ATTRIBUTES = frozenset(["id", "meta"])
+
 
 @dataclass
 class Operation:
@@ -23,8 +27,104 @@ class PatchOp(Resource):
     def from_dict(resource: Mapping) -> "PatchOp":
         return PatchOp(operations=[Operation(**o) for o in resource["Operations"]])
 
+    @staticmethod
+    def from_diff(previous: Mapping, current: Mapping) -> "PatchOp":
+        """
+        The operations which turn resource previous into current. Multi-valued
+        attributes are patched item by item where the items can be addressed by
+        value, otherwise they are replaced as a whole.
+        """
+        return PatchOp(operations=diff_attributes(previous, current, ""))
+
     def to_dict(self) -> Mapping:
+        operations = []
+        for o in self.operations:
+            operation = asdict(o)
+            if o.op == "remove" and o.value is None:
+                # RFC 7644 3.5.2.2, remove does not take a value
+                del operation["value"]
+            operations.append(operation)
+
         return {
             "schemas": [PATCHOP_SCHEMA],
-            "Operations": [asdict(o) for o in self.operations],
+            "Operations": operations,
         }
+
+
+def diff_attributes(previous: Mapping, current: Mapping, prefix: str) -> List[Operation]:
+    operations = []
+    for name in previous:
+        if name not in current and name not in READ_ONLY_ATTRIBUTES:
+            operations.append(Operation("remove", prefix + name, None))
+
+    for name, value in current.items():
+        if name in READ_ONLY_ATTRIBUTES:
+            continue
+        path = prefix + name
+        if name not in previous:
+            operations.append(Operation("add", path, value))
+            continue
+
+        old = previous[name]
+        if old == value:
+            continue
+        if not prefix and isinstance(old, Mapping) and isinstance(value, Mapping):
+            # complex attributes only nest one level deep
+            operations.extend(diff_attributes(old, value, path + "."))
+        elif isinstance(old, list) and isinstance(value, list):
+            operations.extend(diff_multi_valued(path, old, value))
+        else:
+            operations.append(Operation("replace", path, value))
+
+    return operations
+
+
+def item_value(item: Any) -> Optional[Any]:
+    """The "value" a multi-valued attribute item can be addressed by in a filter"""
+    if not isinstance(item, Mapping):
+        return None
+    value = item.get("value", None)
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    return value
+
+
+def item_key(item: Any) -> Hashable:
+    """Equal items have equal keys, and keys are cheap for the usual flat items"""
+    if isinstance(item, Mapping):
+        key = tuple(sorted(item.items()))
+        try:
+            hash(key)
+            return key
+        except TypeError:
+            pass
+    elif isinstance(item, Hashable):
+        return (type(item).__name__, item)
+    return json.dumps(item, sort_keys=True)
+
+
+def diff_multi_valued(path: str, old: Sequence, new: Sequence) -> List[Operation]:
+    old_keys = [item_key(item) for item in old]
+    new_keys = [item_key(item) for item in new]
+    # items are matched up as a set, which loses count of repeated items
+    if len(set(old_keys)) < len(old_keys) or len(set(new_keys)) < len(new_keys):
+        return [Operation("replace", path, list(new))]
+
+    kept = set(old_keys) & set(new_keys)
+    removed = [item for item, key in zip(old, old_keys) if key not in kept]
+    added = [item for item, key in zip(new, new_keys) if key not in kept]
+
+    # remove path[value eq x] drops every item with that value, so it can only be
+    # used when none of the items holding x are kept
+    kept_values = {item_value(item) for item, key in zip(old, old_keys) if key in kept}
+    removed_values = [item_value(item) for item in removed]
+    if any(v is None or v in kept_values for v in removed_values):
+        return [Operation("replace", path, list(new))]
+
+    operations = [
+        Operation("remove", f"{path}[value eq {json.dumps(value)}]", None)
+        for value in dict.fromkeys(removed_values)
+    ]
+    if added:
+        operations.append(Operation("add", path, added))
+    return operations
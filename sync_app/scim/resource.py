@@ -8,18 +8,21 @@ from typing import (
     List,
     TypeVar,
     Protocol,
+    ClassVar,
+    Tuple,
 )
 from dataclasses import dataclass, asdict
 from datetime import datetime
 from typing import Literal
 from uuid import UUID
+from sync_app.scim.intern import HashConsTable, intern_str
 
 ResourceType = Literal[
     "User", "Group", "ServiceProviderConfig", "ResourceType", "Schema"
 ]
 
 
-@dataclass
+@dataclass(slots=True)
 class ResourceMeta:
     resourceType: ResourceType
     created: datetime
@@ -27,10 +30,14 @@ class ResourceMeta:
     location: str  # url
     version: Optional[str] = None
 
+    def __post_init__(self):
+        self.resourceType = intern_str(self.resourceType)
+        self.version = intern_str(self.version)
+
     def to_dict(self):
         d = {
             "resourceType": self.resourceType,
-            "create": str(self.created),
+            "created": str(self.created),
             "lastModified": str(self.lastModified),
             "location": self.location,
         }
@@ -51,6 +58,8 @@ class ResourceMeta:
 
 
 class Resource:
+    # resources are held by the million in a store, slots spare each one a __dict__
+    __slots__ = ("schemas",)
     schemas: Iterable[str]
 
     def __init__(self, schemas: Iterable[str]):
@@ -64,17 +73,32 @@ class Resource:
         json.dumps(self.to_dict())
 
     def to_dict(self):
-        return {"schemas": self.schemas}
+        # schemas may be a tuple shared between resources, hand out a list of its own
+        return {"schemas": list(self.schemas)}
 
 
 class ResourceWithMeta(Resource):
+    __slots__ = ("meta", "id", "externalId")
     meta: ResourceMeta
     id: UUID
-
-    def __init__(self, schemas: Iterable[str], meta: ResourceMeta, resource_id: UUID):
+    externalId: Optional[str]
+    unique_attributes: ClassVar[Tuple[str, ...]] = ("id",)
+    # filter paths a store keeps value -> records indexes for
+    indexed_attributes: ClassVar[Tuple[str, ...]] = ()
+    # filter paths a store keeps ordered indexes for, to answer range filters and sortBy
+    sorted_attributes: ClassVar[Tuple[str, ...]] = ("meta.created", "meta.lastModified")
+
+    def __init__(
+        self,
+        schemas: Iterable[str],
+        meta: ResourceMeta,
+        resource_id: UUID,
+        externalId: Optional[str] = None,
+    ):
         super().__init__(schemas)
         self.meta = meta
         self.id = resource_id
+        self.externalId = externalId
 
     def get_id(self) -> UUID:
         return self.id
@@ -84,19 +108,28 @@ class ResourceWithMeta(Resource):
 
     def to_dict(self):
         resource_common = super().to_dict()
-        return {**resource_common, "meta": self.meta.to_dict(), "id": str(self.id)}
+        result = {**resource_common, "meta": self.meta.to_dict(), "id": str(self.id)}
+        if self.externalId is not None:
+            result["externalId"] = self.externalId
+        return result
 
 
-@dataclass
+# frozen, a ref is shared by every resource referring to the same resource
+@dataclass(slots=True, frozen=True, weakref_slot=True)
 class ResourceRef:
-    ref: str
+    ref: Optional[str]
     value: str
-    display: str
+    display: Optional[str]
 
     # We can't use dict expansion here because the "$" prefix in $ref causes problems
     @staticmethod
     def from_dict(d: Mapping):
-        return ResourceRef(ref=d["$ref"], value=d["value"], display=d["display"])
+        # only value is required, RFC 7643 section 4.2
+        ref, value, display = d.get("$ref", None), d["value"], d.get("display", None)
+        return resource_refs.get_or_create(
+            (value, ref, display),
+            lambda: ResourceRef(ref=ref, value=value, display=display),
+        )
 
     def to_dict(self):
         return {
@@ -106,6 +139,10 @@ class ResourceRef:
         }
 
 
+# one canonical ResourceRef per referenced resource, used by from_dict
+resource_refs: HashConsTable[ResourceRef] = HashConsTable()
+
+
 T = TypeVar("T", bound="Resource")
 
 
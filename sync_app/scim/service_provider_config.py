@@ -0,0 +1,53 @@
+from typing import Mapping, Iterable, Optional
+from sync_app.scim.resource import Resource
+from sync_app.scim.bulk import BulkLimits
+
+SERVICE_PROVIDER_CONFIG_SCHEMA = (
+    "urn:ietf:params:scim:schemas:core:2.0:ServiceProviderConfig"
+)
+
+BEARER_TOKEN_SCHEME = {
+    "type": "oauthbearertoken",
+    "name": "OAuth Bearer Token",
+    "description": "Authentication scheme using the OAuth Bearer Token Standard",
+    "specUri": "http://www.rfc-editor.org/info/rfc6750",
+}
+
+
+class ServiceProviderConfig(Resource):
+    """What this server supports, RFC 7643 section 5"""
+
+    bulk: Optional[BulkLimits]
+    patch: bool
+    sort: bool
+    authentication_schemes: Iterable[Mapping]
+
+    def __init__(
+        self,
+        bulk: Optional[BulkLimits] = None,
+        patch: bool = False,
+        sort: bool = True,
+        authentication_schemes: Iterable[Mapping] = (BEARER_TOKEN_SCHEME,),
+    ):
+        super().__init__([SERVICE_PROVIDER_CONFIG_SCHEMA])
+        self.bulk = bulk
+        self.patch = patch
+        self.sort = sort
+        self.authentication_schemes = authentication_schemes
+
+    def to_dict(self) -> Mapping:
+        bulk: dict = {"supported": self.bulk is not None}
+        if self.bulk is not None:
+            bulk["maxOperations"] = self.bulk.max_operations
+            bulk["maxPayloadSize"] = self.bulk.max_payload_size
+
+        return {
+            "schemas": [SERVICE_PROVIDER_CONFIG_SCHEMA],
+            "patch": {"supported": self.patch},
+            "bulk": bulk,
+            "filter": {"supported": True},
+            "changePassword": {"supported": False},
+            "sort": {"supported": self.sort},
+            "etag": {"supported": False},
+            "authenticationSchemes": list(self.authentication_schemes),
+        }
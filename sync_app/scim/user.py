@@ -1,21 +1,37 @@
 from sync_app.scim.resource import ResourceWithMeta, ResourceMeta, ResourceRef
-from typing import Iterable, OrderedDict, Optional, TypeAlias, Mapping, List
+from sync_app.scim.intern import intern_str
+from typing import (
+    Iterable,
+    OrderedDict,
+    Optional,
+    TypeAlias,
+    Mapping,
+    List,
+    ClassVar,
+    Tuple,
+)
 from dataclasses import dataclass, asdict
 from uuid import UUID
 
 USER_RESOURCE_TYPE = "User"
 USER_SCHEMA = "urn:ietf:params:scim:schemas:core:2.0:User"
+# shared by every user
+USER_SCHEMAS = (USER_SCHEMA,)
 
 
-@dataclass
+@dataclass(slots=True)
 class Email:
     value: Optional[str] = None
     type: Optional[str] = None
     primary: Optional[bool] = None
     display: Optional[str] = None
 
+    def __post_init__(self):
+        # "work", "home" and the like
+        self.type = intern_str(self.type)
 
-@dataclass
+
+@dataclass(slots=True)
 class Name:
     formatted: Optional[str] = None
     familyName: Optional[str] = None
@@ -23,12 +39,21 @@ class Name:
 
 
 class User(ResourceWithMeta):
+    __slots__ = ("active", "userName", "emails", "name", "groups", "displayName")
     active: bool
     userName: str
-    emails: Optional[Iterable[Email]] = None
-    name: Optional[Name] = None
-    groups: Optional[Iterable[ResourceRef]] = None
-    displayName: Optional[str] = None
+    emails: Optional[Iterable[Email]]
+    name: Optional[Name]
+    groups: Optional[Iterable[ResourceRef]]
+    displayName: Optional[str]
+    unique_attributes: ClassVar[Tuple[str, ...]] = ("id", "userName")
+    indexed_attributes: ClassVar[Tuple[str, ...]] = ("externalId", "emails.value")
+    sorted_attributes: ClassVar[Tuple[str, ...]] = (
+        "userName",
+        "displayName",
+        "meta.created",
+        "meta.lastModified",
+    )
 
     def __init__(
         self,
@@ -40,8 +65,9 @@ class User(ResourceWithMeta):
         name: Optional[Name],
         emails: Optional[Iterable[Email]],
         groups: Optional[Iterable[ResourceRef]] = None,
+        externalId: Optional[str] = None,
     ):
-        super().__init__([USER_SCHEMA], meta, user_id)
+        super().__init__(USER_SCHEMAS, meta, user_id, externalId)
         self.displayName = displayName
         self.active = active
         self.userName = userName
@@ -82,6 +108,7 @@ class User(ResourceWithMeta):
             name=name,
             emails=emails,
             groups=groups,
+            externalId=resource.get("externalId", None),
         )
 
     def get_id(self) -> UUID:
@@ -108,6 +135,7 @@ class User(ResourceWithMeta):
 
 
 class NewUser(User):
+    __slots__ = ("password",)
 
     def __init__(
         self,
@@ -1,24 +1,45 @@
-from typing import TypedDict, Literal
+from typing import Dict, TypedDict, Literal, Mapping, Optional, Protocol
 import json
 from sync_app.scim.resource import ResourceWithMeta, Resource
+from sync_app.scim.patchop import PatchOp
+from sync_app.scim.bulk import BulkOperation, BulkRequest
 import requests
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+from sync_app.http_session import PoolConfiguration, PooledSession
 
 
 Operation = Literal["add", "remove", "replace"]
 
 
+class ResourceChangeHandler(Protocol):
+    """Anything handlers can report created and replaced resources to"""
+
+    def handle_resource_change(
+        self, operation: Operation, resource: ResourceWithMeta
+    ) -> None:
+        ...
+
+
 @dataclass
 class ServerConfiguration:
     server_url: str
     auth_token: str
+    pool: PoolConfiguration = field(default_factory=PoolConfiguration)
 
 
 class SCIMServer:
     config: ServerConfiguration
+    # keeps connections to the downstream server open between changes
+    session: PooledSession
+    # resource path -> the resource as handle_resource_change last delivered it, so
+    # replacements can be sent as a PATCH of what changed. OutboxDispatcher keeps its
+    # own, durable, record in the outbox.
+    delivered: Dict[str, Mapping]
 
     def __init__(self, config: ServerConfiguration):
         self.config = config
+        self.session = PooledSession(config.pool, self.request_headers())
+        self.delivered = {}
 
     def request_headers(self):
         return {
@@ -27,33 +48,93 @@ class SCIMServer:
             "Accept": "application/scim+json; charset=utf-8",
         }
 
-    def handle_resource_change(self, operation: Operation, resource: ResourceWithMeta):
+    def change_request(
+        self, operation: Operation, resource: ResourceWithMeta
+    ) -> Optional["ChangeRequest"]:
+        """The downstream request which propagates a change, if it needs one"""
         assert resource.meta.resourceType in [
             "Group",
             "User",
         ], "Only groups and users can be sent on change"
 
-        response = None
-
         # issue a PUT request downstream
         if operation == "replace":
-            response = requests.put(
-                f"{self.config.server_url}/{resource.meta.resourceType}s/{resource.id}",
-                data=json.dumps(resource.to_dict()),
-                headers=self.request_headers(),
+            return ChangeRequest(
+                "PUT",
+                f"{resource.meta.resourceType}s/{resource.id}",
+                resource.to_dict(),
             )
 
         # issue a POST request downstream
         elif operation == "add":
             resource_as_dict = resource.to_dict()
             resource_as_dict.update({"entitlements": [{"value": "00eao000000cSL6"}]})
-            response = requests.post(
-                f"{self.config.server_url}/{resource.meta.resourceType}s",
-                data=json.dumps(resource_as_dict),
-                headers=self.request_headers(),
+            return ChangeRequest(
+                "POST", f"{resource.meta.resourceType}s", resource_as_dict
             )
 
-        if response is not None:
-            print(response.request.headers)
-            print(response.request.url)
-            print(json.dumps(response.request.body, indent=2))
+        return None
+
+    def delta_request(
+        self, change: "ChangeRequest", previous: Optional[Mapping]
+    ) -> Optional["ChangeRequest"]:
+        """
+        Turns a PUT into a PATCH of just what changed since previous, the version
+        downstream already has. The PUT is kept when the PATCH would not be smaller,
+        and None is returned when there is nothing to send.
+        """
+        if change.method != "PUT" or previous is None:
+            return change
+
+        patch = PatchOp.from_diff(previous, change.body)
+        if not patch.operations:
+            return None
+
+        body = patch.to_dict()
+        if len(json.dumps(body)) >= len(json.dumps(change.body)):
+            return change
+        return ChangeRequest("PATCH", change.path, body)
+
+    def send(self, change: "ChangeRequest") -> requests.Response:
+        return self.session.request(
+            change.method,
+            f"{self.config.server_url}/{change.path}",
+            # bytes, http.client only sends a body in the same packet as the headers
+            # when it is already encoded
+            data=json.dumps(change.body).encode(),
+        )
+
+    def bulk_operation(self, change: "ChangeRequest", bulk_id: str) -> BulkOperation:
+        return BulkOperation(change.method, f"/{change.path}", bulk_id, change.body)
+
+    def send_bulk(self, bulk: BulkRequest) -> requests.Response:
+        """Submits several changes in one request, RFC 7644 section 3.7"""
+        return self.session.post(
+            f"{self.config.server_url}/Bulk", data=json.dumps(bulk.to_dict()).encode()
+        )
+
+    def handle_resource_change(
+        self, operation: Operation, resource: ResourceWithMeta
+    ) -> None:
+        """
+        Sends the change downstream, raising if it was not accepted. Changes to the
+        same resource must not be handled concurrently, ChangeDispatcher sends them
+        one at a time.
+        """
+        change = self.change_request(operation, resource)
+        if change is None:
+            return
+
+        path = f"{resource.meta.resourceType}s/{resource.id}"
+        request = self.delta_request(change, self.delivered.get(path))
+        if request is not None:
+            self.send(request).raise_for_status()
+        self.delivered[path] = change.body
+
+
+@dataclass(frozen=True)
+class ChangeRequest:
+    method: Literal["POST", "PUT", "PATCH"]
+    # relative to ServerConfiguration.server_url
+    path: str
+    body: Mapping
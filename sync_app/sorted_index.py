@@ -0,0 +1,217 @@
+"""
+Sorted list for the ordered indexes of MemoryStore
+
+A single Python list makes every insert or removal move all the entries after it, which
+at a million records costs more than the rest of a create put together. SortedIndex
+keeps its entries in blocks of at most BLOCK_SIZE, so an insert moves at most one
+block's worth of entries, and finds positions through a Fenwick tree over the lengths
+of the blocks.
+"""
+
+import bisect
+from typing import (
+    Any,
+    Callable,
+    Generic,
+    Iterator,
+    List,
+    Optional,
+    Protocol,
+    Tuple,
+    TypeVar,
+    overload,
+)
+
+
+class Comparable(Protocol):
+    def __lt__(self, other: Any) -> bool:
+        ...
+
+
+E = TypeVar("E", bound=Comparable)
+
+# a block is split in two once it grows past this many entries
+BLOCK_SIZE = 1024
+
+
+def merge_sorted(entries: list, new_entries: list) -> list:
+    """
+    Merges two sorted lists. Each new entry is placed by bisecting entries, which
+    costs far fewer comparisons than sorting them together when entries is the
+    longer of the two, and the runs of entries between them are copied over whole.
+    """
+    merged = []
+    start = 0
+    for entry in new_entries:
+        i = bisect.bisect_left(entries, entry, start)
+        merged.extend(entries[start:i])
+        merged.append(entry)
+        start = i
+    merged.extend(entries[start:])
+    return merged
+
+
+class SortedIndex(Generic[E]):
+    blocks: List[List[E]]
+    # the last entry of every block, bisected to find the block an entry belongs in
+    maxes: List[E]
+    # Fenwick tree over len(block), 1-based positions stored 0-based
+    tree: List[int]
+    size: int
+
+    def __init__(self, entries: Optional[List[E]] = None):
+        """entries, if given, must already be sorted"""
+        self.rebuild(entries or [])
+
+    def rebuild(self, entries: List[E]) -> None:
+        # half full blocks, so inserts do not split them right away
+        step = BLOCK_SIZE // 2
+        self.blocks = [entries[i : i + step] for i in range(0, len(entries), step)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(entries)
+        self.build_tree()
+
+    def build_tree(self) -> None:
+        tree = [len(block) for block in self.blocks]
+        for k in range(1, len(tree) + 1):
+            parent = k + (k & -k)
+            if parent <= len(tree):
+                tree[parent - 1] += tree[k - 1]
+        self.tree = tree
+
+    def grow(self, block: int, delta: int) -> None:
+        tree = self.tree
+        k = block + 1
+        while k <= len(tree):
+            tree[k - 1] += delta
+            k += k & -k
+
+    def offset(self, block: int) -> int:
+        """The number of entries in the blocks before block"""
+        total = 0
+        k = block
+        while k > 0:
+            total += self.tree[k - 1]
+            k -= k & -k
+        return total
+
+    def locate(self, position: int) -> Tuple[int, int]:
+        """The block holding position and where in it, (len(blocks), 0) past the end"""
+        tree = self.tree
+        k = 0
+        step = 1 << (len(tree).bit_length() - 1) if tree else 0
+        while step:
+            further = k + step
+            if further <= len(tree) and tree[further - 1] <= position:
+                k = further
+                position -= tree[further - 1]
+            step >>= 1
+        return k, position
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, entry: Any) -> bool:
+        i = self.bisect_left(entry)
+        return i < self.size and self[i] == entry
+
+    def __iter__(self) -> Iterator[E]:
+        for block in self.blocks:
+            yield from block
+
+    @overload
+    def __getitem__(self, index: int) -> E:
+        ...
+
+    @overload
+    def __getitem__(self, index: slice) -> List[E]:
+        ...
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, stride = index.indices(self.size)
+            assert stride == 1, "only contiguous slices are supported"
+            return self.slice(start, stop)
+
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("SortedIndex index out of range")
+        block, position = self.locate(index)
+        return self.blocks[block][position]
+
+    def slice(self, start: int, stop: int) -> List[E]:
+        result: List[E] = []
+        remaining = stop - start
+        if remaining <= 0:
+            return result
+
+        block, position = self.locate(start)
+        while remaining > 0 and block < len(self.blocks):
+            chunk = self.blocks[block][position : position + remaining]
+            result.extend(chunk)
+            remaining -= len(chunk)
+            block += 1
+            position = 0
+        return result
+
+    def bisect_left(self, value: Any, key: Optional[Callable[[E], Any]] = None) -> int:
+        block = bisect.bisect_left(self.maxes, value, key=key)
+        if block == len(self.blocks):
+            return self.size
+        return self.offset(block) + bisect.bisect_left(self.blocks[block], value, key=key)
+
+    def bisect_right(self, value: Any, key: Optional[Callable[[E], Any]] = None) -> int:
+        block = bisect.bisect_right(self.maxes, value, key=key)
+        if block == len(self.blocks):
+            return self.size
+        return self.offset(block) + bisect.bisect_right(self.blocks[block], value, key=key)
+
+    def add(self, entry: E) -> None:
+        if not self.blocks:
+            self.rebuild([entry])
+            return
+
+        block = bisect.bisect_right(self.maxes, entry)
+        if block == len(self.blocks):
+            block -= 1
+            self.blocks[block].append(entry)
+            self.maxes[block] = entry
+        else:
+            bisect.insort(self.blocks[block], entry)
+        self.size += 1
+
+        entries = self.blocks[block]
+        if len(entries) > BLOCK_SIZE:
+            half = len(entries) // 2
+            self.blocks[block : block + 1] = [entries[:half], entries[half:]]
+            self.maxes[block : block + 1] = [entries[half - 1], entries[-1]]
+            self.build_tree()
+        else:
+            self.grow(block, 1)
+
+    def update(self, new_entries: List[E]) -> None:
+        """Adds new_entries, which must be sorted"""
+        if len(new_entries) * 8 > self.size:
+            # a large batch is cheaper to merge in whole than to insert entry by entry
+            self.rebuild(merge_sorted(list(self), new_entries))
+            return
+        for entry in new_entries:
+            self.add(entry)
+
+    def remove(self, entry: E) -> None:
+        block = bisect.bisect_left(self.maxes, entry)
+        entries = self.blocks[block] if block < len(self.blocks) else []
+        i = bisect.bisect_left(entries, entry)
+        if i == len(entries) or entries[i] != entry:
+            raise ValueError(f"{entry!r} is not in the index")
+
+        del entries[i]
+        self.size -= 1
+        if entries:
+            self.maxes[block] = entries[-1]
+            self.grow(block, -1)
+        else:
+            del self.blocks[block]
+            del self.maxes[block]
+            self.build_tree()
@@ -0,0 +1,578 @@
+"""
+Store kept in a SQLite database, so records survive a restart
+
+Every record is kept as its serialized form. Its unique and sorted attributes are
+copied into columns of their own, with unique indexes on the unique ones and ordered
+indexes on the sorted ones, and the values of its other indexed attributes, which may
+be multi-valued like emails.value, go in a side table of (record, attribute, value)
+rows. The database runs in WAL mode so reads are not blocked by a write in progress.
+
+Filters on those attributes are translated into SQL and answered by SQLite, see
+SqliteStore.query. Whatever can't be translated exactly is left for the caller to
+evaluate against what SQLite returns.
+"""
+
+import json
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generic,
+    Iterable,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+)
+from uuid import UUID
+from sync_app import exceptions
+from sync_app.parsers.filter_ast import (
+    And,
+    AttributeGroup,
+    Comparison,
+    Expression,
+    FilterPath,
+    Not,
+    Or,
+    Present,
+)
+from sync_app.parsers.python_filter import (
+    DATETIME_ATTRIBUTES,
+    DATETIME_OPERATORS,
+    parse_datetime,
+    resolve_attribute,
+    sortable_value,
+)
+from sync_app.query_planner import equality_lookups
+from sync_app.store import HasId, RangeBound
+
+DEFAULT_STORE_PATH = "store.sqlite3"
+
+T = TypeVar("T", bound="HasId")
+
+# SQL tests of a single value, every ? is the value from the filter
+VALUE_TESTS: Mapping[str, str] = {
+    "eq": "{value} = ?",
+    "gt": "{value} > ?",
+    "ge": "{value} >= ?",
+    "lt": "{value} < ?",
+    "le": "{value} <= ?",
+    "co": "instr({value}, ?) > 0",
+    "sw": "substr({value}, 1, length(?)) = ?",
+    "ew": "substr({value}, length({value}) - length(?) + 1) = ?",
+}
+
+
+def sql_value(path: FilterPath, value: Any) -> Optional[str]:
+    """
+    The form path's value is kept in, None when it is missing or can't be compared.
+    dateTimes are kept in UTC at a fixed width so they compare in order as text.
+    """
+    value = sortable_value(path, value)
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None).isoformat(timespec="microseconds")
+    return value
+
+
+def value_test(operator: str, value_sql: str, value: str) -> Tuple[str, Tuple]:
+    """The SQL test of value_sql against value from the filter, with its parameters"""
+    if operator == "sw" and value:
+        # every string starting with value sorts from value up to, but not including,
+        # value with its last character incremented, a range indexes can answer
+        last = ord(value[-1]) + 1
+        if last <= 0x10FFFF and not 0xD800 <= last <= 0xDFFF:
+            upper = value[:-1] + chr(last)
+            return f"{value_sql} >= ? AND {value_sql} < ?", (value, upper)
+    test = VALUE_TESTS[operator].format(value=value_sql)
+    return test, (value,) * test.count("?")
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+@dataclass(frozen=True)
+class Clause:
+    sql: str
+    params: Tuple[Any, ...]
+    # whether the records the clause selects are exactly the ones the filter matches,
+    # otherwise they are a superset which the filter still has to be run on
+    exact: bool
+
+
+def conjoin(clauses: Sequence[Clause], operator: str, exact: bool) -> Clause:
+    if len(clauses) == 1:
+        return Clause(clauses[0].sql, clauses[0].params, exact)
+    return Clause(
+        f" {operator} ".join(f"({c.sql})" for c in clauses),
+        tuple(p for c in clauses for p in c.params),
+        exact,
+    )
+
+
+class SqliteStore(Generic[T]):
+    table: str
+    # filter path -> the column it is kept in
+    columns: Dict[str, str]
+    # filter paths kept in the side table
+    value_attributes: Tuple[str, ...]
+
+    def __init__(
+        self, record_type: Type[T], path: str = DEFAULT_STORE_PATH, table: str = ""
+    ):
+        self.from_dict: Callable[[Mapping], T] = record_type.from_dict  # type: ignore
+        self.table = table or record_type.__name__.lower() + "s"
+        self.unique_attributes = tuple(
+            a for a in record_type.unique_attributes if a != "id"
+        )
+        self.sorted_attributes = record_type.sorted_attributes
+        self.columns = {
+            attribute: re.sub(r"\W", "_", attribute)
+            for attribute in dict.fromkeys(
+                self.unique_attributes + self.sorted_attributes
+            )
+        }
+        self.value_attributes = tuple(
+            a for a in record_type.indexed_attributes if a not in self.columns
+        )
+        self.values_table = self.table + "_values"
+
+        # autocommit, writes of more than one statement open their own transaction
+        self.connection = sqlite3.connect(
+            path, isolation_level=None, check_same_thread=False
+        )
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # a crash of the process loses nothing, losing power may lose the last commits
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(self.schema())
+        self.lock = threading.Lock()
+
+        # built once so every call runs the same statement text, which sqlite3 keeps
+        # prepared in its statement cache
+        column_names = "".join(f", {quote(c)}" for c in self.columns.values())
+        placeholders = "".join(", ?" for _ in self.columns)
+        assignments = "".join(f", {quote(c)} = ?" for c in self.columns.values())
+        table, values = quote(self.table), quote(self.values_table)
+        self.insert_sql = (
+            f"INSERT INTO {table} (id, resource{column_names}) "
+            f"VALUES (?, ?{placeholders})"
+        )
+        self.update_sql = (
+            f"UPDATE {table} SET resource = ?{assignments} WHERE id = ? RETURNING seq"
+        )
+        self.insert_values_sql = f"INSERT INTO {values} VALUES (?, ?, ?)"
+        self.delete_values_sql = f"DELETE FROM {values} WHERE seq = ?"
+
+    def schema(self) -> str:
+        table, values = quote(self.table), quote(self.values_table)
+        statements = [
+            f"""CREATE TABLE IF NOT EXISTS {table} (
+                seq INTEGER PRIMARY KEY,
+                id TEXT NOT NULL UNIQUE,
+                resource TEXT NOT NULL
+                {"".join(f", {quote(c)} TEXT" for c in self.columns.values())}
+            )""",
+            f"""CREATE TABLE IF NOT EXISTS {values} (
+                seq INTEGER NOT NULL,
+                attribute TEXT NOT NULL,
+                value TEXT NOT NULL
+            )""",
+            f"""CREATE INDEX IF NOT EXISTS {quote(self.values_table + "_lookup")}
+                ON {values} (attribute, value, seq)""",
+            f"""CREATE INDEX IF NOT EXISTS {quote(self.values_table + "_seq")}
+                ON {values} (seq)""",
+        ]
+        for attribute in self.unique_attributes:
+            column = self.columns[attribute]
+            statements.append(
+                f"""CREATE UNIQUE INDEX IF NOT EXISTS
+                {quote(f"{self.table}_{column}_unique")} ON {table} ({quote(column)})"""
+            )
+        for attribute in self.sorted_attributes:
+            column = self.columns[attribute]
+            statements.append(
+                f"""CREATE INDEX IF NOT EXISTS {quote(f"{self.table}_{column}_sorted")}
+                ON {table} ({quote(column)}, id)"""
+            )
+        return ";\n".join(statements) + ";"
+
+    def close(self) -> None:
+        with self.lock:
+            self.connection.close()
+
+    def row(self, record: T) -> Tuple[str, Tuple[Optional[str], ...], List[Tuple]]:
+        """record's serialized form, its column values and its side table values"""
+        resource = record.to_dict()
+        columns = tuple(
+            sql_value(path, resolve_attribute(path, resource))
+            for path in (tuple(a.split(".")) for a in self.columns)
+        )
+        values = []
+        for attribute in self.value_attributes:
+            value = resolve_attribute(tuple(attribute.split(".")), resource)
+            for v in dict.fromkeys(value if isinstance(value, list) else [value]):
+                if isinstance(v, str):
+                    values.append((attribute, v))
+        return json.dumps(resource), columns, values
+
+    def conflict(
+        self, record: T, error: sqlite3.IntegrityError
+    ) -> exceptions.SCIMException:
+        for attribute, column in self.columns.items():
+            if str(error).endswith(f".{column}"):
+                value = getattr(record, attribute, None)
+                return exceptions.ResourceConflict(
+                    f"Could not store record, {attribute} {value!r} is already in use"
+                )
+        return exceptions.ResourceConflict(f"Could not create record {record}")
+
+    def insert(self, record: T) -> None:
+        """Writes record in the open transaction, raising ResourceConflict"""
+        resource, columns, values = self.row(record)
+        try:
+            cursor = self.connection.execute(
+                self.insert_sql, (str(record.get_id()), resource, *columns)
+            )
+        except sqlite3.IntegrityError as e:
+            raise self.conflict(record, e)
+        self.connection.executemany(
+            self.insert_values_sql, ((cursor.lastrowid, a, v) for a, v in values)
+        )
+
+    def create(self, new_record: T) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            self.insert(new_record)
+
+    def create_many(
+        self, new_records: Sequence[T]
+    ) -> List[Optional[exceptions.SCIMException]]:
+        """
+        Creates every record in new_records which does not conflict with the store or
+        an earlier record in the batch, in a single transaction. Returns the error each
+        record could not be created with, or None.
+        """
+        errors: List[Optional[exceptions.SCIMException]] = []
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            for record in new_records:
+                try:
+                    self.insert(record)
+                    errors.append(None)
+                except exceptions.ResourceConflict as e:
+                    # only the failed statement is undone, the transaction carries on
+                    errors.append(e)
+        return errors
+
+    def get_by_id(self, key: UUID) -> T:
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT resource FROM {quote(self.table)} WHERE id = ?", (str(key),)
+            ).fetchone()
+        if row is None:
+            raise exceptions.ResourceMissing(f"Could not find {key} in store")
+        return self.from_dict(json.loads(row[0]))
+
+    def update(self, updated_record: T) -> None:
+        resource, columns, values = self.row(updated_record)
+        id = str(updated_record.get_id())
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            try:
+                row = self.connection.execute(
+                    self.update_sql, (resource, *columns, id)
+                ).fetchone()
+            except sqlite3.IntegrityError as e:
+                raise self.conflict(updated_record, e)
+            if row is None:
+                raise exceptions.ResourceMissing()
+            self.connection.execute(self.delete_values_sql, row)
+            self.connection.executemany(
+                self.insert_values_sql, ((row[0], a, v) for a, v in values)
+            )
+
+    def delete_by_id(self, key: UUID) -> None:
+        with self.lock, self.connection:
+            self.connection.execute("BEGIN")
+            row = self.connection.execute(
+                f"DELETE FROM {quote(self.table)} WHERE id = ? RETURNING seq",
+                (str(key),),
+            ).fetchone()
+            if row is None:
+                raise exceptions.ResourceMissing()
+            self.connection.execute(self.delete_values_sql, row)
+
+    def select(
+        self, where: str = "", params: Iterable = (), order: str = "seq"
+    ) -> List[T]:
+        sql = f"SELECT resource FROM {quote(self.table)}"
+        if where:
+            sql += f" WHERE {where}"
+        sql += f" ORDER BY {order}"
+        with self.lock:
+            rows = self.connection.execute(sql, tuple(params)).fetchall()
+        return [self.from_dict(json.loads(resource)) for (resource,) in rows]
+
+    def count(self, where: str = "", params: Iterable = ()) -> int:
+        sql = f"SELECT COUNT(*) FROM {quote(self.table)}"
+        if where:
+            sql += f" WHERE {where}"
+        with self.lock:
+            return self.connection.execute(sql, tuple(params)).fetchone()[0]
+
+    def get_all(self) -> Sequence[T]:
+        return self.select()
+
+    def get_page(self, start_index: int, count: int) -> Tuple[int, Sequence[T]]:
+        """
+        Returns the total number of records and count records from 1-based
+        start_index
+        """
+        page = self.select("", (count, start_index - 1), "seq LIMIT ? OFFSET ?")
+        return self.count(), page
+
+    def lookup_clause(self, attribute: str, value: Any) -> Optional[Clause]:
+        """
+        The condition on records whose attribute equals value, a condition nothing
+        matches when value cannot be stored there, or None when the attribute is not
+        indexed
+        """
+        if attribute != "id" and attribute not in self.unique_attributes:
+            if attribute not in self.value_attributes:
+                return None
+        if not isinstance(value, str):
+            return Clause("0", (), True)
+        clause = self.translate(Comparison(tuple(attribute.split(".")), "eq", value))
+        assert clause is not None, "indexed attributes can always be looked up"
+        return clause
+
+    def lookup(self, attribute: str, value: Any) -> Optional[Sequence[T]]:
+        """
+        Returns every record whose attribute equals value, or None when the attribute
+        is not indexed and the caller has to scan instead
+        """
+        clause = self.lookup_clause(attribute, value)
+        if clause is None:
+            return None
+        return self.select(clause.sql, clause.params)
+
+    def lookup_size(self, attribute: str, value: Any) -> Optional[int]:
+        clause = self.lookup_clause(attribute, value)
+        if clause is None:
+            return None
+        return self.count(clause.sql, clause.params)
+
+    def range_clause(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound],
+        upper: Optional[RangeBound],
+    ) -> Optional[Clause]:
+        """The condition on records whose attribute lies between the bounds"""
+        if attribute not in self.sorted_attributes:
+            return None
+
+        path = tuple(attribute.split("."))
+        column = quote(self.columns[attribute])
+        conditions, params = [f"{column} IS NOT NULL"], []
+        for bound, operators in [(lower, (">=", ">")), (upper, ("<=", "<"))]:
+            if bound is not None:
+                value = sql_value(path, bound.value)
+                if value is None:
+                    return Clause("0", (), True)
+                conditions.append(f"{column} {operators[not bound.inclusive]} ?")
+                params.append(value)
+        return Clause(" AND ".join(conditions), tuple(params), True)
+
+    def range_lookup(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[Sequence[T]]:
+        """
+        Returns every record whose attribute lies between the bounds in ascending
+        order, or None when the attribute has no ordered index
+        """
+        clause = self.range_clause(attribute, lower, upper)
+        if clause is None:
+            return None
+        column = quote(self.columns[attribute])
+        return self.select(clause.sql, clause.params, f"{column}, id")
+
+    def range_size(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[int]:
+        clause = self.range_clause(attribute, lower, upper)
+        if clause is None:
+            return None
+        return self.count(clause.sql, clause.params)
+
+    def get_sorted_page(
+        self, attribute: str, ascending: bool, start_index: int, count: int
+    ) -> Optional[Tuple[int, Sequence[T]]]:
+        """
+        Like get_page but ordered by attribute, records without a value come last in
+        ascending order and first in descending order. Returns None when the attribute
+        has no ordered index and the caller has to sort instead.
+        """
+        if attribute not in self.sorted_attributes:
+            return None
+
+        column = quote(self.columns[attribute])
+        direction = "ASC" if ascending else "DESC"
+        segments = [
+            (f"{column} IS NOT NULL", f"{column} {direction}, id {direction}"),
+            (f"{column} IS NULL", f"id {direction}"),
+        ]
+        # descending order is the exact reverse of ascending order, nulls included
+        if not ascending:
+            segments.reverse()
+
+        records: List[T] = []
+        position = start_index - 1
+        for where, order in segments:
+            with self.lock:
+                (size,) = self.connection.execute(
+                    f"SELECT COUNT(*) FROM {quote(self.table)} WHERE {where}"
+                ).fetchone()
+            if position >= size:
+                position -= size
+                continue
+            limit = count - len(records)
+            records.extend(
+                self.select(where, (limit, position), f"{order} LIMIT ? OFFSET ?")
+            )
+            position = 0
+            if len(records) >= count:
+                break
+
+        return self.count(), records
+
+    def query(self, expression: Expression) -> Optional[Tuple[Sequence[T], bool]]:
+        """
+        Runs as much of expression as can be translated into SQL, returning the
+        records it selects and whether they are exactly the ones expression matches.
+        None when nothing could be translated.
+        """
+        clause = self.translate(expression)
+        if clause is None:
+            return None
+        return self.select(clause.sql, clause.params), clause.exact
+
+    def translate(self, expression: Expression) -> Optional[Clause]:
+        """
+        The SQL condition for expression, which matches at least every record
+        expression does, or None when it doesn't narrow the records down at all
+        """
+        if isinstance(expression, Comparison):
+            return self.translate_comparison(expression)
+
+        if isinstance(expression, Present):
+            return self.translate_present(expression)
+
+        if isinstance(expression, And):
+            operands = [self.translate(e) for e in expression.operands]
+            clauses = [c for c in operands if c is not None]
+            if not clauses:
+                return None
+            exact = len(clauses) == len(operands) and all(c.exact for c in clauses)
+            return conjoin(clauses, "AND", exact)
+
+        if isinstance(expression, Or):
+            operands = [self.translate(e) for e in expression.operands]
+            clauses = [c for c in operands if c is not None]
+            if len(clauses) < len(operands):
+                # a branch which can't be narrowed down could match any record
+                return None
+            return conjoin(clauses, "OR", all(c.exact for c in clauses))
+
+        if isinstance(expression, Not):
+            # the complement of a superset is not a superset of the complement
+            operand = self.translate(expression.operand)
+            if operand is None or not operand.exact:
+                return None
+            return Clause(f"NOT ({operand.sql})", operand.params, True)
+
+        if isinstance(expression, AttributeGroup):
+            # emails[type eq "work" and value eq "x"] needs emails.value eq "x", but
+            # the whole group still has to hold for a single email
+            lookups = [
+                self.translate_comparison(
+                    Comparison(tuple(lookup.attribute.split(".")), "eq", lookup.value)
+                )
+                for lookup, _ in equality_lookups(expression)
+            ]
+            clauses = [c for c in lookups if c is not None]
+            return conjoin(clauses, "AND", False) if clauses else None
+
+        return None
+
+    def translate_present(self, expression: Present) -> Optional[Clause]:
+        attribute = ".".join(expression.path)
+        # a dateTime column holds null for values which aren't dateTimes, and whether a
+        # multi-valued attribute is present depends on more than its values
+        if attribute not in self.columns or expression.path in DATETIME_ATTRIBUTES:
+            return None
+        column = quote(self.columns[attribute])
+        return Clause(f"{column} IS NOT NULL AND {column} <> ''", (), True)
+
+    def translate_comparison(self, expression: Comparison) -> Optional[Clause]:
+        attribute = ".".join(expression.path)
+        operator, value = expression.operator, expression.value
+        if operator not in VALUE_TESTS and operator != "ne":
+            return None
+
+        if expression.path in DATETIME_ATTRIBUTES:
+            # compared as dateTimes, an invalid one is left for the filter to report
+            if operator not in DATETIME_OPERATORS or not isinstance(value, str):
+                return None
+            try:
+                value = sql_value(expression.path, parse_datetime(value))
+            except ValueError:
+                return None
+        elif value is None:
+            if operator not in ("eq", "ne"):
+                return None
+        elif not isinstance(value, str):
+            # numbers and booleans never equal the text kept here, but comparing them
+            # with the filter is an error it should report
+            return None
+
+        if attribute == "id" or attribute in self.columns:
+            column = quote(self.columns.get(attribute, "id"))
+            if value is None:
+                return Clause(
+                    f"{column} IS {'NOT ' if operator == 'ne' else ''}NULL", (), True
+                )
+            if operator == "ne":
+                return Clause(f"{column} IS NULL OR {column} <> ?", (value,), True)
+            test, params = value_test(operator, column, value)
+            # a missing value has to test false rather than null, so NOT works
+            return Clause(f"{column} IS NOT NULL AND {test}", params, True)
+
+        if attribute in self.value_attributes:
+            rows = f"SELECT seq FROM {quote(self.values_table)} WHERE attribute = ?"
+            if value is None:
+                negate = "NOT " if operator == "eq" else ""
+                return Clause(f"seq {negate}IN ({rows})", (attribute,), True)
+            if operator == "ne":
+                # ne is the negation of eq, none of the values may be equal
+                return Clause(
+                    f"seq NOT IN ({rows} AND value = ?)", (attribute, value), True
+                )
+            test, params = value_test(operator, "value", value)
+            return Clause(f"seq IN ({rows} AND {test})", (attribute, *params), True)
+
+        return None
@@ -1,28 +1,48 @@
-from typing import TypeVar, Sequence
-from typing import Protocol, TypeVar, Iterable
+from typing import TypeVar, Sequence, ClassVar, Tuple, Optional, Any
+from typing import Protocol, TypeVar, Iterable, List
 from uuid import UUID
+from dataclasses import dataclass
+from sync_app.exceptions import SCIMException
+from sync_app.parsers.filter_ast import Expression
 
 
 S = TypeVar("S")
 
 
+@dataclass(frozen=True)
+class RangeBound:
+    value: Any
+    inclusive: bool
+
+
 class HasId(Protocol):
+    # attributes which no two records in a store may share
+    unique_attributes: ClassVar[Tuple[str, ...]]
+    # filter paths which stores keep an equality index for
+    indexed_attributes: ClassVar[Tuple[str, ...]]
+    # filter paths which stores keep an ordered index for
+    sorted_attributes: ClassVar[Tuple[str, ...]]
+
     def get_id(self) -> UUID:
         ...
 
     def compare_unique(self: S, other: S) -> bool:
         ...
 
+    def to_dict(self) -> dict:
+        ...
+
 
 T = TypeVar("T", bound="HasId")
 
 
 class Store(Protocol[T]):
-    datastore: dict[UUID, T]
-
     def create(self, new_record: T) -> None:
         ...
 
+    def create_many(self, new_records: Sequence[T]) -> List[Optional[SCIMException]]:
+        ...
+
     def get_by_id(self, key: UUID) -> T:
         ...
 
@@ -34,3 +54,36 @@ class Store(Protocol[T]):
 
     def get_all(self) -> Sequence[T]:
         ...
+
+    def get_page(self, start_index: int, count: int) -> Tuple[int, Sequence[T]]:
+        ...
+
+    def lookup(self, attribute: str, value: Any) -> Optional[Sequence[T]]:
+        ...
+
+    def lookup_size(self, attribute: str, value: Any) -> Optional[int]:
+        ...
+
+    def range_lookup(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[Sequence[T]]:
+        ...
+
+    def range_size(
+        self,
+        attribute: str,
+        lower: Optional[RangeBound] = None,
+        upper: Optional[RangeBound] = None,
+    ) -> Optional[int]:
+        ...
+
+    def get_sorted_page(
+        self, attribute: str, ascending: bool, start_index: int, count: int
+    ) -> Optional[Tuple[int, Sequence[T]]]:
+        ...
+
+    def query(self, expression: Expression) -> Optional[Tuple[Sequence[T], bool]]:
+        ...
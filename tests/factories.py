@@ -0,0 +1,32 @@
+"""Resources for tests, spelling out only what a test cares about"""
+from sync_app.scim.resource import ResourceMeta
+from sync_app.scim.user import User, Email
+from datetime import datetime
+from typing import Optional, Sequence
+import uuid
+
+
+def make_user(
+    userName: str,
+    id: Optional[uuid.UUID] = None,
+    *,
+    displayName: Optional[str] = None,
+    active: bool = True,
+    emails: Sequence[Email] = (),
+    externalId: Optional[str] = None,
+    created: Optional[datetime] = None,
+    lastModified: Optional[datetime] = None,
+) -> User:
+    now = datetime.now()
+    return User(
+        meta=ResourceMeta(
+            "User", created or now, lastModified or now, "http://example.com"
+        ),
+        user_id=id or uuid.uuid1(),
+        displayName=displayName,
+        active=active,
+        userName=userName,
+        name=None,
+        emails=list(emails),
+        externalId=externalId,
+    )
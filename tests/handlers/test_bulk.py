@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+from sync_app.handlers import bulk, users
+from sync_app.handlers.common import RequestProvider
+from sync_app.memory_store import MemoryStore
+from sync_app.schema import ResourceValidator
+from sync_app.scim.bulk import BulkLimits
+from sync_app.scim.group import Group
+from sync_app.scim.resource import ResourceMeta
+from sync_app.scim.user import User
+from sync_app.server import SCIMServer
+from sync_app import exceptions
+from unittest import mock
+import os
+import pytest
+import uuid
+
+SCHEMAS = [
+    os.path.join(os.path.dirname(__file__), "..", "..", "schemas", name)
+    for name in [
+        "common.schema.json",
+        "group.schema.json",
+        "schemas.schema.json",
+        "user.schema.json",
+    ]
+]
+BULK_REQUEST = "urn:ietf:params:scim:api:messages:2.0:BulkRequest"
+
+
+@pytest.fixture
+def validator():
+    return ResourceValidator.load(SCHEMAS)
+
+
+@pytest.fixture
+def endpoints():
+    return {
+        "Users": bulk.BulkEndpoint(MemoryStore[User](), "User", User.from_dict, ""),
+        "Groups": bulk.BulkEndpoint(MemoryStore[Group](), "Group", Group.from_dict, ""),
+    }
+
+
+def user_data(userName: str):
+    return {
+        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:User"],
+        "userName": userName,
+    }
+
+
+def post(path: str, data, bulkId=None):
+    operation = {"method": "POST", "path": path, "data": data}
+    if bulkId is not None:
+        operation["bulkId"] = bulkId
+    return operation
+
+
+def run_bulk(endpoints, validator, operations, failOnErrors=None, limits=None):
+    server = mock.MagicMock(spec=SCIMServer)
+    provider = mock.MagicMock(spec=RequestProvider)
+    provider.url_for_resource.side_effect = lambda view, id: f"http://example.com/{id}"
+    provider.json_body = {"schemas": [BULK_REQUEST], "Operations": operations}
+    if failOnErrors is not None:
+        provider.json_body["failOnErrors"] = failOnErrors
+    limits = limits or BulkLimits()
+    response = bulk.handle_bulk(endpoints, validator, server, limits, provider)
+    return response["Operations"], server
+
+
+def test_bulk_creates_resolve_bulk_ids(endpoints, validator):
+    group = {
+        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:Group"],
+        "displayName": "team",
+        # referenced before the user is created
+        "members": [{"value": "bulkId:u1", "$ref": "bulkId:u1", "display": "foo"}],
+    }
+    results, server = run_bulk(
+        endpoints,
+        validator,
+        [
+            post("/Groups", group, "g1"),
+            post("/Users", user_data("foo"), "u1"),
+        ],
+    )
+
+    assert [r["status"] for r in results] == ["201", "201"]
+    (user,) = endpoints["Users"].store.get_all()
+    (group,) = endpoints["Groups"].store.get_all()
+    assert results[1]["location"] == f"http://example.com/{user.id}"
+    assert group.members[0].value == str(user.id)
+    assert server.handle_resource_change.call_count == 2
+
+
+def test_bulk_reports_errors_per_operation(endpoints, validator):
+    results, server = run_bulk(
+        endpoints,
+        validator,
+        [
+            post("/Users", user_data("foo"), "a"),
+            post("/Users", user_data("foo"), "b"),
+            post("/Users", {"schemas": []}, "c"),
+            post("/Users", {"userName": "bulkId:x"}),
+            {"method": "DELETE", "path": "/Users/x"},
+        ],
+    )
+
+    assert [r["status"] for r in results] == ["201", "409", "400", "409", "400"]
+    assert results[1]["response"]["scimType"] == "uniqueness"
+    assert len(endpoints["Users"].store.get_all()) == 1
+    assert server.handle_resource_change.call_count == 1
+
+
+def test_bulk_stops_after_fail_on_errors(endpoints, validator):
+    results, _ = run_bulk(
+        endpoints,
+        validator,
+        [
+            post("/Nothing", user_data("a")),
+            post("/Users", user_data("b")),
+            post("/Nothing", user_data("c")),
+            post("/Users", user_data("d")),
+        ],
+        failOnErrors=2,
+    )
+
+    assert [r["status"] for r in results] == ["400", "201", "400"]
+    assert [u.userName for u in endpoints["Users"].store.get_all()] == ["b"]
+
+
+def test_bulk_replaces_resources(endpoints, validator):
+    created, _ = run_bulk(endpoints, validator, [post("/Users", user_data("foo"))])
+    id = created[0]["location"].rsplit("/", 1)[1]
+    results, server = run_bulk(
+        endpoints,
+        validator,
+        [
+            {"method": "PUT", "path": f"/Users/{id}", "data": user_data("bar")},
+            {"method": "PUT", "path": f"/Users/{uuid.uuid1()}", "data": user_data("x")},
+        ],
+    )
+
+    assert [r["status"] for r in results] == ["200", "404"]
+    assert endpoints["Users"].store.get_by_id(uuid.UUID(id)).userName == "bar"
+    server.handle_resource_change.assert_called_once()
+
+
+def test_bulk_operations_are_limited(endpoints, validator):
+    operations = [post("/Users", user_data("a"))] * 3
+    with pytest.raises(exceptions.PayloadTooLarge):
+        run_bulk(endpoints, validator, operations, limits=BulkLimits(max_operations=2))
+
+
+def test_bulk_counts_store_errors_towards_fail_on_errors(endpoints, validator):
+    results, server = run_bulk(
+        endpoints,
+        validator,
+        [
+            post("/Users", user_data("a")),
+            post("/Users", user_data("a")),
+            post("/Users", user_data("b")),
+        ],
+        failOnErrors=1,
+    )
+
+    assert [r["status"] for r in results] == ["201", "409"]
+    assert [u.userName for u in endpoints["Users"].store.get_all()] == ["a"]
+    assert server.handle_resource_change.call_count == 1
+
+
+def test_bulk_writes_in_request_order(endpoints, validator):
+    created, _ = run_bulk(endpoints, validator, [post("/Users", user_data("foo"))])
+    id = created[0]["location"].rsplit("/", 1)[1]
+    results, _ = run_bulk(
+        endpoints,
+        validator,
+        [
+            {"method": "PUT", "path": f"/Users/{id}", "data": user_data("bar")},
+            # only free once the PUT before it has renamed foo
+            post("/Users", user_data("foo")),
+        ],
+    )
+
+    assert [r["status"] for r in results] == ["200", "201"]
+    names = sorted(u.userName for u in endpoints["Users"].store.get_all())
+    assert names == ["bar", "foo"]
+
+
+def test_bulk_validation_errors_match_single_requests(endpoints, validator):
+    invalid = {**user_data("foo"), "active": "yes"}
+    results, _ = run_bulk(endpoints, validator, [post("/Users", invalid)])
+
+    meta = ResourceMeta.create_meta("User", "http://example.com/x")
+    resource = {**invalid, "id": str(uuid.uuid1()), "meta": meta.to_dict()}
+    with pytest.raises(exceptions.ResourceValidationError) as raised:
+        users.validate_user(validator, resource)
+    expected = exceptions.as_scim_exception(raised.value)
+    assert results[0]["status"] == str(expected.code)
+    assert results[0]["response"]["scimType"] == expected.to_dict()["scimType"]
+    assert results[0]["response"]["detail"] == expected.to_dict()["detail"]
@@ -10,6 +10,7 @@ from sync_app.memory_store import MemoryStore, ObjectNotFound
 from sync_app.schema import ValidatorResult
 from sync_app.scim.user import User, Name
 from datetime import datetime
+import json
 import uuid
 
 
@@ -228,3 +229,167 @@ def test_handle_get_users_with_no_results_filter(populated_user_store):
         ),
     )
     assert not "Resources" in user_list
+
+
+@pytest.fixture
+def large_user_store(valid_user_resource):
+    store = MemoryStore[User]()
+    for i in range(50):
+        user = dict(valid_user_resource)
+        user.update({"id": str(uuid.uuid1()), "userName": f"user{i:02}"})
+        store.create(User.from_dict(user))
+    return store
+
+
+def test_handle_get_users_without_count_returns_every_match(large_user_store):
+    user_list = users.handle_get_users(large_user_store, RequestProvider(args={}))
+    assert user_list["totalResults"] == 50
+    assert user_list["startIndex"] == 1
+    assert user_list["itemsPerPage"] == 50
+    assert len(user_list["Resources"]) == 50
+
+    user_list = users.handle_get_users(
+        large_user_store, RequestProvider(args={"startIndex": "41"})
+    )
+    assert [u["userName"] for u in user_list["Resources"]] == [
+        f"user{i:02}" for i in range(40, 50)
+    ]
+
+
+def test_handle_get_users_paged(large_user_store):
+    user_list = users.handle_get_users(
+        large_user_store, RequestProvider(args={"startIndex": "11", "count": "5"})
+    )
+    assert user_list["totalResults"] == 50
+    assert user_list["startIndex"] == 11
+    assert user_list["itemsPerPage"] == 5
+    assert [u["userName"] for u in user_list["Resources"]] == [
+        f"user{i:02}" for i in range(10, 15)
+    ]
+
+
+def test_handle_get_users_paged_past_end(large_user_store):
+    user_list = users.handle_get_users(
+        large_user_store, RequestProvider(args={"startIndex": "48", "count": "10"})
+    )
+    assert user_list["totalResults"] == 50
+    assert [u["userName"] for u in user_list["Resources"]] == [
+        "user47",
+        "user48",
+        "user49",
+    ]
+
+
+def test_handle_get_users_paged_with_filter(large_user_store):
+    user_list = users.handle_get_users(
+        large_user_store,
+        RequestProvider(
+            args={"filter": 'userName sw "user1"', "startIndex": "3", "count": "4"}
+        ),
+    )
+    assert user_list["totalResults"] == 10
+    assert [u["userName"] for u in user_list["Resources"]] == [
+        f"user1{i}" for i in range(2, 6)
+    ]
+
+
+def test_handle_get_users_clamps_paging(large_user_store):
+    user_list = users.handle_get_users(
+        large_user_store, RequestProvider(args={"startIndex": "0", "count": "-1"})
+    )
+    assert user_list["totalResults"] == 50
+    assert user_list["startIndex"] == 1
+    assert user_list["Resources"] == []
+
+
+def test_handle_get_users_invalid_paging(large_user_store):
+    with pytest.raises(exceptions.InvalidValue):
+        users.handle_get_users(
+            large_user_store, RequestProvider(args={"count": "many"})
+        )
+
+
+def test_handle_get_users_sorted_descending(large_user_store):
+    user_list = users.handle_get_users(
+        large_user_store,
+        RequestProvider(
+            args={
+                "sortBy": "userName",
+                "sortOrder": "descending",
+                "startIndex": "3",
+                "count": "3",
+            }
+        ),
+    )
+    assert user_list["totalResults"] == 50
+    assert [u["userName"] for u in user_list["Resources"]] == [
+        "user47",
+        "user46",
+        "user45",
+    ]
+
+
+def test_handle_get_users_sorted_nulls_last(large_user_store):
+    for i, user in enumerate(large_user_store.get_all()):
+        resource = user.to_dict()
+        resource["displayName"] = f"name{49 - i:02}" if i % 2 else None
+        large_user_store.update(User.from_dict(resource))
+
+    user_list = users.handle_get_users(
+        large_user_store, RequestProvider(args={"sortBy": "displayName", "count": "50"})
+    )
+    names = [u.get("displayName") for u in user_list["Resources"]]
+    assert names[:25] == sorted(f"name{49 - i:02}" for i in range(1, 50, 2))
+    assert names[25:] == [None] * 25
+
+
+def test_handle_get_users_sorted_with_filter(large_user_store):
+    user_list = users.handle_get_users(
+        large_user_store,
+        RequestProvider(
+            args={
+                "filter": 'userName sw "user1"',
+                "sortBy": "userName",
+                "sortOrder": "descending",
+                "count": "3",
+            }
+        ),
+    )
+    assert user_list["totalResults"] == 10
+    assert [u["userName"] for u in user_list["Resources"]] == [
+        "user19",
+        "user18",
+        "user17",
+    ]
+
+
+def test_handle_get_users_sorted_by_unindexed_attribute(large_user_store):
+    user_list = users.handle_get_users(
+        large_user_store,
+        RequestProvider(args={"sortBy": "name.familyName", "count": "5"}),
+    )
+    assert user_list["totalResults"] == 50
+    assert user_list["itemsPerPage"] == 5
+
+
+def test_handle_get_users_invalid_sort_order(large_user_store):
+    with pytest.raises(exceptions.InvalidValue):
+        users.handle_get_users(
+            large_user_store,
+            RequestProvider(args={"sortBy": "userName", "sortOrder": "sideways"}),
+        )
+
+
+def test_handle_stream_users_matches_get(large_user_store):
+    args = {
+        "filter": 'userName sw "user1"',
+        "sortBy": "userName",
+        "attributes": "userName",
+        "count": "4",
+    }
+    streamed = "".join(
+        users.handle_stream_users(large_user_store, RequestProvider(args=args))
+    )
+    assert json.loads(streamed) == users.handle_get_users(
+        large_user_store, RequestProvider(args=args)
+    )
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+from sync_app.async_client import AsyncSCIMClient
+from sync_app.client import ClientConfiguration, Filter, PageRequest
+from tests.factories import make_user
+from aiohttp import web
+from aiohttp.client_exceptions import ClientResponseError
+from aiohttp.test_utils import TestServer
+import asyncio
+
+
+class SlowServer:
+    """Answers requests after a delay, recording them and how many overlap"""
+
+    def __init__(self, fail=()):
+        self.in_flight = 0
+        self.peak = 0
+        self.fail = set(fail)
+        self.requests = []
+
+    async def post_user(self, request: web.Request) -> web.Response:
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        await asyncio.sleep(0.01)
+        self.in_flight -= 1
+        body = await request.json()
+        if body["userName"] in self.fail:
+            return web.json_response({"detail": "userName is taken"}, status=409)
+        # the id we sent comes back as the externalId
+        return web.json_response({**body, "id": body["externalId"]}, status=201)
+
+    async def get_users(self, request: web.Request) -> web.Response:
+        self.requests.append(request)
+        return web.json_response(
+            {
+                "schemas": ["urn:ietf:params:scim:api:messages:2.0:ListResponse"],
+                "totalResults": 0,
+                "startIndex": 11,
+                "itemsPerPage": 0,
+                "Resources": [],
+            }
+        )
+
+
+async def with_client(server: SlowServer, concurrency: int, use):
+    app = web.Application()
+    app.router.add_post("/scim/v2/Users", server.post_user)
+    app.router.add_get("/scim/v2/Users", server.get_users)
+    async with TestServer(app) as test_server:
+        config = ClientConfiguration(str(test_server.make_url("/scim/v2/")), "token")
+        async with AsyncSCIMClient(config, concurrency) as client:
+            return await use(client)
+
+
+def test_create_users_many_is_bounded_and_ordered():
+    server = SlowServer()
+    users = [make_user(f"user{i}") for i in range(20)]
+
+    created = asyncio.run(
+        with_client(server, 4, lambda client: client.create_users_many(users))
+    )
+    assert [u.userName for u in created] == [u.userName for u in users]
+    assert [u.id for u in created] == [u.id for u in users]
+    assert server.peak == 4
+
+
+def test_create_users_many_can_return_exceptions():
+    server = SlowServer(fail=["b"])
+    users = [make_user(name) for name in ["a", "b", "c"]]
+
+    created = asyncio.run(
+        with_client(
+            server,
+            2,
+            lambda client: client.create_users_many(users, return_exceptions=True),
+        )
+    )
+    assert created[0].userName == "a" and created[2].userName == "c"
+    assert isinstance(created[1], ClientResponseError)
+    assert created[1].status == 409
+
+
+def test_requests_are_built_as_by_scim_client():
+    server = SlowServer()
+    filter = Filter('userName eq "a"')
+    page = PageRequest(11, 5)
+
+    asyncio.run(
+        with_client(
+            server, 1, lambda client: client.get_users(filter, ["userName"], page=page)
+        )
+    )
+    (request,) = server.requests
+    assert dict(request.query) == {
+        "attributes": "userName",
+        "filter": 'userName eq "a"',
+        "startIndex": "11",
+        "count": "5",
+    }
+    assert request.headers["Authorization"] == "Bearer token"
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+from sync_app.scim.bulk import (
+    BulkOperation,
+    BulkOperationResult,
+    BulkRequest,
+    BulkResponse,
+)
+
+
+def test_bulk_request_round_trip():
+    request = BulkRequest(
+        [
+            BulkOperation("POST", "/Users", "1", {"userName": "foo"}),
+            BulkOperation("DELETE", "/Users/2", version='W/"3"'),
+        ],
+        failOnErrors=1,
+    )
+    assert request.to_dict() == {
+        "schemas": ["urn:ietf:params:scim:api:messages:2.0:BulkRequest"],
+        "failOnErrors": 1,
+        "Operations": [
+            {
+                "method": "POST",
+                "path": "/Users",
+                "bulkId": "1",
+                "data": {"userName": "foo"},
+            },
+            {"method": "DELETE", "path": "/Users/2", "version": 'W/"3"'},
+        ],
+    }
+    parsed = BulkRequest.from_dict(request.to_dict())
+    assert parsed.operations == request.operations
+    assert parsed.failOnErrors == 1
+
+
+def test_bulk_response_statuses_are_numbers():
+    response = BulkResponse.from_dict(
+        {
+            "schemas": ["urn:ietf:params:scim:api:messages:2.0:BulkResponse"],
+            "Operations": [
+                {"method": "POST", "bulkId": "1", "status": "201", "location": "/a"},
+                {"method": "PUT", "status": 409, "response": {"detail": "taken"}},
+            ],
+        }
+    )
+    assert response.operations == [
+        BulkOperationResult("POST", 201, "1", "/a"),
+        BulkOperationResult("PUT", 409, response={"detail": "taken"}),
+    ]
+    assert response.to_dict()["Operations"][0]["status"] == "201"
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+from sync_app.client import ClientConfiguration, PageRequest, SCIMClient
+from sync_app.http_session import PooledSession
+from sync_app.scim.list_response import ListResponse
+from tests.factories import make_user
+import time
+
+
+class PagedServer:
+    """Stands in for SCIMClient.get_users, returning at most max_page users a page"""
+
+    def __init__(self, users, max_page: int):
+        self.users = users
+        self.max_page = max_page
+        self.requests = []
+        self.sessions = []
+
+    def __call__(self, client, filter, attributes, excludedAttributes, sorting, page):
+        self.requests.append(page)
+        self.sessions.append(client.session)
+        count = min(page.results_per_page, self.max_page)
+        return ListResponse(
+            len(self.users),
+            self.users[page.start_index - 1 : page.start_index - 1 + count],
+            page.start_index,
+            count,
+        )
+
+
+def test_iter_users_follows_pages(monkeypatch):
+    client = SCIMClient(ClientConfiguration("http://scim.invalid", "token"))
+    users = [make_user(f"user{i}") for i in range(12)]
+    monkeypatch.setattr(SCIMClient, "get_users", server := PagedServer(users, 3))
+
+    assert list(client.iter_users(page_size=5)) == users
+    assert [p.start_index for p in server.requests] == [1, 4, 7, 10]
+    assert all(p.results_per_page == 5 for p in server.requests)
+
+
+def test_iter_users_prefetches_next_page(monkeypatch):
+    client = SCIMClient(ClientConfiguration("http://scim.invalid", "token"))
+    server = PagedServer([make_user("a"), make_user("b")], 1)
+    monkeypatch.setattr(SCIMClient, "get_users", server)
+    users = client.iter_users(page_size=1)
+
+    next(users)
+    # the second page is requested without the caller asking for more
+    deadline = time.monotonic() + 5
+    while len(server.requests) < 2 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert [p.start_index for p in server.requests] == [1, 2]
+    assert list(users) == [server.users[1]]
+
+
+def test_iter_users_of_empty_tenant(monkeypatch):
+    client = SCIMClient(ClientConfiguration("http://scim.invalid", "token"))
+    monkeypatch.setattr(SCIMClient, "get_users", PagedServer([], max_page=10))
+    assert list(client.iter_users()) == []
+
+
+def test_iter_users_fetches_pages_over_a_session_of_its_own(monkeypatch):
+    client = SCIMClient(ClientConfiguration("http://scim.invalid", "token"))
+    server = PagedServer([make_user("a"), make_user("b")], 1)
+    monkeypatch.setattr(SCIMClient, "get_users", server)
+    closed = []
+    monkeypatch.setattr(PooledSession, "close", lambda s: closed.append(s))
+
+    assert len(list(client.iter_users(page_size=1))) == 2
+    (session,) = set(server.sessions)
+    # requests sessions aren't thread safe, the caller's is left to the caller
+    assert session is not client.session
+    deadline = time.monotonic() + 5
+    while not closed and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert closed == [session]
+
+
+def test_page_request_defaults():
+    assert PageRequest() == PageRequest(start_index=1, results_per_page=20)
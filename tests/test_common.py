@@ -2,12 +2,13 @@ from sync_app.schema import ResourceValidator
 from sync_app.parsers.python_filter import (
     PythonFilter,
 )
-from sync_app.handlers.common import filter_resource
+from sync_app.handlers.common import filter_resource, stream_chunks
 from sync_app.scim.list_response import ListResponse
 from sync_app.store import Store
 from typing import Mapping, Optional
 from dataclasses import dataclass
 from sync_app import exceptions
+import asyncio
 import pytest
 import uuid
 
@@ -91,3 +92,10 @@ def test_filter_exclude_resource_subattribute_path_multiple(basic_resource):
 def test_filter_exclude_required(basic_resource):
     result = filter_resource(basic_resource, exclude=[["id"], ["schemas"]])
     assert result == basic_resource
+
+
+def test_stream_chunks_joins_small_pieces():
+    async def collect():
+        return [c async for c in stream_chunks(["a", "bc", "d", "efgh", "i"], 3)]
+
+    assert asyncio.run(collect()) == [b"abc", b"defgh", b"i"]
@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+from sync_app.dispatcher import ChangeDispatcher
+from sync_app.server import SCIMServer, ServerConfiguration
+from tests.factories import make_user
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import asyncio
+import json
+import pytest
+import threading
+import time
+import uuid
+
+
+class SlowServer:
+    def __init__(self, delay: float = 0.0, fail_on: str = ""):
+        self.delay = delay
+        self.fail_on = fail_on
+        self.received = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def handle_resource_change(self, operation, resource):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if resource.userName == self.fail_on:
+                raise RuntimeError("downstream rejected the change")
+            with self.lock:
+                self.received.append((operation, resource.userName))
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def test_changes_are_queued_without_waiting():
+    server = SlowServer(delay=0.2)
+
+    async def run():
+        dispatcher = ChangeDispatcher(server, workers=2)
+        await dispatcher.start()
+        start = time.perf_counter()
+        for i in range(4):
+            dispatcher.handle_resource_change("add", make_user(f"user{i}"))
+        enqueued = time.perf_counter() - start
+        await dispatcher.stop()
+        return enqueued, dispatcher.stats()
+
+    enqueued, stats = asyncio.run(run())
+    assert enqueued < 0.05
+    assert stats == {
+        "workers": 2,
+        "pending": 0,
+        "sent": 4,
+        "failed": 0,
+        "coalesced": None,
+    }
+    assert sorted(server.received) == [("add", f"user{i}") for i in range(4)]
+
+
+def test_concurrency_is_bounded_by_workers():
+    server = SlowServer(delay=0.02)
+
+    async def run():
+        dispatcher = ChangeDispatcher(server, workers=3)
+        await dispatcher.start()
+        for i in range(30):
+            dispatcher.handle_resource_change("add", make_user(f"user{i}"))
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert len(server.received) == 30
+    assert server.max_in_flight <= 3
+
+
+def test_changes_to_a_resource_keep_their_order():
+    server = SlowServer()
+    id = uuid.uuid1()
+
+    async def run():
+        dispatcher = ChangeDispatcher(server, workers=4)
+        await dispatcher.start()
+        dispatcher.handle_resource_change("add", make_user("v0", id=id))
+        for i in range(1, 10):
+            dispatcher.handle_resource_change("replace", make_user(f"v{i}", id=id))
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert server.received == [("add", "v0")] + [
+        ("replace", f"v{i}") for i in range(1, 10)
+    ]
+
+
+def test_changes_can_be_reported_from_other_threads():
+    server = SlowServer()
+
+    async def run():
+        dispatcher = ChangeDispatcher(server, workers=2)
+        await dispatcher.start()
+        # as app.py runs the handlers which report them
+        await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    dispatcher.handle_resource_change, "add", make_user(f"user{i}")
+                )
+                for i in range(8)
+            )
+        )
+        await dispatcher.stop(timeout=5)
+
+    asyncio.run(run())
+    assert sorted(server.received) == sorted(("add", f"user{i}") for i in range(8))
+
+
+def test_failed_changes_do_not_stop_workers():
+    server = SlowServer(fail_on="bad")
+
+    async def run():
+        dispatcher = ChangeDispatcher(server, workers=1)
+        await dispatcher.start()
+        for name in ["good", "bad", "also good"]:
+            dispatcher.handle_resource_change("add", make_user(name))
+        await dispatcher.stop()
+        return dispatcher.stats()
+
+    stats = asyncio.run(run())
+    assert stats["sent"] == 2
+    assert stats["failed"] == 1
+    assert server.received == [("add", "good"), ("add", "also good")]
+
+
+class DownstreamHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    received: list = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.received.append((self.path, self.headers["Authorization"], body))
+        status = 500 if body.get("userName") == "bad" else 201
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    do_PUT = do_PATCH = do_POST
+
+
+@pytest.fixture
+def downstream_url():
+    DownstreamHandler.received = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), DownstreamHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/scim/v2"
+    server.shutdown()
+    server.server_close()
+
+
+def test_changes_are_sent_through_scim_server(downstream_url, capsys):
+    downstream = SCIMServer(ServerConfiguration(downstream_url, "secret"))
+
+    async def run():
+        dispatcher = ChangeDispatcher(downstream, workers=1)
+        await dispatcher.start()
+        for name in ["good", "bad"]:
+            dispatcher.handle_resource_change("add", make_user(name))
+        await dispatcher.stop(timeout=5)
+        return dispatcher.stats()
+
+    stats = asyncio.run(run())
+    assert stats["sent"] == 1
+    # rejected by downstream, not counted as sent
+    assert stats["failed"] == 1
+    received = DownstreamHandler.received
+    assert [(path, token, body["userName"]) for path, token, body in received] == [
+        ("/scim/v2/Users", "Bearer secret", "good"),
+        ("/scim/v2/Users", "Bearer secret", "bad"),
+    ]
+    # nothing about the request, the token least of all, is written to stdout
+    assert capsys.readouterr().out == ""
+
+
+def test_replacements_are_sent_as_patches(downstream_url):
+    downstream = SCIMServer(ServerConfiguration(downstream_url, "secret"))
+    user = make_user("alice", displayName="Alice Smith")
+
+    async def run():
+        dispatcher = ChangeDispatcher(downstream, workers=1)
+        await dispatcher.start()
+        dispatcher.handle_resource_change("add", user)
+        renamed = make_user("alice", user.id, displayName="Alice Jones")
+        dispatcher.handle_resource_change("replace", renamed)
+        # nothing changed since the last delivery, nothing is sent
+        dispatcher.handle_resource_change("replace", renamed)
+        await dispatcher.stop(timeout=5)
+
+    asyncio.run(run())
+    received = DownstreamHandler.received
+    assert [path for path, _, _ in received] == [
+        "/scim/v2/Users",
+        f"/scim/v2/Users/{user.id}",
+    ]
+    # the entitlements only go with the POST, a PUT would drop them as well
+    assert received[1][2]["Operations"] == [
+        {"op": "remove", "path": "entitlements"},
+        {"op": "replace", "path": "displayName", "value": "Alice Jones"},
+    ]
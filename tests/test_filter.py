@@ -1,9 +1,10 @@
 #!/usr/bin/env python
-from sync_app.parsers.python_filter import PythonFilter
+from sync_app.parsers.python_filter import PythonFilter, FilterCache, predicate_cache
 from sync_app.exceptions import InvalidSCIMFilter
 from abnf.parser import NodeVisitor
 from sync_app.parsers.scim_query_filter import Rule as SCIMQueryRule
 import pytest
+from unittest import mock
 
 
 def test_username_query():
@@ -232,3 +233,132 @@ def test_nested_subattribute_query():
     predicate = PythonFilter.parse_filter_to_predicate("car.model[year eq 1997]")
     assert predicate({"car": {"model": {"year": 1997}}})
     assert not predicate({"car": {"model": {"year": 1998}}})
+
+
+def reference_predicate(filter: str):
+    return PythonFilter().visit(SCIMQueryRule("filter").parse_all(filter))
+
+
+REFERENCE_RECORDS = [
+    {},
+    {"userName": "bjensen"},
+    {"userName": "claire", "active": True},
+    {"userName": 5.0},
+    {"userName": "tyler", "name": {"givenName": "mark", "familyName": "jensen"}},
+    {"name": {"givenName": "tom"}, "displayName": "Tom"},
+]
+
+
+@pytest.mark.parametrize(
+    "filter",
+    [
+        'userName eq "bjensen"',
+        "userName pr",
+        'not (userName eq "claire")',
+        'userName sw "c" and active eq true',
+        'userName eq "tyler" or displayName pr and name.givenName eq "tom"',
+        'userName eq "bjensen" or userName eq "tyler" or userName eq "claire"',
+        '(userName pr or displayName pr) and not (name pr)',
+        'name[givenName eq "mark" or givenName eq "tom"]',
+        'name.familyName co "ens"',
+        "userName eq 5",
+        "userName ne null",
+    ],
+)
+def test_compiled_predicate_matches_reference(filter):
+    compiled = PythonFilter.parse_filter_to_predicate(filter)
+    reference = reference_predicate(filter)
+    for record in REFERENCE_RECORDS:
+        try:
+            expected = reference(record)
+        except Exception:
+            # the reference engine does not short circuit and cannot descend into
+            # missing attributes, compiled predicates are allowed to do better
+            continue
+        assert compiled(record) == expected, record
+
+
+def test_compiled_predicate_does_not_visit_parse_tree():
+    predicate = PythonFilter.parse_filter_to_predicate(
+        'emails[type eq "work" and value co "@corp"]'
+    )
+    with mock.patch.object(
+        NodeVisitor, "visit", side_effect=AssertionError("visited parse tree")
+    ):
+        assert predicate(
+            {
+                "emails": [
+                    {"type": "home", "value": "a@home"},
+                    {"type": "work", "value": "a@corp"},
+                ]
+            }
+        )
+        assert not predicate({"emails": [{"type": "work", "value": "a@home"}]})
+
+
+def test_multi_valued_subattribute_query():
+    predicate = PythonFilter.parse_filter_to_predicate('emails[type eq "work"]')
+    assert predicate({"emails": [{"type": "home"}, {"type": "work"}]})
+    assert not predicate({"emails": [{"type": "home"}]})
+    assert not predicate({"emails": []})
+    assert not predicate({})
+
+
+def test_multi_valued_attribute_path():
+    predicate = PythonFilter.parse_filter_to_predicate(
+        'emails.value eq "b@example.com"'
+    )
+    assert predicate(
+        {"emails": [{"value": "a@example.com"}, {"value": "b@example.com"}]}
+    )
+    assert not predicate({"emails": [{"value": "a@example.com"}]})
+    assert not predicate({})
+
+
+@pytest.mark.parametrize("operator", ["eq", "ne"])
+@pytest.mark.parametrize("values", [[], ["a"], ["b"], ["a", "b"], ["a", "a"]])
+def test_compiled_predicate_matches_reference_on_multi_valued(operator, values):
+    # the reference engine cannot look inside lists, ask it about each value on its
+    # own: a list matches eq when any of its values do, and ne when none equal
+    compiled = PythonFilter.parse_filter_to_predicate(f'schemas {operator} "a"')
+    equal = reference_predicate('schemas eq "a"')
+    any_equal = any(equal({"schemas": value}) for value in values)
+    expected = any_equal if operator == "eq" else not any_equal
+    assert compiled({"schemas": values}) == expected
+
+
+def test_filter_cache_hits_and_evictions():
+    cache = FilterCache[int](maxsize=2)
+    assert cache.get_or_create("a", lambda: 1) == 1
+    assert cache.get_or_create("a", lambda: 2) == 1
+    cache.get_or_create("b", lambda: 3)
+    cache.get_or_create("a", lambda: 4)
+    cache.get_or_create("c", lambda: 5)
+
+    assert cache.stats() == {
+        "size": 2,
+        "maxsize": 2,
+        "hits": 2,
+        "misses": 3,
+        "evictions": 1,
+    }
+    # "b" was the least recently used entry
+    assert cache.get_or_create("b", lambda: 6) == 6
+
+
+def test_parse_filter_to_predicate_is_cached():
+    predicate_cache.clear()
+    with mock.patch.object(
+        PythonFilter, "parse_filter_to_ast", wraps=PythonFilter.parse_filter_to_ast
+    ) as parse:
+        first = PythonFilter.parse_filter_to_predicate('userName eq "cached"')
+        second = PythonFilter.parse_filter_to_predicate('userName eq "cached"')
+    assert first is second
+    assert parse.call_count == 1
+    assert predicate_cache.stats()["hits"] == 1
+
+
+def test_parse_filter_to_path_returns_independent_lists():
+    first = PythonFilter.parse_filter_to_path("name.givenName")
+    first.append("mutated")
+    assert PythonFilter.parse_filter_to_path("name.givenName") == ["name", "givenName"]
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+from sync_app.parsers import python_filter
+from sync_app.parsers.python_filter import (
+    PythonFilter,
+    abnf_parse_filter,
+    abnf_parse_attribute_path,
+    set_filter_parser,
+    get_filter_parser,
+)
+from sync_app.parsers.filter_parser import parse_filter, parse_attribute_path
+from sync_app.exceptions import InvalidSCIMFilter
+import random
+import pytest
+
+# every filter used in test_filter.py
+TEST_FILTER_CORPUS = [
+    'userName eq "bjensen"',
+    "userName pr",
+    "not ( userName pr )",
+    "not (not ( userName pr ))",
+    'userName le "claire"',
+    'userName gt "claire"',
+    'userName lt "claire"',
+    'userName ge "claire"',
+    'userName ew "claire"',
+    'userName sw "claire"',
+    'userName co "la"',
+    'userName ne "claire"',
+    'userName eq "claire"',
+    "userName le 5",
+    "userName ge 5",
+    "userName lt 5",
+    "userName gt 5",
+    "userName ew 5",
+    "userName sw 5",
+    "userName co 5",
+    "userName ne 5",
+    "userName eq 5",
+    "a1-steak_sauce pr",
+    "a1-steak_sauce.important eq true",
+    'name[givenName eq "mark"]',
+    "car.model[year eq 1997]",
+    'not (userName eq "claire")',
+    'userName sw "c" and active eq true',
+    'userName eq "tyler" or displayName pr and name.givenName eq "tom"',
+    'userName eq "bjensen" or userName eq "tyler" or userName eq "claire"',
+    "(userName pr or displayName pr) and not (name pr)",
+    'name[givenName eq "mark" or givenName eq "tom"]',
+    'name.familyName co "ens"',
+    "userName ne null",
+    'emails[type eq "work" and value co "@corp"]',
+    'emails.value eq "b@example.com"',
+    # RFC 7644 section 3.4.2.2 examples
+    'title pr and userType eq "Employee"',
+    'title pr or userType eq "Intern"',
+    'schemas eq "urn:ietf:params:scim:schemas:extension:enterprise:2.0:User"',
+    'userType eq "Employee" and (emails co "example.com" or emails.value co "example.org")',
+    'userType ne "Employee" and not (emails co "example.com" or emails.value co "example.org")',
+    'userType eq "Employee" and emails[type eq "work" and value co "@example.com"]',
+    'emails[type eq "work" and value co "@example.com"] or ims[type eq "xmpp" and value co "@foo.com"]',
+    'meta.lastModified gt "2011-05-13T04:42:34Z"',
+    "urn:ietf:params:scim:schemas:extension:enterprise:2.0:User:employeeNumber pr",
+    'urn:ietf:params:scim:schemas:core:2.0:User:name.familyName co "O\'Malley"',
+    'userName EQ "bjensen" AND active Eq false',
+    'displayName eq "quote \\" slash \\\\ unicode \\u00e9"',
+    "score ge -1.5e3",
+    "score lt 0.25",
+    "not(active eq false)",
+    "( userName pr )",
+    "http://example.com:userName pr",
+    "http://admin@example.com:8080/scim?v=2#user:name.givenName pr",
+    "urn:a%20b:userName pr",
+]
+
+INVALID_FILTER_CORPUS = [
+    "",
+    "userName",
+    "userName eq",
+    'userName eq bjensen',
+    'userName xx "bjensen"',
+    'userName eq "bjensen" and',
+    '(userName eq "bjensen"',
+    'userName eq "bjensen")',
+    'emails[type eq "work"',
+    'not userName eq "bjensen"',
+    '1userName eq "x"',
+    'userName eq "unterminated',
+    "userName eq 01",
+    'userName eq "a" xor active eq true',
+    "userName..x pr",
+    " userName pr",
+    "userName pr ",
+    'emails[ type eq "x" ]',
+    'emails[type eq "x" ]',
+    "a:userName pr",
+    "urn:userName pr",
+    "http://example.com:8o:userName pr",
+    "urn:a%2:userName pr",
+]
+
+ATTRIBUTE_NAMES = ["userName", "name.givenName", "meta.lastModified", "a1-x_y", "emails.value"]
+VALUES = ['"work"', '"O\'Malley"', '""', "true", "false", "null", "5", "-0.5", "1e10"]
+OPERATORS = ["eq", "ne", "co", "sw", "ew", "gt", "lt", "ge", "le"]
+
+
+def generate_filter(rng: random.Random, depth: int = 0) -> str:
+    choice = rng.randrange(6 if depth < 3 else 2)
+    path = rng.choice(ATTRIBUTE_NAMES)
+
+    if choice == 0:
+        return f"{path} pr"
+    if choice == 1:
+        return f"{path} {rng.choice(OPERATORS)} {rng.choice(VALUES)}"
+    if choice == 2:
+        return f"({generate_filter(rng, depth + 1)})"
+    if choice == 3:
+        return f"not ({generate_filter(rng, depth + 1)})"
+    if choice == 4:
+        return f"{rng.choice(['emails', 'name'])}[{generate_filter(rng, depth + 1)}]"
+
+    operands = [generate_filter(rng, depth + 1) for _ in range(rng.randrange(2, 5))]
+    result = operands[0]
+    for operand in operands[1:]:
+        result += f" {rng.choice(['and', 'or'])} {operand}"
+    return result
+
+
+GENERATED_FILTER_CORPUS = [generate_filter(random.Random(seed)) for seed in range(200)]
+
+
+@pytest.mark.parametrize("filter", TEST_FILTER_CORPUS + GENERATED_FILTER_CORPUS)
+def test_parsers_agree(filter):
+    assert parse_filter(filter) == abnf_parse_filter(filter)
+
+
+@pytest.mark.parametrize("filter", INVALID_FILTER_CORPUS)
+def test_parsers_agree_on_invalid_filters(filter):
+    with pytest.raises(InvalidSCIMFilter):
+        abnf_parse_filter(filter)
+    with pytest.raises(InvalidSCIMFilter):
+        parse_filter(filter)
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "userName",
+        "name.givenName",
+        "urn:ietf:params:scim:schemas:extension:enterprise:2.0:User:employeeNumber",
+    ],
+)
+def test_attribute_path_parsers_agree(path):
+    assert parse_attribute_path(path) == abnf_parse_attribute_path(path)
+
+
+def test_native_parser_accepts_repeated_spaces():
+    assert parse_filter('userName  eq   "a"') == parse_filter('userName eq "a"')
+    assert parse_filter("not  (userName pr)") == parse_filter("not (userName pr)")
+
+
+def test_filter_parser_is_selectable():
+    previous = get_filter_parser()
+    try:
+        for name in python_filter.FILTER_PARSERS:
+            set_filter_parser(name)
+            predicate = PythonFilter.parse_filter_to_predicate(
+                'name[givenName eq "mark"]'
+            )
+            assert predicate({"name": {"givenName": "mark"}})
+            assert PythonFilter.parse_filter_to_path("name.givenName") == [
+                "name",
+                "givenName",
+            ]
+
+        with pytest.raises(ValueError):
+            set_filter_parser("yacc")
+    finally:
+        set_filter_parser(previous)
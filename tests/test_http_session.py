@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+from sync_app.http_session import PoolConfiguration, PooledSession
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+import requests
+from requests.adapters import HTTPAdapter
+import threading
+import pytest
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        body = self.headers.get("Authorization", "").encode()
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def server_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_connections_are_reused(server_url):
+    session = PooledSession(headers={"Authorization": "Bearer token"})
+    responses = [session.get(f"{server_url}/Users") for _ in range(10)]
+
+    assert all(r.text == "Bearer token" for r in responses)
+    assert session.stats.to_dict() == {
+        "requests": 10,
+        "connections": 1,
+        "reuse_rate": 0.9,
+    }
+
+
+def test_default_timeouts_are_applied():
+    session = PooledSession(PoolConfiguration(connect_timeout=1, read_timeout=2))
+    response = requests.Response()
+    response.status_code = 200
+    send_patch = mock.patch.object(HTTPAdapter, "send", return_value=response)
+    with send_patch as send:
+        session.get("http://downstream.invalid/Users")
+        assert send.call_args.kwargs["timeout"] == (1, 2)
+        session.get("http://downstream.invalid/Users", timeout=5)
+        assert send.call_args.kwargs["timeout"] == 5
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+from sync_app import journaled_store
+from sync_app.journaled_store import Journal, JournaledStore, encode
+from sync_app.scim.user import User, Email
+from sync_app.scim.group import Group
+from sync_app.scim.resource import ResourceMeta
+from sync_app import exceptions
+from tests.factories import make_user
+from datetime import datetime
+import os
+import threading
+import pytest
+import uuid
+
+
+def numbered_user(i: int, id=None) -> User:
+    return make_user(
+        f"user{i}",
+        id,
+        displayName=f"User {i}",
+        emails=[Email(value=f"user{i}@corp.example", type="work")],
+    )
+
+
+def reopen(tmp_path, record_type=User, **kwargs):
+    """Reopens the store under tmp_path once its snapshot has been read into memory"""
+    store = JournaledStore(record_type, str(tmp_path), **kwargs)
+    store.loaded.wait()
+    return store
+
+
+def contents(store):
+    return sorted((str(u.id), u.to_dict()["userName"]) for u in store.get_all())
+
+
+def test_changes_survive_reopening(tmp_path):
+    store = JournaledStore(User, str(tmp_path))
+    users = [numbered_user(i) for i in range(5)]
+    for user in users:
+        store.create(user)
+    renamed = numbered_user(10, id=users[1].id)
+    store.update(renamed)
+    store.delete_by_id(users[2].id)
+    store.close()
+
+    reopened = reopen(tmp_path)
+    assert contents(reopened) == contents(store)
+    assert reopened.lookup("userName", "user10")[0].id == users[1].id
+    assert reopened.lookup("userName", "user1") == []
+    with pytest.raises(exceptions.ResourceConflict):
+        reopened.create(numbered_user(0))
+
+
+def test_failed_changes_are_not_journaled(tmp_path):
+    store = JournaledStore(User, str(tmp_path))
+    store.create(numbered_user(0))
+    with pytest.raises(exceptions.ResourceConflict):
+        store.create(numbered_user(0))
+    with pytest.raises(exceptions.ResourceMissing):
+        store.delete_by_id(uuid.uuid1())
+    errors = store.create_many([numbered_user(1), numbered_user(1)])
+    assert errors[0] is None and errors[1] is not None
+    store.close()
+
+    assert contents(reopen(tmp_path)) == contents(store)
+
+
+def test_snapshots_replace_the_journal(tmp_path):
+    store = JournaledStore(User, str(tmp_path), snapshot_every=10)
+    users = [numbered_user(i) for i in range(25)]
+    for user in users:
+        store.create(user)
+    for user in users[::2]:
+        store.delete_by_id(user.id)
+    store.close()
+
+    # a snapshot is skipped while the one before is still being written
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2
+    assert files[0] == f"users.{store.generation:08}.journal"
+    assert files[1] == f"users.{store.generation:08}.snapshot"
+    reopened = reopen(tmp_path, snapshot_every=10)
+    assert contents(reopened) == contents(store)
+    assert reopened.journaled == store.journaled < 10
+
+
+def test_snapshot_on_demand(tmp_path):
+    store = JournaledStore(User, str(tmp_path))
+    store.create_many([numbered_user(i) for i in range(3)])
+    store.snapshot()
+    store.create(numbered_user(3))
+    store.close()
+
+    reopened = reopen(tmp_path)
+    assert contents(reopened) == contents(store)
+    assert reopened.generation == 1 and reopened.journaled == 1
+
+
+def test_journal_is_replayed_over_the_snapshot_before_it_is_read(tmp_path, monkeypatch):
+    store = JournaledStore(User, str(tmp_path))
+    users = [numbered_user(i) for i in range(5)]
+    store.create_many(users)
+    store.snapshot()
+    store.update(numbered_user(10, id=users[1].id))
+    store.delete_by_id(users[2].id)
+    store.create(numbered_user(5))
+    store.close()
+
+    monkeypatch.setattr(JournaledStore, "start_hydrating", lambda self: None)
+    reopened = JournaledStore(User, str(tmp_path))
+    assert reopened.base is not None and not reopened.loaded.is_set()
+    assert reopened.lookup("userName", "user10")[0].id == users[1].id
+    assert reopened.lookup("userName", "user1") == []
+    with pytest.raises(exceptions.ResourceMissing):
+        reopened.get_by_id(users[2].id)
+    with pytest.raises(exceptions.ResourceConflict):
+        reopened.create(numbered_user(0))
+    assert contents(reopened) == contents(store)
+    page = [u.id for u in store.get_page(1, 10)[1]]
+    assert [u.id for u in reopened.get_page(1, 10)[1]] == page
+
+    reopened.hydrate()
+    assert contents(reopened) == contents(store)
+    assert [u.id for u in reopened.get_page(1, 10)[1]] == page
+
+
+def test_json_lines_snapshot_is_loaded(tmp_path):
+    users = [numbered_user(i) for i in range(3)]
+    with open(tmp_path / "users.00000000.snapshot", "wb") as snapshot:
+        for user in users:
+            snapshot.write(encode(user.to_dict()))
+
+    reopened = reopen(tmp_path)
+    assert reopened.base is None
+    assert contents(reopened) == sorted((str(u.id), u.userName) for u in users)
+
+
+def test_torn_journal_tail_is_dropped(tmp_path):
+    store = JournaledStore(User, str(tmp_path))
+    store.create(numbered_user(0))
+    store.close()
+    with open(tmp_path / "users.00000000.journal", "ab") as journal:
+        journal.write(b'{"op":"put","resource":{"userN')
+
+    reopened = reopen(tmp_path)
+    reopened.create(numbered_user(1))
+    reopened.close()
+    assert len(reopen(tmp_path).get_all()) == 2
+
+
+def test_unfinished_snapshot_is_ignored(tmp_path):
+    store = JournaledStore(User, str(tmp_path))
+    store.create(numbered_user(0))
+    store.close()
+    (tmp_path / "users.00000001.snapshot.tmp").write_bytes(b"{")
+
+    assert len(reopen(tmp_path).get_all()) == 1
+    assert not (tmp_path / "users.00000001.snapshot.tmp").exists()
+
+
+def test_users_and_groups_share_a_directory(tmp_path):
+    users = JournaledStore(User, str(tmp_path))
+    groups = JournaledStore(Group, str(tmp_path))
+    users.create(numbered_user(0))
+    meta = ResourceMeta("Group", datetime.now(), datetime.now(), "http://example.com")
+    groups.create(Group(meta, uuid.uuid1(), "team"))
+    users.close()
+    groups.close()
+
+    assert len(reopen(tmp_path).get_all()) == 1
+    assert len(reopen(tmp_path, Group).get_all()) == 1
+
+
+def test_concurrent_commits_share_fsyncs(tmp_path):
+    journal = Journal(str(tmp_path / "journal"), commit_delay=0.01)
+    barrier = threading.Barrier(8)
+
+    def write(i: int) -> None:
+        barrier.wait()
+        journal.commit(journal.append([{"entry": i}]))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert journal.synced == 8
+    assert journal.syncs < 8
+
+
+def test_new_segments_are_made_durable(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(journaled_store, "fsync_directory", synced.append)
+    journal = Journal(str(tmp_path / "users.00000000.journal"))
+    journal.rotate(str(tmp_path / "users.00000001.journal"))
+    journal.close()
+
+    assert synced == [str(tmp_path), str(tmp_path)]
+
+
+def test_writes_from_threads_share_fsyncs(tmp_path):
+    store = JournaledStore(User, str(tmp_path), commit_delay=0.01)
+    barrier = threading.Barrier(8)
+
+    def write(i: int) -> None:
+        barrier.wait()
+        store.create(numbered_user(i))
+
+    threads = [threading.Thread(target=write, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.close()
+
+    assert store.journal.syncs < 8
+    assert contents(reopen(tmp_path)) == contents(store)
+    assert len(store.get_all()) == 8
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+from sync_app.scim.list_response import ListResponse
+from tests.factories import make_user
+import json
+
+
+def test_from_list_first_page():
+    response = ListResponse.from_list(list(range(50)), startIndex=1, itemsPerPage=20)
+    assert response.totalResults == 50
+    assert response.resources == list(range(20))
+
+
+def test_from_list_later_page():
+    response = ListResponse.from_list(list(range(50)), startIndex=21, itemsPerPage=20)
+    assert response.totalResults == 50
+    assert response.resources == list(range(20, 40))
+
+
+def test_iter_json_matches_to_dict():
+    users = [make_user(f"user{i}") for i in range(5)]
+    response = ListResponse(
+        totalResults=10, resources=users, startIndex=3, itemsPerPage=5
+    )
+    assert json.loads("".join(response.iter_json())) == json.loads(
+        json.dumps(response.to_dict())
+    )
+
+
+def test_iter_json_applies_transform():
+    user = make_user("foo")
+    response = ListResponse.from_list([user])
+    streamed = json.loads("".join(response.iter_json(lambda r: {"id": r["id"]})))
+    assert streamed["Resources"] == [{"id": str(user.id)}]
+
+
+def test_iter_json_empty():
+    response = ListResponse(totalResults=0, resources=[], startIndex=1, itemsPerPage=0)
+    assert json.loads("".join(response.iter_json())) == response.to_dict()
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+from sync_app.memory_store import MemoryStore
+from sync_app.scim.user import User
+from sync_app.scim.group import Group
+from sync_app.scim.resource import ResourceMeta
+from sync_app import exceptions
+from sync_app.handlers.common import sort_records
+from tests.factories import make_user
+from datetime import datetime
+import pytest
+import random
+import uuid
+
+
+def make_group(displayName: str, id=None) -> Group:
+    return Group(
+        meta=ResourceMeta("Group", datetime.now(), datetime.now(), "http://example.com"),
+        group_id=id or uuid.uuid1(),
+        displayName=displayName,
+    )
+
+
+def test_create_rejects_duplicate_id():
+    store = MemoryStore[User]()
+    user = make_user("foo")
+    store.create(user)
+    with pytest.raises(exceptions.ResourceConflict):
+        store.create(make_user("bar", id=user.id))
+
+
+def test_create_rejects_duplicate_username():
+    store = MemoryStore[User]()
+    store.create(make_user("foo"))
+    with pytest.raises(exceptions.ResourceConflict):
+        store.create(make_user("foo"))
+    assert len(store.get_all()) == 1
+
+
+def test_groups_only_require_unique_ids():
+    store = MemoryStore[Group]()
+    store.create(make_group("same"))
+    store.create(make_group("same"))
+    assert len(store.get_all()) == 2
+    assert store.unique_indexes == {}
+
+
+def test_update_moves_username_index():
+    store = MemoryStore[User]()
+    user = make_user("foo")
+    store.create(user)
+    store.update(make_user("renamed", id=user.id))
+
+    assert store.unique_indexes["userName"] == {"renamed": user.id}
+    store.create(make_user("foo"))
+
+
+def test_update_rejects_username_of_other_user():
+    store = MemoryStore[User]()
+    user = make_user("foo")
+    store.create(user)
+    store.create(make_user("bar"))
+
+    with pytest.raises(exceptions.ResourceConflict):
+        store.update(make_user("bar", id=user.id))
+    # a failed update leaves the original record in place
+    assert store.get_by_id(user.id).userName == "foo"
+
+
+def test_update_keeping_username():
+    store = MemoryStore[User]()
+    user = make_user("foo")
+    store.create(user)
+    store.update(make_user("foo", id=user.id))
+    assert store.get_by_id(user.id).userName == "foo"
+
+
+def test_delete_frees_username():
+    store = MemoryStore[User]()
+    user = make_user("foo")
+    store.create(user)
+    store.delete_by_id(user.id)
+    assert store.unique_indexes["userName"] == {}
+    store.create(make_user("foo"))
+
+
+def test_sorted_page_matches_sorting_every_record():
+    store = MemoryStore[User]()
+    rng = random.Random(8)
+    users = []
+    for i in range(40):
+        user = make_user(f"user{rng.randrange(1000):03}-{i}")
+        user.displayName = rng.choice([None, "a", "b", "c"])
+        store.create(user)
+        users.append(user)
+    for user in users[:10]:
+        store.delete_by_id(user.id)
+    for user in users[10:20]:
+        renamed = make_user(user.userName.upper(), id=user.id)
+        renamed.displayName = rng.choice([None, "b", "d"])
+        store.update(renamed)
+
+    for attribute in ["userName", "displayName", "meta.created"]:
+        for ascending in [True, False]:
+            expected = sort_records(store.get_all(), attribute, ascending)
+            for start_index, count in [(1, 100), (1, 7), (5, 10), (25, 10), (31, 5)]:
+                offset = start_index - 1
+                assert store.get_sorted_page(
+                    attribute, ascending, start_index, count
+                ) == (30, expected[offset : offset + count])
+
+
+def test_sorted_page_on_unsorted_attribute():
+    store = MemoryStore[User]()
+    store.create(make_user("foo"))
+    assert store.get_sorted_page("name.familyName", True, 1, 10) is None
+
+
+def test_create_many_indexes_batch_once():
+    store = MemoryStore[User]()
+    store.create(make_user("existing"))
+    users = [make_user(f"user{i}") for i in random.sample(range(100), 100)]
+    errors = store.create_many(users + [make_user("user5"), make_user("existing")])
+
+    assert errors[:100] == [None] * 100
+    assert all(isinstance(e, exceptions.ResourceConflict) for e in errors[100:])
+    assert len(store.get_all()) == 101
+    total, page = store.get_sorted_page("userName", True, 1, 3)
+    assert [u.userName for u in page] == ["existing", "user0", "user1"]
+
+
+def test_get_page_keeps_insertion_order():
+    store = MemoryStore[User]()
+    for i in range(30):
+        store.create(make_user(f"user{i}"))
+    store.create_many([make_user(f"batch{i}") for i in range(10)])
+    for user in store.get_all()[5:15]:
+        store.delete_by_id(user.id)
+    store.create(make_user("last"))
+
+    expected = [u.userName for u in store.get_all()]
+    total, page = store.get_page(4, 7)
+    assert total == 31
+    assert [u.userName for u in page] == expected[3:10]
+    assert [u.userName for u in store.get_page(30, 10)[1]] == expected[29:]
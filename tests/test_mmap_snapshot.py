@@ -0,0 +1,179 @@
+#!/usr/bin/env python
+from sync_app import query_planner
+from sync_app.memory_store import MemoryStore
+from sync_app.mmap_snapshot import (
+    Snapshot,
+    SnapshotStore,
+    key_attributes,
+    write_snapshot,
+)
+from sync_app.scim.user import User, Email
+from sync_app.scim.group import Group
+from sync_app.scim.resource import ResourceMeta
+from sync_app import exceptions
+from tests.factories import make_user
+from datetime import datetime
+import pytest
+import uuid
+
+
+def numbered_user(i: int, id=None) -> User:
+    return make_user(
+        f"user{i}",
+        id,
+        displayName=f"User {i % 3}",
+        emails=[Email(value=f"user{i}@corp.example", type="work")],
+        externalId=f"ext-{i}",
+    )
+
+
+@pytest.fixture
+def users():
+    return [numbered_user(i) for i in range(50)]
+
+
+@pytest.fixture
+def path(tmp_path, users):
+    path = str(tmp_path / "users.snapshot")
+    write_snapshot(path, users, ["userName"])
+    return path
+
+
+@pytest.fixture
+def store(path):
+    store = SnapshotStore(User)
+    store.open_base(path)
+    return store
+
+
+@pytest.fixture
+def changed(users):
+    return [
+        numbered_user(100, id=users[1].id),
+        numbered_user(50),
+        numbered_user(51),
+        numbered_user(1),
+        numbered_user(3, id=users[3].id),
+    ]
+
+
+def change(store, users, changed):
+    """The same changes, made to a SnapshotStore over users or a MemoryStore of them"""
+    store.update(changed[0])
+    store.delete_by_id(users[2].id)
+    store.create(changed[1])
+    store.create_many(changed[2:4])
+    store.delete_by_id(users[3].id)
+    store.create(changed[4])
+
+
+def test_snapshot_finds_records_by_id_and_key(path, users):
+    snapshot = Snapshot(path)
+    assert snapshot.count == 50
+    for position, user in enumerate(users):
+        assert snapshot.find_id(user.id) == position
+        assert snapshot.find_key("userName", user.userName) == position
+        assert snapshot.resource(position) == user.to_dict()
+    assert snapshot.find_id(uuid.uuid4()) is None
+    assert snapshot.find_key("userName", "user") is None
+    assert snapshot.find_key("userName", "user99") is None
+
+
+def test_other_files_are_rejected(tmp_path):
+    path = tmp_path / "not.snapshot"
+    for contents in [b"", b"{}", b"{}" * 20]:
+        path.write_bytes(contents)
+        with pytest.raises(ValueError):
+            Snapshot(str(path))
+
+
+def test_lookups_only_read_what_they_touch(store, users):
+    user = users[7]
+
+    assert store.get_by_id(user.id).to_dict() == user.to_dict()
+    assert store.lookup("userName", "user7")[0] is store.get_by_id(user.id)
+    assert store.lookup("id", str(user.id))[0] is store.get_by_id(user.id)
+    assert store.lookup("id", str(user.id).upper()) == []
+    assert store.lookup("userName", "nobody") == []
+    assert store.lookup("userName", 7) == []
+    assert store.lookup_size("userName", "user7") == 1
+    total, page = store.get_page(49, 10)
+    assert total == 50 and [u.userName for u in page] == ["user48", "user49"]
+    with pytest.raises(exceptions.ResourceMissing):
+        store.get_by_id(uuid.uuid4())
+
+    assert store.base is not None and not store.datastore
+    assert sorted(store.touched) == [7, 48, 49]
+
+
+def test_changes_are_made_over_the_base(store, users, changed):
+    change(store, users, changed)
+
+    assert store.lookup("userName", "user100")[0].id == users[1].id
+    assert store.lookup("userName", "user1")[0].id != users[1].id
+    with pytest.raises(exceptions.ResourceMissing):
+        store.get_by_id(users[2].id)
+    with pytest.raises(exceptions.ResourceMissing):
+        store.delete_by_id(users[2].id)
+    with pytest.raises(exceptions.ResourceConflict):
+        store.create(numbered_user(4))
+    with pytest.raises(exceptions.ResourceConflict):
+        store.create(numbered_user(200, id=users[4].id))
+    with pytest.raises(exceptions.ResourceConflict):
+        store.update(numbered_user(5, id=users[6].id))
+
+    total, page = store.get_page(1, 4)
+    assert total == 52
+    assert [u.userName for u in page] == ["user0", "user100", "user4", "user5"]
+    total, page = store.get_page(48, 10)
+    names = [u.userName for u in page]
+    assert names == ["user49", "user50", "user51", "user1", "user3"]
+    assert store.base is not None and len(store.datastore) == 5
+
+
+def test_other_queries_scan_the_base(store, users, changed):
+    touched = store.get_by_id(users[4].id)
+    change(store, users, changed)
+
+    assert store.lookup("externalId", "ext-4") is None
+    assert store.get_sorted_page("userName", True, 1, 10) is None
+    assert store.range_size("meta.created") is None
+    filter = 'userName eq "user4" and active eq true'
+    assert query_planner.filter_records(store, filter) == [touched]
+    assert query_planner.filter_records(store, 'externalId eq "ext-4"') == [touched]
+    assert [u.id for u in store.get_all()] == [u.id for u in store.get_page(1, 100)[1]]
+    assert store.base is not None and len(store.touched) == 50
+
+    store.hydrate()
+    assert store.base is None and store.loaded.is_set()
+    assert store.get_by_id(users[4].id) is touched
+    assert query_planner.filter_records(store, 'externalId eq "ext-4"') == [touched]
+
+
+def test_hydrated_store_matches_memory_store(store, users, changed):
+    memory_store = MemoryStore[User]()
+    memory_store.create_many(users)
+    change(store, users, changed)
+    change(memory_store, users, changed)
+    before = store.get_page(1, 100)[1]
+
+    store.hydrate()
+    assert [u.id for u in store.get_page(1, 100)[1]] == [u.id for u in before]
+    assert store.get_page(1, 100)[0] == memory_store.get_page(1, 100)[0] == 52
+    for attribute in ["userName", "displayName", "meta.created"]:
+        expected = memory_store.get_sorted_page(attribute, False, 1, 60)[1]
+        page = store.get_sorted_page(attribute, False, 1, 60)[1]
+        assert [u.id for u in page] == [u.id for u in expected]
+    with pytest.raises(exceptions.ResourceConflict):
+        store.create(numbered_user(4))
+
+
+def test_snapshot_without_keys(tmp_path):
+    meta = ResourceMeta("Group", datetime.now(), datetime.now(), "http://example.com")
+    path = str(tmp_path / "groups.snapshot")
+    write_snapshot(path, [Group(meta, uuid.uuid1(), "team")], key_attributes(Group))
+
+    store = SnapshotStore(Group)
+    store.open_base(path)
+    assert store.base is not None and store.base.keys == {}
+    assert store.get_page(1, 10)[1][0].displayName == "team"
@@ -0,0 +1,395 @@
+#!/usr/bin/env python
+from sync_app.outbox import Outbox, OutboxDispatcher, retry_after, backoff, pack
+from sync_app.scim.bulk import BulkLimits, BulkOperationResult, BulkResponse
+from sync_app.scim.user import Email
+from sync_app.server import ChangeRequest, SCIMServer, ServerConfiguration
+from tests.factories import make_user
+from email.utils import formatdate
+import asyncio
+import json
+import pytest
+import requests
+import threading
+import uuid
+
+
+def make_response(status: int, headers=None, body=None) -> requests.Response:
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    response._content = json.dumps(body).encode() if body is not None else b""
+    return response
+
+
+class FakeServer(SCIMServer):
+    """
+    Answers each send with the next queued response, 201 once they run out. Bulk
+    requests take the next queued response too, or map each operation to its status
+    in bulk_statuses, 201 if it has none.
+    """
+
+    def __init__(self, responses=(), bulk_statuses=None):
+        super().__init__(ServerConfiguration("http://downstream.invalid", "token"))
+        self.responses = list(responses)
+        self.bulk_statuses = bulk_statuses or {}
+        self.sent = []
+        self.bulk_sent = []
+
+    def send(self, change):
+        self.sent.append(change)
+        response = self.responses.pop(0) if self.responses else make_response(201)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def send_bulk(self, bulk):
+        self.bulk_sent.append(bulk)
+        if self.responses:
+            return self.responses.pop(0)
+        results = []
+        for o in bulk.operations:
+            status = self.bulk_statuses.get(o.data["userName"], 201)
+            if status is not None:
+                results.append(BulkOperationResult(o.method, status, o.bulkId))
+        return make_response(200, body=BulkResponse(results).to_dict())
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def outbox(tmp_path):
+    outbox = Outbox(str(tmp_path / "outbox.sqlite3"))
+    yield outbox
+    outbox.close()
+
+
+def change(name: str) -> ChangeRequest:
+    return ChangeRequest("POST", "Users", {"userName": name})
+
+
+def test_outbox_survives_reopening(tmp_path):
+    path = str(tmp_path / "outbox.sqlite3")
+    outbox = Outbox(path)
+    outbox.append("a", "add", change("foo"), 0)
+    outbox.close()
+
+    reopened = Outbox(path)
+    entry = reopened.next_due(0)
+    assert entry is not None
+    assert entry.change == change("foo")
+    reopened.close()
+
+
+def test_changes_to_a_resource_are_delivered_in_order(outbox):
+    outbox.append("a", "add", change("a1"), 0)
+    outbox.append("a", "add", change("a2"), 0)
+    outbox.append("b", "add", change("b1"), 0)
+
+    first = outbox.next_due(0)
+    assert first.change == change("a1")
+    # a2 has to wait for a1 even when a is not in flight
+    assert outbox.next_due(0, {"a"}).change == change("b1")
+
+    outbox.complete(first)
+    assert outbox.next_due(0).change == change("a2")
+
+
+def test_delivered_change_leaves_outbox(outbox):
+    dispatcher = OutboxDispatcher(outbox, FakeServer())
+    dispatcher.handle_resource_change("add", make_user("foo"))
+    assert dispatcher.deliver(outbox.next_due(dispatcher.clock())) == "delivered"
+    assert outbox.pending() == 0
+
+
+def test_retry_after_is_honored(outbox):
+    clock = Clock()
+    server = FakeServer([make_response(503, {"Retry-After": "30"})])
+    dispatcher = OutboxDispatcher(outbox, server, clock=clock)
+    id = uuid.uuid1()
+    dispatcher.handle_resource_change("add", make_user("foo", id=id))
+    dispatcher.handle_resource_change("replace", make_user("bar", id=id))
+
+    assert dispatcher.deliver(outbox.next_due(clock.now)) == "retried"
+    clock.now += 29
+    assert outbox.next_due(clock.now) is None
+    clock.now += 1
+    entry = outbox.next_due(clock.now)
+    assert entry.attempts == 1
+    assert entry.change.method == "POST"
+
+
+def test_failed_connections_back_off(outbox):
+    clock = Clock()
+    server = FakeServer([requests.ConnectionError("refused")] * 3)
+    dispatcher = OutboxDispatcher(outbox, server, base_delay=10, clock=clock)
+    dispatcher.handle_resource_change("add", make_user("foo"))
+
+    for attempt in range(1, 4):
+        assert dispatcher.deliver(outbox.next_due(clock.now)) == "retried"
+        # jittered between half and all of base_delay * 2 ** (attempt - 1)
+        clock.now += 10 * 2 ** (attempt - 1) / 2 - 0.01
+        assert outbox.next_due(clock.now) is None
+        clock.now += 10 * 2 ** (attempt - 1) / 2 + 0.01
+
+    assert dispatcher.deliver(outbox.next_due(clock.now)) == "delivered"
+
+
+def test_rejected_changes_are_given_up_on(outbox):
+    dispatcher = OutboxDispatcher(outbox, FakeServer([make_response(409)]))
+    dispatcher.handle_resource_change("add", make_user("foo"))
+    assert dispatcher.deliver(outbox.next_due(dispatcher.clock())) == "failed"
+    assert outbox.pending() == 0
+    assert outbox.dead() == 1
+
+
+def test_retries_are_bounded(outbox):
+    clock = Clock()
+    server = FakeServer([make_response(500, {"Retry-After": "0"})] * 3)
+    dispatcher = OutboxDispatcher(outbox, server, max_attempts=3, clock=clock)
+    dispatcher.handle_resource_change("add", make_user("foo"))
+
+    outcomes = [dispatcher.deliver(outbox.next_due(clock.now)) for _ in range(3)]
+    assert outcomes == ["retried", "retried", "failed"]
+    assert outbox.dead() == 1
+
+
+def test_retry_after_accepts_http_dates():
+    response = make_response(429, {"Retry-After": formatdate(1060, usegmt=True)})
+    assert retry_after(response, 1000) == 60
+    assert retry_after(make_response(429, {"Retry-After": "soon"}), 1000) is None
+    assert retry_after(make_response(429), 1000) is None
+
+
+def test_backoff_is_capped():
+    assert backoff(50, base_delay=1, max_delay=60) <= 60
+
+
+def test_dispatcher_drains_outbox(outbox):
+    server = FakeServer([make_response(503, {"Retry-After": "0"})])
+
+    async def run():
+        dispatcher = OutboxDispatcher(outbox, server, workers=4)
+        await dispatcher.start()
+        for i in range(20):
+            dispatcher.handle_resource_change("add", make_user(f"user{i}"))
+        await dispatcher.drain(timeout=10)
+        await dispatcher.stop()
+        return dispatcher.stats()
+
+    stats = asyncio.run(run())
+    assert stats["pending"] == 0
+    assert stats["delivered"] == 20
+    assert stats["retried"] == 1
+    assert len(server.sent) == 21
+
+
+def test_replacements_are_coalesced(outbox):
+    server = FakeServer()
+    dispatcher = OutboxDispatcher(outbox, server)
+    user = make_user("v0")
+    dispatcher.handle_resource_change("add", user)
+    dispatcher.deliver(outbox.next_due(dispatcher.clock()))
+
+    for i in range(1, 5):
+        dispatcher.handle_resource_change("replace", make_user(f"v{i}", id=user.id))
+    assert outbox.pending() == 1
+    dispatcher.deliver(outbox.next_due(dispatcher.clock()))
+
+    assert server.sent[0].method == "POST"
+    assert server.sent[1].method == "PATCH"
+    assert server.sent[1].body["Operations"] == [
+        {"op": "remove", "path": "entitlements"},
+        {"op": "replace", "path": "userName", "value": "v4"},
+    ]
+    assert dispatcher.stats()["coalesced"] == 3
+
+
+def test_pending_add_sends_latest_version(outbox):
+    server = FakeServer()
+    dispatcher = OutboxDispatcher(outbox, server)
+    user = make_user("v0")
+    dispatcher.handle_resource_change("add", user)
+    dispatcher.handle_resource_change("replace", make_user("v1", id=user.id))
+    dispatcher.deliver(outbox.next_due(dispatcher.clock()))
+
+    assert len(server.sent) == 1
+    assert server.sent[0].method == "POST"
+    assert server.sent[0].body["userName"] == "v1"
+    assert "entitlements" in server.sent[0].body
+
+
+def test_changes_in_flight_are_not_coalesced(outbox):
+    dispatcher = OutboxDispatcher(outbox, FakeServer())
+    user = make_user("v0")
+    dispatcher.handle_resource_change("add", user)
+    entry = outbox.next_due(dispatcher.clock())
+    dispatcher.in_flight[entry.resource_key] = entry.seq
+
+    dispatcher.handle_resource_change("replace", make_user("v1", id=user.id))
+    assert outbox.pending() == 2
+    assert dispatcher.stats()["coalesced"] == 0
+
+
+def test_changes_being_replaced_are_not_claimed(outbox, monkeypatch):
+    dispatcher = OutboxDispatcher(outbox, FakeServer())
+    user = make_user("v0")
+    dispatcher.handle_resource_change("add", user)
+    claimed = []
+    workers = []
+    replace = outbox.replace
+
+    def replace_while_claiming(entry, change, due):
+        # a worker looks for work after the change to fold into was picked
+        worker = threading.Thread(target=lambda: claimed.extend(dispatcher.claim(1)))
+        worker.start()
+        worker.join(0.1)
+        workers.append(worker)
+        replace(entry, change, due)
+
+    monkeypatch.setattr(outbox, "replace", replace_while_claiming)
+    dispatcher.handle_resource_change("replace", make_user("v1", id=user.id))
+    workers[0].join()
+
+    assert [entry.change.body["userName"] for entry in claimed] == ["v1"]
+
+
+def test_coalesce_window_holds_changes_back(outbox):
+    clock = Clock()
+    dispatcher = OutboxDispatcher(outbox, FakeServer(), coalesce_window=1, clock=clock)
+    user = make_user("v0")
+    dispatcher.handle_resource_change("replace", user)
+    clock.now += 0.5
+    dispatcher.handle_resource_change("replace", make_user("v1", id=user.id))
+
+    clock.now += 0.9
+    assert outbox.next_due(clock.now) is None
+    clock.now += 0.1
+    assert outbox.next_due(clock.now).change.body["userName"] == "v1"
+
+
+def test_unchanged_replacements_are_skipped(outbox):
+    server = FakeServer()
+    dispatcher = OutboxDispatcher(outbox, server)
+    user = make_user("v0")
+    dispatcher.handle_resource_change("replace", user)
+    dispatcher.deliver(outbox.next_due(dispatcher.clock()))
+    dispatcher.handle_resource_change("replace", user)
+
+    assert dispatcher.deliver(outbox.next_due(dispatcher.clock())) == "skipped"
+    assert len(server.sent) == 1
+    assert outbox.pending() == 0
+
+
+def test_large_deltas_fall_back_to_put(outbox):
+    server = FakeServer()
+    dispatcher = OutboxDispatcher(outbox, server)
+    user = make_user("v0")
+
+    # every email replaced, the individual removes outweigh the resource itself
+    user.emails = [Email(value=f"old{i}@example.com") for i in range(10)]
+    dispatcher.handle_resource_change("replace", user)
+    dispatcher.deliver(outbox.next_due(dispatcher.clock()))
+    changed = make_user("v0", id=user.id)
+    changed.emails = [Email(value=f"new{i}@example.com") for i in range(10)]
+    dispatcher.handle_resource_change("replace", changed)
+    assert dispatcher.deliver(outbox.next_due(dispatcher.clock())) == "delivered"
+    assert server.sent[-1].method == "PUT"
+
+
+def test_due_changes_are_batched_one_per_resource(outbox):
+    dispatcher = OutboxDispatcher(outbox, FakeServer())
+    user = make_user("a1")
+    dispatcher.handle_resource_change("add", user)
+    dispatcher.handle_resource_change("add", make_user("a2", id=user.id))
+    for name in ["b", "c", "d"]:
+        dispatcher.handle_resource_change("add", make_user(name))
+
+    entries = outbox.due(dispatcher.clock(), limit=3)
+    assert [e.change.body["userName"] for e in entries] == ["a1", "b", "c"]
+    entries = outbox.due(dispatcher.clock(), {entries[1].resource_key}, limit=10)
+    assert [e.change.body["userName"] for e in entries] == ["a1", "c", "d"]
+
+
+def test_changes_are_packed_within_bulk_limits(outbox):
+    server = FakeServer()
+    dispatcher = OutboxDispatcher(outbox, server)
+    for i in range(5):
+        dispatcher.handle_resource_change("add", make_user(f"user{i}"))
+    entries = outbox.due(dispatcher.clock(), limit=5)
+    deliveries = [
+        (e, e.change, server.bulk_operation(e.change, str(e.seq))) for e in entries
+    ]
+
+    batches = pack(deliveries, BulkLimits(max_operations=2))
+    assert [len(b) for b in batches] == [2, 2, 1]
+
+    # room for the envelope and two operations, but not three
+    size = len(json.dumps(server.bulk_operation(entries[0].change, "1").to_dict()))
+    batches = pack(deliveries, BulkLimits(max_payload_size=100 + 2 * size))
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert [len(b) for b in pack(deliveries, BulkLimits(max_payload_size=1))] == [1] * 5
+
+
+def test_bulk_results_are_mapped_to_changes(outbox):
+    clock = Clock()
+    statuses = {"retry": 503, "reject": 409, "unprocessed": None}
+    server = FakeServer(bulk_statuses=statuses)
+    dispatcher = OutboxDispatcher(outbox, server, bulk=BulkLimits(), clock=clock)
+    for name in ["ok", "retry", "reject", "unprocessed"]:
+        dispatcher.handle_resource_change("add", make_user(name))
+
+    outcomes = dispatcher.deliver_batch(outbox.due(clock.now, limit=10))
+    assert outcomes == ["delivered", "retried", "failed", "retried"]
+    assert len(server.bulk_sent) == 1
+    assert server.sent == []
+    assert [o.path for o in server.bulk_sent[0].operations] == ["/Users"] * 4
+    assert outbox.pending() == 2
+    assert outbox.dead() == 1
+
+
+def test_failed_bulk_request_retries_every_change(outbox):
+    clock = Clock()
+    server = FakeServer([make_response(503, {"Retry-After": "30"})])
+    dispatcher = OutboxDispatcher(outbox, server, bulk=BulkLimits(), clock=clock)
+    for name in ["a", "b"]:
+        dispatcher.handle_resource_change("add", make_user(name))
+
+    assert dispatcher.deliver_batch(outbox.due(clock.now, limit=10)) == ["retried"] * 2
+    clock.now += 30
+    assert len(outbox.due(clock.now, limit=10)) == 2
+
+
+def test_too_large_bulk_request_falls_back_to_single_requests(outbox):
+    server = FakeServer([make_response(413)])
+    dispatcher = OutboxDispatcher(outbox, server, bulk=BulkLimits())
+    for name in ["a", "b"]:
+        dispatcher.handle_resource_change("add", make_user(name))
+
+    outcomes = dispatcher.deliver_batch(outbox.due(dispatcher.clock(), limit=10))
+    assert outcomes == ["delivered"] * 2
+    assert len(server.sent) == 2
+
+
+def test_dispatcher_drains_outbox_in_bulk(outbox):
+    server = FakeServer()
+
+    async def run():
+        dispatcher = OutboxDispatcher(
+            outbox, server, workers=2, bulk=BulkLimits(max_operations=10)
+        )
+        for i in range(50):
+            dispatcher.handle_resource_change("add", make_user(f"user{i}"))
+        await dispatcher.start()
+        await dispatcher.drain(timeout=10)
+        await dispatcher.stop()
+        return dispatcher.stats()
+
+    stats = asyncio.run(run())
+    assert stats["delivered"] == 50
+    assert len(server.bulk_sent) == 5
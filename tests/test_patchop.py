@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+from sync_app.scim.patchop import PatchOp, Operation
+
+
+def group(members, **attributes):
+    return {
+        "schemas": ["urn:ietf:params:scim:schemas:core:2.0:Group"],
+        "id": "g",
+        "displayName": "group",
+        "members": [{"value": m} for m in members],
+        "meta": {"lastModified": "2024-01-01"},
+        **attributes,
+    }
+
+
+def test_diff_of_identical_resources_is_empty():
+    assert PatchOp.from_diff(group(["a"]), group(["a"])).operations == []
+
+
+def test_diff_ignores_read_only_attributes():
+    previous = group(["a"])
+    current = dict(group(["a"]), id="other", meta={"lastModified": "2024-02-02"})
+    assert PatchOp.from_diff(previous, current).operations == []
+
+
+def test_diff_members():
+    patch = PatchOp.from_diff(group(["a", "b", "c"]), group(["a", "c", "d"]))
+    assert patch.operations == [
+        Operation("remove", 'members[value eq "b"]', None),
+        Operation("add", "members", [{"value": "d"}]),
+    ]
+
+
+def test_diff_single_valued_attributes():
+    previous = group([], externalId="x")
+    current = dict(group([], displayName="renamed"), nickName="n")
+    del current["members"]
+    patch = PatchOp.from_diff(previous, current)
+    assert patch.operations == [
+        Operation("remove", "members", None),
+        Operation("remove", "externalId", None),
+        Operation("replace", "displayName", "renamed"),
+        Operation("add", "nickName", "n"),
+    ]
+
+
+def test_diff_complex_attributes_by_sub_attribute():
+    previous = {"name": {"givenName": "Barbara", "familyName": "Jensen"}}
+    current = {"name": {"givenName": "Babs", "familyName": "Jensen"}}
+    assert PatchOp.from_diff(previous, current).operations == [
+        Operation("replace", "name.givenName", "Babs")
+    ]
+
+
+def test_diff_changed_item_is_removed_and_added():
+    previous = {"emails": [{"value": "a@x", "primary": True}, {"value": "b@x"}]}
+    current = {"emails": [{"value": "a@x", "primary": False}, {"value": "b@x"}]}
+    assert PatchOp.from_diff(previous, current).operations == [
+        Operation("remove", 'emails[value eq "a@x"]', None),
+        Operation("add", "emails", [{"value": "a@x", "primary": False}]),
+    ]
+
+
+def test_diff_replaces_items_that_cannot_be_addressed():
+    # removing value eq "a@x" would also remove the item that is kept
+    previous = {"emails": [{"value": "a@x", "type": "work"}, {"value": "a@x"}]}
+    current = {"emails": [{"value": "a@x"}]}
+    assert PatchOp.from_diff(previous, current).operations == [
+        Operation("replace", "emails", [{"value": "a@x"}])
+    ]
+
+    previous = {"schemas": ["a", "b"]}
+    current = {"schemas": ["a"]}
+    assert PatchOp.from_diff(previous, current).operations == [
+        Operation("replace", "schemas", ["a"])
+    ]
+
+
+def test_remove_operations_have_no_value():
+    patch = PatchOp([Operation("remove", "members", None)])
+    assert patch.to_dict()["Operations"] == [{"op": "remove", "path": "members"}]
+
+
+def test_diff_replaces_items_that_repeat():
+    previous = group(["a", "a", "b"])
+    assert PatchOp.from_diff(previous, group(["a", "b"])).operations == [
+        Operation("replace", "members", [{"value": "a"}, {"value": "b"}])
+    ]
+    assert PatchOp.from_diff(group(["a"]), group(["a", "a"])).operations == [
+        Operation("replace", "members", [{"value": "a"}, {"value": "a"}])
+    ]
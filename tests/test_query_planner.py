@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+from sync_app import query_planner
+from sync_app.memory_store import MemoryStore
+from sync_app.parsers.python_filter import PythonFilter
+from sync_app.scim.user import User, Email
+from sync_app.scim.resource import ResourceMeta
+from datetime import datetime
+from sync_app import exceptions
+from tests.factories import make_user
+from unittest import mock
+import pytest
+
+
+def numbered_user(i: int) -> User:
+    return make_user(
+        f"user{i}",
+        displayName=f"User {i % 3}",
+        active=i % 2 == 0,
+        emails=[
+            Email(value=f"user{i}@corp.example", type="work"),
+            Email(value=f"shared{i % 4}@home.example", type="home"),
+        ],
+        externalId=f"ext-{i % 10}",
+    )
+
+
+@pytest.fixture
+def user_store():
+    store = MemoryStore[User]()
+    for i in range(40):
+        store.create(numbered_user(i))
+    return store
+
+
+def scan(store, filter):
+    predicate = PythonFilter.parse_filter_to_predicate(filter)
+    return sorted(str(u.id) for u in store.get_all() if predicate(u.to_dict()))
+
+
+@pytest.mark.parametrize(
+    "filter, index",
+    [
+        ('userName eq "user7"', "userName"),
+        ('externalId eq "ext-3"', "externalId"),
+        ('emails.value eq "shared1@home.example"', "emails.value"),
+        ('externalId eq "ext-3" and userName eq "user13"', "userName"),
+        ('active eq true and externalId eq "ext-4"', "externalId"),
+        ('emails[type eq "home" and value eq "shared2@home.example"]', "emails.value"),
+        ('emails[type eq "work" and value eq "shared2@home.example"]', "emails.value"),
+        ('userName eq "nobody"', "userName"),
+    ],
+)
+def test_indexed_filters(user_store, filter, index):
+    plan = query_planner.plan_query(user_store, filter)
+    assert plan.explain()["strategy"] == "index"
+    assert plan.explain()["indexes"][0]["attribute"] == index
+    assert sorted(str(u.id) for u in plan.execute()) == scan(user_store, filter)
+
+
+def test_unique_index_has_no_residual(user_store):
+    explained = query_planner.explain(user_store, 'userName eq "user7"')
+    assert explained["candidates"] == 1
+    assert explained["residual"] is None
+
+
+def test_disjunction_of_indexed_filters(user_store):
+    filter = 'userName eq "user1" or externalId eq "ext-2"'
+    plan = query_planner.plan_query(user_store, filter)
+    assert plan.strategy == "index"
+    assert [l.attribute for l in plan.lookups] == ["userName", "externalId"]
+    assert sorted(str(u.id) for u in plan.execute()) == scan(user_store, filter)
+
+
+@pytest.mark.parametrize(
+    "filter",
+    [
+        'displayName eq "User 1"',
+        'userName eq "user1" or displayName eq "User 2"',
+        'not (userName eq "user1")',
+        'userName sw "user1"',
+        "externalId eq null",
+    ],
+)
+def test_unindexed_filters_scan(user_store, filter):
+    plan = query_planner.plan_query(user_store, filter)
+    assert plan.explain()["strategy"] == "scan"
+    assert plan.explain()["candidates"] == 40
+    assert sorted(str(u.id) for u in plan.execute()) == scan(user_store, filter)
+
+
+def test_id_lookup(user_store):
+    user = user_store.get_all()[5]
+    plan = query_planner.plan_query(user_store, f'id eq "{user.id}"')
+    assert plan.strategy == "index"
+    assert plan.execute() == [user]
+    assert query_planner.filter_records(user_store, 'id eq "not-a-uuid"') == []
+
+
+def test_indexes_follow_updates(user_store):
+    user = user_store.get_all()[0]
+    updated = numbered_user(0)
+    updated.id = user.id
+    updated.externalId = "moved"
+    user_store.update(updated)
+
+    assert query_planner.filter_records(user_store, 'externalId eq "moved"') == [updated]
+    assert user not in query_planner.filter_records(user_store, 'externalId eq "ext-0"')
+
+
+@pytest.fixture
+def dated_user_store():
+    store = MemoryStore[User]()
+    for day in range(1, 29):
+        user = numbered_user(day)
+        user.meta = ResourceMeta(
+            "User",
+            datetime(2024, 2, day, 12),
+            datetime(2024, 3, day, 12),
+            "http://example.com",
+        )
+        store.create(user)
+    return store
+
+
+@pytest.mark.parametrize(
+    "filter, candidates",
+    [
+        ('meta.lastModified gt "2024-03-20T12:00:00Z"', 8),
+        ('meta.lastModified ge "2024-03-20T12:00:00Z"', 9),
+        ('meta.lastModified lt "2024-03-03T00:00:00+00:00"', 2),
+        ('meta.lastModified le "2024-03-03T12:00:00"', 3),
+        ('meta.created gt "2024-02-10T00:00:00Z" and meta.created lt "2024-02-12T23:00:00Z"', 3),
+        ('meta.created ge "2024-02-10T12:00:00Z" and meta.created gt "2024-02-10T12:00:00Z"', 18),
+        ('meta.lastModified gt "2024-03-25T00:00:00Z" and active eq true', 4),
+    ],
+)
+def test_range_filters(dated_user_store, filter, candidates):
+    plan = query_planner.plan_query(dated_user_store, filter)
+    assert plan.strategy == "index"
+    assert len(plan.candidates) == candidates
+    assert sorted(str(u.id) for u in plan.execute()) == scan(dated_user_store, filter)
+
+
+def test_range_filter_residual(dated_user_store):
+    explained = query_planner.explain(
+        dated_user_store, 'meta.lastModified gt "2024-03-25T00:00:00Z"'
+    )
+    assert explained["residual"] is None
+    assert explained["indexes"] == [
+        {
+            "attribute": "meta.lastModified",
+            "lower": {"value": "2024-03-25T00:00:00+00:00", "inclusive": False},
+            "upper": None,
+        }
+    ]
+
+
+def test_only_the_chosen_lookup_is_run(dated_user_store):
+    filter = 'meta.lastModified gt "2024-03-01T00:00:00Z" and userName eq "user5"'
+    with mock.patch.object(
+        dated_user_store, "range_lookup", wraps=dated_user_store.range_lookup
+    ) as range_lookup:
+        plan = query_planner.plan_query(dated_user_store, filter)
+
+    assert [l.attribute for l in plan.lookups] == ["userName"]
+    assert range_lookup.call_count == 0
+    assert [u.userName for u in plan.execute()] == ["user5"]
+
+
+def test_range_results_follow_updates(dated_user_store):
+    user = dated_user_store.lookup("userName", "user1")[0]
+    updated = numbered_user(1)
+    updated.id = user.id
+    updated.meta = ResourceMeta(
+        "User", user.meta.created, datetime(2025, 1, 1), "http://example.com"
+    )
+    dated_user_store.update(updated)
+
+    assert query_planner.filter_records(
+        dated_user_store, 'meta.lastModified gt "2024-12-31T00:00:00Z"'
+    ) == [updated]
+
+
+def test_datetime_comparisons_are_not_string_comparisons():
+    predicate = PythonFilter.parse_filter_to_predicate(
+        'meta.lastModified gt "2024-03-05T10:00:00Z"'
+    )
+    # as strings "2024-03-05 11:00:00" sorts before "2024-03-05T10:00:00Z"
+    assert predicate({"meta": {"lastModified": "2024-03-05 11:00:00"}})
+    assert predicate({"meta": {"lastModified": "2024-03-05T12:00:00+01:00"}})
+    assert not predicate({"meta": {"lastModified": "2024-03-05T10:30:00+01:00"}})
+    assert not predicate({"meta": {}})
+
+
+def test_invalid_datetime_filter():
+    with pytest.raises(exceptions.InvalidSCIMFilter):
+        PythonFilter.parse_filter_to_predicate('meta.created gt "yesterday"')
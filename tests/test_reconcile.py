@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+from sync_app.client import SCIMClient
+from sync_app.reconcile import Reconciler, TargetIndex, TargetRecord
+from sync_app.scim.group import Group
+from sync_app.scim.patchop import Operation
+from sync_app.scim.resource import ResourceMeta, ResourceRef
+from sync_app.scim.user import User
+from tests.factories import make_user
+from datetime import datetime
+from unittest import mock
+import threading
+import time
+import uuid
+
+
+def make_group(displayName: str, members=(), externalId=None) -> Group:
+    now = datetime.now()
+    return Group(
+        meta=ResourceMeta("Group", now, now, "http://example.com"),
+        group_id=uuid.uuid1(),
+        displayName=displayName,
+        members=[ResourceRef(None, str(m), None) for m in members],
+        externalId=externalId,
+    )
+
+
+def make_client(users=(), groups=()):
+    client = mock.MagicMock(spec=SCIMClient)
+    client.iter_users.side_effect = lambda **kwargs: iter(users)
+    client.iter_groups.side_effect = lambda **kwargs: iter(groups)
+    client.create_user.side_effect = lambda user: make_user(user.userName)
+    client.create_group.side_effect = lambda group: make_group(group.displayName)
+    return client
+
+
+def test_index_matches_by_external_id_before_name_and_only_once():
+    index = TargetIndex()
+    by_name = TargetRecord("1", None, "a", b"")
+    by_external_id = TargetRecord("2", "source-id", "b", b"")
+    index.add(by_name)
+    index.add(by_external_id)
+
+    assert index.match("source-id", "a") == by_external_id
+    assert index.match("source-id", "a") == by_name
+    assert index.match("source-id", "a") is None
+    assert index.unmatched == {}
+
+
+def test_reconcile_users():
+    same = make_user("same", displayName="Same")
+    renamed = make_user("renamed", displayName="New name")
+    added = make_user("added")
+    source = make_client(users=[same, renamed, added])
+
+    target_same = make_user("same", displayName="Same", externalId=str(same.id))
+    target_renamed = make_user("renamed", displayName="Old name")
+    target_removed = make_user("removed")
+    target = make_client(users=[target_same, target_renamed, target_removed])
+    target.get_user.return_value = target_renamed
+
+    report = Reconciler(source, target, concurrency=2).reconcile_users()
+
+    assert report.to_dict() == {
+        "dry_run": False,
+        "scanned": 3,
+        "target_scanned": 3,
+        "created": 1,
+        "patched": 1,
+        "deleted": 1,
+        "skipped": 1,
+        "failed": 0,
+    }
+    target.create_user.assert_called_once_with(added)
+    target.get_user.assert_called_once_with(str(target_renamed.id))
+    id, patch = target.update_user.call_args.args
+    assert id == str(target_renamed.id)
+    assert patch.operations == [Operation("replace", "displayName", "New name")]
+    target.delete_user.assert_called_once_with(str(target_removed.id))
+
+
+def test_dry_run_reports_without_writing():
+    source = make_client(users=[make_user("a", displayName="A"), make_user("b")])
+    target = make_client(users=[make_user("a", displayName="Changed"), make_user("c")])
+
+    report = Reconciler(source, target, dry_run=True).reconcile_users()
+
+    counts = (report.created, report.patched, report.deleted, report.skipped)
+    assert counts == (1, 1, 1, 0)
+    assert report.changed == 3
+    target.create_user.assert_not_called()
+    target.get_user.assert_not_called()
+    target.update_user.assert_not_called()
+    target.delete_user.assert_not_called()
+
+
+def test_failed_writes_are_counted():
+    source = make_client(users=[make_user("a"), make_user("b")])
+    target = make_client()
+    target.create_user.side_effect = [make_user("a"), ValueError("b")]
+
+    report = Reconciler(source, target, concurrency=1).reconcile_users()
+
+    assert (report.created, report.failed) == (1, 1)
+
+
+def test_writes_are_bounded():
+    lock = threading.Lock()
+    in_flight = peak = 0
+
+    def slow_create(user: User) -> User:
+        nonlocal in_flight, peak
+        with lock:
+            in_flight += 1
+            peak = max(peak, in_flight)
+        time.sleep(0.01)
+        with lock:
+            in_flight -= 1
+        return user
+
+    source = make_client(users=[make_user(f"user{i}") for i in range(20)])
+    target = make_client()
+    target.create_user.side_effect = slow_create
+
+    report = Reconciler(source, target, concurrency=3).reconcile_users()
+
+    assert report.created == 20
+    assert peak == 3
+
+
+def test_group_members_are_given_by_target_id():
+    member = make_user("member")
+    added_member = make_user("added")
+    source = make_client(
+        users=[member, added_member],
+        groups=[
+            make_group("team", [member.id, added_member.id]),
+            make_group("new", [member.id]),
+        ],
+    )
+    target_member = make_user("member")
+    target_added_member = make_user("added")
+    target_team = make_group("team", [target_member.id])
+    target = make_client(users=[target_member], groups=[target_team])
+    target.create_user.side_effect = lambda user: target_added_member
+    target.get_group.return_value = target_team
+
+    reports = Reconciler(source, target).run()
+
+    assert reports["users"].created == 1
+    assert (reports["groups"].created, reports["groups"].patched) == (1, 1)
+    created = target.create_group.call_args.args[0]
+    assert (created.displayName, created.members) == ("new", [])
+    patches = {id: p for id, p in (c.args for c in target.update_group.mock_calls)}
+    assert patches[str(target_team.id)].operations == [
+        Operation("add", "members", [{"value": str(target_added_member.id)}])
+    ]
+    new_id = next(id for id in patches if id != str(target_team.id))
+    assert patches[new_id].operations == [
+        Operation("add", "members", [{"value": str(target_member.id)}])
+    ]
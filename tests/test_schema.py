@@ -108,3 +108,57 @@ def test_validator_common_schema_default():
     }
     result = validator.validate(user)
     assert any([isinstance(e, jsonschema.ValidationError) for e in result.errors])
+
+
+def test_validate_raises_same_error_as_jsonschema():
+    user_schema = schema.JSONSchema.load(USER_SCHEMA_FILENAME)
+    bad_user = dict(TEST_USER, userName=5)
+    with pytest.raises(jsonschema.ValidationError) as expected:
+        jsonschema.validate(bad_user, user_schema.schema)
+    with pytest.raises(jsonschema.ValidationError) as raised:
+        user_schema.validate(bad_user)
+    assert raised.value.message == expected.value.message
+    assert raised.value.path == expected.value.path
+
+
+def test_validator_is_built_once(monkeypatch):
+    validator = schema.ResourceValidator.load(
+        [COMMON_SCHEMA_FILENAME, USER_SCHEMA_FILENAME, SCHEMAS_SCHEMA_FILENAME]
+    )
+
+    def fail(*args, **kwargs):
+        raise AssertionError("schemas should not be rechecked per call")
+
+    monkeypatch.setattr(jsonschema, "validate", fail)
+    monkeypatch.setattr(jsonschema.Draft7Validator, "check_schema", fail)
+    assert validator.validate(TEST_USER).valid
+
+
+def test_validator_resolves_refs_between_schemas():
+    schemas_schema = schema.JSONSchema.load(SCHEMAS_SCHEMA_FILENAME)
+    referencing = schema.JSONSchema(
+        {
+            "$schema": "http://json-schema.org/draft-07/schema#",
+            "$id": "urn:example:referencing",
+            "properties": {
+                "user": {"$ref": "urn:ietf:params:scim:schemas:core:2.0:User"}
+            },
+        }
+    )
+    validator = schema.ResourceValidator(
+        [schemas_schema, schema.JSONSchema.load(USER_SCHEMA_FILENAME), referencing]
+    )
+    assert validator.validate(
+        {"schemas": ["urn:example:referencing"], "user": TEST_USER}
+    ).valid
+    assert not validator.validate(
+        {"schemas": ["urn:example:referencing"], "user": {"schemas": []}}
+    ).valid
+
+
+def test_validate_all_reports_unvalidatable_resources():
+    validator = schema.ResourceValidator.load(
+        [COMMON_SCHEMA_FILENAME, SCHEMAS_SCHEMA_FILENAME, USER_SCHEMA_FILENAME]
+    )
+    results = validator.validate_all([{"schemas": ["urn:unknown"]}, {}])
+    assert [r.valid for r in results] == [False, False]
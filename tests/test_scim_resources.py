@@ -0,0 +1,102 @@
+from sync_app.scim.group import Group
+from sync_app.scim.resource import ResourceMeta, ResourceRef, resource_refs
+from sync_app.scim.user import Email, Name, User
+from datetime import datetime
+import json
+import pickle
+import pytest
+import uuid
+
+
+def make_user() -> User:
+    return User(
+        meta=ResourceMeta(
+            resourceType="User",
+            created=datetime(2024, 1, 1),
+            lastModified=datetime(2024, 1, 2),
+            location="https://example.com/v2/Users/1",
+            version="1",
+        ),
+        user_id=uuid.uuid4(),
+        displayName="User One",
+        active=True,
+        userName="user1",
+        name=Name(givenName="User", familyName="One"),
+        emails=[Email(value="user1@example.com", type="work", primary=True)],
+        groups=[ResourceRef(ref=None, value=str(uuid.uuid4()), display="Group")],
+        externalId="ext-1",
+    )
+
+
+def make_group() -> Group:
+    return Group(
+        meta=ResourceMeta.create_meta("Group", "https://example.com/v2/Groups/1"),
+        group_id=uuid.uuid4(),
+        displayName="Group One",
+        members=[ResourceRef(ref="https://example.com/v2/Users/1", value="1", display=None)],
+    )
+
+
+def test_resources_have_no_instance_dict():
+    user = make_user()
+    group = make_group()
+    for o in [user, user.meta, user.name, *user.emails, *user.groups, group, *group.members]:
+        assert not hasattr(o, "__dict__"), type(o).__name__
+
+    with pytest.raises(AttributeError):
+        user.nickName = "one"
+
+
+def test_user_round_trip():
+    user = make_user()
+    d = user.to_dict()
+    d["meta"]["created"] = user.meta.created
+    d["meta"]["lastModified"] = user.meta.lastModified
+    again = User.from_dict(d)
+    assert again.to_dict() == user.to_dict()
+    assert again.emails == user.emails
+    assert again.name == user.name
+
+
+def test_group_round_trip():
+    group = make_group()
+    again = Group.from_dict(group.to_dict())
+    assert again.to_dict() == group.to_dict()
+    assert again.members == group.members
+
+
+def test_slotted_resources_pickle():
+    user = make_user()
+    again = pickle.loads(pickle.dumps(user))
+    assert again.to_dict() == user.to_dict()
+    assert again.groups == user.groups
+
+
+def test_from_dict_shares_repeated_values():
+    group = {"value": str(uuid.uuid4()), "display": "Group"}
+    # decoded JSON, so no string is shared up front
+    first, second = [
+        User.from_dict(json.loads(json.dumps({**make_user().to_dict(), "groups": [group]})))
+        for _ in range(2)
+    ]
+
+    assert first.schemas is second.schemas
+    assert first.meta.resourceType is second.meta.resourceType
+    assert first.emails[0].type is second.emails[0].type
+    assert all(a is b for a, b in zip(first.groups, second.groups))
+    assert first.to_dict()["schemas"] == ["urn:ietf:params:scim:schemas:core:2.0:User"]
+
+
+def test_ref_to_dict_keeps_missing_attributes():
+    ref = ResourceRef.from_dict({"value": "1"})
+    assert ref.to_dict() == {"$ref": None, "value": "1", "display": None}
+
+
+def test_shared_refs_are_immutable_and_released():
+    ref = ResourceRef.from_dict({"value": str(uuid.uuid4()), "display": "Group"})
+    with pytest.raises(AttributeError):
+        ref.display = "Renamed"
+
+    size = len(resource_refs)
+    del ref
+    assert len(resource_refs) == size - 1
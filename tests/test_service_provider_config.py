@@ -0,0 +1,20 @@
+#!/usr/bin/env python
+from sync_app.schema import JSONSchema
+from sync_app.scim.bulk import BulkLimits
+from sync_app.scim.service_provider_config import ServiceProviderConfig
+import os
+
+SCHEMA_FILENAME = os.path.join(
+    os.path.dirname(__file__), "..", "schemas", "serviceProviderConfig.schema.json"
+)
+
+
+def test_service_provider_config_advertises_bulk_limits():
+    config = ServiceProviderConfig(bulk=BulkLimits(10, 2048)).to_dict()
+    assert JSONSchema.load(SCHEMA_FILENAME).validate(config)
+    assert config["bulk"] == {
+        "supported": True,
+        "maxOperations": 10,
+        "maxPayloadSize": 2048,
+    }
+    assert ServiceProviderConfig().to_dict()["bulk"] == {"supported": False}
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+from sync_app import sorted_index
+from sync_app.sorted_index import SortedIndex, merge_sorted
+import bisect
+import pytest
+import random
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # splits and empties blocks often enough to exercise the Fenwick tree rebuilds
+    monkeypatch.setattr(sorted_index, "BLOCK_SIZE", 8)
+
+
+def test_matches_a_sorted_list():
+    rng = random.Random(7)
+    index: SortedIndex[int] = SortedIndex()
+    expected: list = []
+
+    for _ in range(3000):
+        action = rng.random()
+        if action < 0.55 or not expected:
+            value = rng.randrange(500)
+            index.add(value)
+            bisect.insort(expected, value)
+        elif action < 0.9:
+            value = rng.choice(expected)
+            index.remove(value)
+            expected.remove(value)
+        else:
+            batch = sorted(rng.randrange(500) for _ in range(rng.randrange(1, 40)))
+            index.update(batch)
+            expected = merge_sorted(expected, batch)
+
+        assert len(index) == len(expected)
+        probe = rng.randrange(-1, 501)
+        assert index.bisect_left(probe) == bisect.bisect_left(expected, probe)
+        assert index.bisect_right(probe) == bisect.bisect_right(expected, probe)
+        start = rng.randrange(len(expected) + 2)
+        assert index[start : start + 17] == expected[start : start + 17]
+
+    assert list(index) == expected
+    assert [index[i] for i in range(len(expected))] == expected
+
+
+def test_bisect_by_key():
+    index = SortedIndex([(i // 3, i) for i in range(60)])
+    assert index.bisect_left(4, key=lambda e: e[0]) == 12
+    assert index.bisect_right(4, key=lambda e: e[0]) == 15
+    assert index[12:15] == [(4, 12), (4, 13), (4, 14)]
+
+
+def test_remove_missing_entry():
+    index = SortedIndex([1, 2, 3])
+    assert 2 in index and 4 not in index and 0 not in index
+    with pytest.raises(ValueError):
+        index.remove(4)
+    with pytest.raises(ValueError):
+        index.remove(0)
+    assert list(index) == [1, 2, 3]
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+from sync_app import query_planner
+from sync_app.sqlite_store import SqliteStore
+from sync_app.parsers.python_filter import PythonFilter
+from sync_app.scim.user import User, Email
+from sync_app.scim.group import Group
+from sync_app.scim.resource import ResourceMeta
+from sync_app.store import RangeBound
+from sync_app.handlers.common import sort_records
+from sync_app import exceptions
+from tests.factories import make_user
+from datetime import datetime
+import pytest
+import uuid
+
+
+def numbered_user(i: int, id=None) -> User:
+    return make_user(
+        f"user{i}",
+        id,
+        displayName=f"User {i % 3}" if i % 5 else None,
+        active=i % 2 == 0,
+        emails=[
+            Email(value=f"user{i}@corp.example", type="work"),
+            Email(value=f"shared{i % 4}@home.example", type="home"),
+        ][: i % 3],
+        externalId=f"ext-{i % 10}" if i % 7 else None,
+        created=datetime(2024, 2, i % 28 + 1, 12),
+        lastModified=datetime(2024, 3, i % 28 + 1, 12),
+    )
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "store.sqlite3")
+
+
+@pytest.fixture
+def user_store(path):
+    store = SqliteStore(User, path)
+    for i in range(40):
+        store.create(numbered_user(i))
+    yield store
+    store.close()
+
+
+def ids(records):
+    return sorted(str(r.id) for r in records)
+
+
+def scan(store, filter):
+    predicate = PythonFilter.parse_filter_to_predicate(filter)
+    return ids(u for u in store.get_all() if predicate(u.to_dict()))
+
+
+def test_records_survive_reopening(path):
+    store = SqliteStore(User, path)
+    user = numbered_user(1)
+    store.create(user)
+    store.close()
+
+    reopened = SqliteStore(User, path)
+    assert reopened.get_by_id(user.id).to_dict() == user.to_dict()
+    assert reopened.lookup("userName", "user1")[0].id == user.id
+
+
+def test_create_rejects_duplicate_id_and_username(user_store):
+    user = user_store.get_all()[0]
+    with pytest.raises(exceptions.ResourceConflict):
+        user_store.create(numbered_user(100, id=user.id))
+    with pytest.raises(exceptions.ResourceConflict, match="userName"):
+        user_store.create(numbered_user(0))
+    assert len(user_store.get_all()) == 40
+
+
+def test_create_many_reports_conflicts(user_store):
+    errors = user_store.create_many(
+        [numbered_user(100), numbered_user(0), numbered_user(100)]
+    )
+    assert errors[0] is None
+    assert isinstance(errors[1], exceptions.ResourceConflict)
+    assert isinstance(errors[2], exceptions.ResourceConflict)
+    assert len(user_store.lookup("userName", "user100")) == 1
+
+
+def test_update_and_delete(user_store):
+    user = user_store.lookup("userName", "user1")[0]
+    updated = numbered_user(1, id=user.id)
+    updated.userName = "renamed"
+    updated.externalId = "moved"
+    user_store.update(updated)
+
+    assert user_store.lookup("userName", "user1") == []
+    assert ids(user_store.lookup("externalId", "moved")) == [str(user.id)]
+    with pytest.raises(exceptions.ResourceConflict):
+        updated.userName = "user2"
+        user_store.update(updated)
+
+    user_store.delete_by_id(user.id)
+    assert user_store.lookup("externalId", "moved") == []
+    with pytest.raises(exceptions.ResourceMissing):
+        user_store.get_by_id(user.id)
+    with pytest.raises(exceptions.ResourceMissing):
+        user_store.delete_by_id(user.id)
+    with pytest.raises(exceptions.ResourceMissing):
+        user_store.update(updated)
+
+
+def test_get_page_keeps_insertion_order(user_store):
+    total, page = user_store.get_page(11, 5)
+    assert total == 40
+    assert [u.userName for u in page] == [f"user{i}" for i in range(10, 15)]
+
+
+@pytest.mark.parametrize(
+    "filter, exact",
+    [
+        ('userName eq "user7"', True),
+        ('userName ne "user7"', True),
+        ('userName sw "user1"', True),
+        ('userName sw "user"', True),
+        ('userName sw "us\U0010ffff"', True),
+        ('userName ew "9"', True),
+        ('userName co "er3"', True),
+        ('userName co ""', True),
+        ('userName gt "user35"', True),
+        ('displayName eq "User 1"', True),
+        ("displayName eq null", True),
+        ("displayName ne null", True),
+        ("displayName pr", True),
+        ('not (displayName eq "User 1")', True),
+        ('externalId eq "ext-3"', True),
+        ('externalId ne "ext-3"', True),
+        ("externalId eq null", True),
+        ('emails.value eq "shared1@home.example"', True),
+        ('emails.value ne "shared1@home.example"', True),
+        ('emails.value sw "user1"', True),
+        ('not (emails.value ew "home.example")', True),
+        ('userName eq "user1" or externalId eq "ext-2"', True),
+        ('meta.lastModified gt "2024-03-20T12:00:00Z"', True),
+        ('meta.created le "2024-02-03T13:00:00+01:00"', True),
+        ('meta.created ne "2024-02-03T12:00:00Z"', True),
+        ('active eq true and externalId eq "ext-4"', False),
+        ('emails[type eq "home" and value eq "shared2@home.example"]', False),
+        ('not (active eq true) and userName sw "user2"', False),
+    ],
+)
+def test_filters_run_in_sqlite(user_store, filter, exact):
+    plan = query_planner.plan_query(user_store, filter)
+    assert plan.strategy == "query"
+    assert (plan.residual is None) == exact
+    assert ids(plan.execute()) == scan(user_store, filter)
+
+
+@pytest.mark.parametrize(
+    "filter",
+    [
+        "active eq true",
+        'userName eq "user1" or active eq false',
+        'not (active eq true and userName sw "user2")',
+        "emails.value pr",
+    ],
+)
+def test_untranslatable_filters_scan(user_store, filter):
+    plan = query_planner.plan_query(user_store, filter)
+    assert plan.strategy == "scan"
+    assert ids(plan.execute()) == scan(user_store, filter)
+
+
+def test_invalid_datetime_filter_is_reported(user_store):
+    with pytest.raises(exceptions.InvalidSCIMFilter):
+        query_planner.filter_records(user_store, 'meta.created gt "yesterday"')
+
+
+def test_range_lookup(user_store):
+    records = user_store.range_lookup(
+        "meta.created",
+        RangeBound(datetime(2024, 2, 3, 12), True),
+        RangeBound(datetime(2024, 2, 5, 12), False),
+    )
+    days = [u.meta.created for u in records]
+    assert days == sorted(days) and len(days) == 4
+    assert user_store.range_lookup("active") is None
+
+
+@pytest.mark.parametrize("attribute", ["userName", "displayName", "meta.created"])
+@pytest.mark.parametrize("ascending", [True, False])
+def test_sorted_page_matches_sorting_every_record(user_store, attribute, ascending):
+    expected = sort_records(user_store.get_all(), attribute, ascending)
+    for start in [1, 7, 25, 39]:
+        total, page = user_store.get_sorted_page(attribute, ascending, start, 10)
+        assert total == 40
+        assert [u.id for u in page] == [u.id for u in expected[start - 1 : start + 9]]
+    assert user_store.get_sorted_page("active", True, 1, 10) is None
+
+
+def test_groups_only_require_unique_ids(path):
+    store = SqliteStore(Group, path)
+    meta = ResourceMeta("Group", datetime.now(), datetime.now(), "http://example.com")
+    store.create(Group(meta, uuid.uuid1(), "team"))
+    store.create(Group(meta, uuid.uuid1(), "team"))
+    assert len(query_planner.filter_records(store, 'displayName eq "team"')) == 2